@@ -0,0 +1,479 @@
+import atexit
+import datetime
+import json
+import math
+import os
+
+from date_index import date_ordinal, file_identity
+from locking import atomic_write, work_log_lock
+from tombstones import tombstones_size
+
+
+# The rollups are kept in a sidecar file next to the work log, e.g.
+# work_log.txt -> work_log.txt.rollup
+ROLLUP_SUFFIX = '.rollup'
+
+# How many logs can be added or deleted while the rollups are kept in
+# memory before they're saved again (they're also saved when the program
+# exits, see save_rollups()).
+SAVE_EVERY = 1000
+
+# The date buckets logs can be grouped by (None puts every log in one
+# bucket), and the groupings kept as incremental rollups: every bucket, with
+# and without the task name.
+BUCKETS = (None, 'day', 'week', 'month')
+GROUPINGS = tuple(
+    (bucket, by_task) for bucket in BUCKETS for by_task in (False, True)
+    if bucket is not None or by_task
+)
+
+
+def bucket_key(date, bucket):
+    '''
+    Returns the key of the date bucket a log's date falls in
+
+    Keys sort chronologically: 'YYYY-MM-DD' for days, 'YYYY-Www' (ISO weeks)
+    for weeks and 'YYYY-MM' for months. Dates that can't be parsed go in an
+    'invalid date' bucket.
+
+    Arguments: String (Date, DD/MM/YYYY), String (Bucket -- 'day', 'week'
+    or 'month')
+    Returns: String (Bucket key)
+    '''
+    ordinal = date_ordinal(date)
+    if not ordinal:
+        return 'invalid date'
+    day = datetime.date.fromordinal(ordinal)
+    if bucket == 'day':
+        return day.isoformat()
+    if bucket == 'week':
+        year, week, _ = day.isocalendar()
+        return '{:04d}-W{:02d}'.format(year, week)
+    if bucket == 'month':
+        return '{:04d}-{:02d}'.format(day.year, day.month)
+    raise ValueError('Unknown date bucket {!r}'.format(bucket))
+
+
+def minutes(log):
+    '''Returns a log's time_spent as an integer, or None if it isn't one'''
+    try:
+        return int(log['time_spent'])
+    except (TypeError, ValueError):
+        return None
+
+
+class Stats():
+    '''
+    Summary statistics of the time_spent of a group of logs
+
+    Rather than every value, a histogram of how many logs took each number
+    of minutes is kept. That is enough for exact counts, sums, minimums,
+    maximums and percentiles, stays small (logs take a limited number of
+    distinct durations) and, unlike a running minimum, can have a value
+    taken away again when a log is deleted.
+    '''
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram if histogram is not None else {}
+        self.count = sum(self.histogram.values())
+        self.total = sum(
+            value * count for value, count in self.histogram.items()
+        )
+
+    def add(self, value):
+        '''Counts a log that took value minutes'''
+        self.histogram[value] = self.histogram.get(value, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def remove(self, value):
+        '''Stops counting a log that took value minutes'''
+        if not self.histogram.get(value):
+            return
+        self.histogram[value] -= 1
+        if not self.histogram[value]:
+            del self.histogram[value]
+        self.count -= 1
+        self.total -= value
+
+    @property
+    def minimum(self):
+        return min(self.histogram) if self.histogram else None
+
+    @property
+    def maximum(self):
+        return max(self.histogram) if self.histogram else None
+
+    def percentile(self, percent):
+        '''
+        Returns the nearest-rank percentile of the values (e.g. 50 for the
+        median), or None if there are none
+        '''
+        if not self.count:
+            return None
+        rank = max(math.ceil(percent / 100 * self.count), 1)
+        seen = 0
+        for value in sorted(self.histogram):
+            seen += self.histogram[value]
+            if seen >= rank:
+                return value
+
+    def to_json(self):
+        return {str(value): count for value, count in self.histogram.items()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({int(value): count for value, count in data.items()})
+
+
+def group_key(log, bucket=None, by_task=False):
+    '''Returns the key of the group a log is counted in'''
+    key = ()
+    if bucket is not None:
+        key += (bucket_key(log['date'], bucket),)
+    if by_task:
+        key += (log['task_name'],)
+    return key
+
+
+def aggregate(logs, bucket=None, by_task=False):
+    '''
+    Sums up the time_spent of logs, grouped by date bucket and/or task name
+
+    The logs are read in a single pass, so they can come straight from
+    iter_logs(); only one Stats per group is held in memory. Logs whose
+    time_spent isn't a whole number are left out.
+
+    Arguments: Iterable of Dictionaries (Logs), String or None (Date bucket
+    -- see bucket_key()), Boolean (Whether to group by task name too)
+    Returns: Dictionary (Group key Tuple -> Stats)
+    '''
+    groups = {}
+    for log in logs:
+        value = minutes(log)
+        if value is None:
+            continue
+        key = group_key(log, bucket, by_task)
+        stats = groups.get(key)
+        if stats is None:
+            stats = groups[key] = Stats()
+        stats.add(value)
+    return groups
+
+
+class Rollups():
+    '''
+    Incrementally maintained aggregates of the work log, for every grouping
+    in GROUPINGS
+
+    The rollups are updated as logs are added (see record_rollup_append())
+    and deleted (see record_rollup_delete()), so reports don't have to scan
+    the work log. Like the date index, they are stamped with the work log's
+    size and mtime (and the size of its tombstone file), and can catch up
+    with logs appended by other means (e.g. ingest.py) by reading just the
+    new ones.
+
+    Once loaded, the rollups are kept in memory (see _find()), and are only
+    saved again after SAVE_EVERY changes, or when the program exits, so
+    adding or deleting a log doesn't rewrite the whole sidecar file.
+    '''
+
+    def __init__(self, groups=None, size=0, mtime=0, dead=0):
+        self.groups = groups if groups is not None else {
+            grouping: {} for grouping in GROUPINGS
+        }
+        self.size = size
+        self.mtime = mtime
+        self.dead = dead
+        # How many changes haven't been saved yet.
+        self.unsaved = 0
+
+    def add(self, log):
+        '''Counts a log in every grouping'''
+        value = minutes(log)
+        if value is None:
+            return
+        for (bucket, by_task), groups in self.groups.items():
+            key = group_key(log, bucket, by_task)
+            stats = groups.get(key)
+            if stats is None:
+                stats = groups[key] = Stats()
+            stats.add(value)
+
+    def remove(self, log):
+        '''Stops counting a log in every grouping'''
+        value = minutes(log)
+        if value is None:
+            return
+        for (bucket, by_task), groups in self.groups.items():
+            key = group_key(log, bucket, by_task)
+            stats = groups.get(key)
+            if stats is not None:
+                stats.remove(value)
+                if not stats.count:
+                    del groups[key]
+
+    @classmethod
+    def build(cls, path='work_log.txt'):
+        '''Builds the rollups with a single pass over the work log'''
+        size, mtime = file_identity(path)
+        rollups = cls(size=size, mtime=mtime, dead=tombstones_size(path))
+        rollups.catch_up(path, 0)
+        return rollups
+
+    def catch_up(self, path='work_log.txt', start_offset=None):
+        '''
+        Counts the logs between a byte offset of the work log and the size
+        the rollups are stamped with (logs appended while reading are left
+        for next time)
+        '''
+        # Imported here as csv_functions imports this module.
+        from csv_functions import iter_log_records
+
+        for record_id, log in iter_log_records(path, start_offset or None):
+            if record_id < self.size:
+                self.add(log)
+
+    @classmethod
+    def load(cls, path='work_log.txt', identity=None, allow_growth=False,
+             dead=None):
+        '''
+        Reads the rollups for a work log
+
+        As with DateIndex.load(), the rollups are only returned if they were
+        written for a file with the given (size, mtime) identity -- or, with
+        allow_growth, a smaller one -- and for a tombstone file of the given
+        size (by default, the current ones).
+        '''
+        if dead is None:
+            dead = tombstones_size(path)
+        if identity is None:
+            try:
+                identity = file_identity(path)
+            except FileNotFoundError:
+                return None
+        try:
+            with open(path + ROLLUP_SUFFIX) as rollup_file:
+                data = json.load(rollup_file)
+            size, mtime = data['size'], data['mtime']
+            if (size, mtime) != identity and not (
+                    allow_growth and size < identity[0]):
+                return None
+            if data['dead'] != dead:
+                return None
+            groups = {}
+            for grouping in data['groups']:
+                groups[(grouping['bucket'], grouping['by_task'])] = {
+                    tuple(key): Stats.from_json(histogram)
+                    for key, histogram in grouping['stats']
+                }
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if set(groups) != set(GROUPINGS):
+            return None
+        return cls(groups, size, mtime, dead)
+
+    def save(self, path='work_log.txt'):
+        '''Writes the rollups to their sidecar file (atomically)'''
+        with atomic_write(path + ROLLUP_SUFFIX, 'w') as rollup_file:
+            json.dump({
+                'size': self.size,
+                'mtime': self.mtime,
+                'dead': self.dead,
+                'groups': [
+                    {
+                        'bucket': bucket,
+                        'by_task': by_task,
+                        'stats': [
+                            [list(key), stats.to_json()]
+                            for key, stats in groups.items()
+                        ]
+                    }
+                    for (bucket, by_task), groups in self.groups.items()
+                ]
+            }, rollup_file)
+
+
+# The rollups kept in memory by this process, by work log path, along with
+# the inode of the work log they describe. Like the rollups on disk, they
+# are only used or changed holding the work log's lock.
+_rollups = {}
+
+
+def _inode(path):
+    '''Returns the inode of a work log'''
+    return os.stat(path).st_ino
+
+
+def _find(path='work_log.txt', identity=None, allow_growth=False,
+          dead=None):
+    '''
+    Returns the rollups for a work log kept in memory, if they are stamped
+    as Rollups.load() requires (and are of the same file, not one it was
+    rewritten to), or else the saved ones (or None)
+    '''
+    if dead is None:
+        dead = tombstones_size(path)
+    if identity is None:
+        try:
+            identity = file_identity(path)
+        except FileNotFoundError:
+            return None
+    inode, rollups = _rollups.get(os.path.abspath(path), (None, None))
+    if rollups is not None and inode == _inode(path) and (
+            rollups.dead == dead) and (
+            (rollups.size, rollups.mtime) == identity or
+            allow_growth and rollups.size < identity[0]):
+        return rollups
+    return Rollups.load(path, identity, allow_growth, dead)
+
+
+def _keep(rollups, path='work_log.txt'):
+    '''
+    Keeps rollups in memory, saving them if enough changes have built up
+    '''
+    _rollups[os.path.abspath(path)] = (_inode(path), rollups)
+    if rollups.unsaved >= SAVE_EVERY:
+        try:
+            rollups.save(path)
+        except OSError:
+            return
+        rollups.unsaved = 0
+
+
+def save_rollups():
+    '''
+    Saves the rollups kept in memory that have changed since they were
+    last saved (called when the program exits)
+    '''
+    for key, (inode, rollups) in list(_rollups.items()):
+        if not rollups.unsaved:
+            continue
+        try:
+            with work_log_lock(key):
+                # Rollups of a work log that has since been rewritten (or
+                # changed by another process) are of no more use.
+                if _find(key) is rollups:
+                    rollups.save(key)
+                    rollups.unsaved = 0
+        except OSError:
+            pass
+
+
+atexit.register(save_rollups)
+
+
+def get_rollups(path='work_log.txt'):
+    '''
+    Returns up to date Rollups for the work log
+
+    Uses the rollups kept in memory, or the saved ones, and if logs have
+    been appended since, counts just those in. Only when there are no
+    usable rollups is the whole work log read. Either way, up to date
+    rollups are saved for next time.
+
+    The caller should hold the work log's lock (at least a shared one)
+    while using the rollups returned, as other threads may change them.
+    '''
+    # Writers are kept out while the rollups catch up, so the work log, its
+    # tombstones and the rollups all describe the same logs.
+    with work_log_lock(path, shared=True):
+        identity = file_identity(path)
+        rollups = _find(path, identity, allow_growth=True)
+        if rollups is None:
+            rollups = Rollups.build(path)
+            rollups.unsaved = SAVE_EVERY
+        elif (rollups.size, rollups.mtime) != identity:
+            start_offset = rollups.size
+            rollups.size, rollups.mtime = identity
+            rollups.catch_up(path, start_offset)
+            rollups.unsaved = SAVE_EVERY
+        _keep(rollups, path)
+        return rollups
+
+
+def report(bucket=None, by_task=False, path='work_log.txt'):
+    '''
+    Returns the totals of one grouping of the work log, in order
+
+    Arguments: String or None (Date bucket -- see bucket_key()), Boolean
+    (Whether to group by task name too), String (Path to the work log)
+    Returns: List of Tuples (Group key Tuple, Stats), sorted by key
+    '''
+    if (bucket, by_task) not in GROUPINGS:
+        raise ValueError('Unknown grouping {!r}'.format((bucket, by_task)))
+    # The Stats are copied, as the rollups kept in memory go on changing.
+    with work_log_lock(path, shared=True):
+        return sorted(
+            (key, Stats(dict(stats.histogram)))
+            for key, stats in
+            get_rollups(path).groups[(bucket, by_task)].items()
+        )
+
+
+def format_report(rows):
+    '''
+    Lays out a report as a table of text lines
+
+    Argument: List of Tuples (Group key Tuple, Stats -- see report())
+    Returns: List of Strings (Lines of the table)
+    '''
+    header = ('Group', 'Logs', 'Total', 'Min', 'Max', 'Median', '90th')
+    table = [header] + [
+        (
+            ' / '.join(
+                str(part) if part is not None else '-' for part in key
+            ) or 'All logs',
+            str(stats.count),
+            str(stats.total),
+            str(stats.minimum),
+            str(stats.maximum),
+            str(stats.percentile(50)),
+            str(stats.percentile(90))
+        )
+        for key, stats in rows
+    ]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    return [
+        '  '.join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in table
+    ]
+
+
+def record_rollup_append(log, previous_identity, path='work_log.txt'):
+    '''
+    Updates the rollups after a log has been appended to the work log
+
+    As with date_index.record_append(), rollups that were stale before the
+    append are left to catch up the next time a report is run.
+
+    Arguments: Dictionary (The new log), Tuple (size, mtime of the work log
+    before the append), String (Path to the work log)
+    '''
+    rollups = _find(path, previous_identity)
+    if rollups is None:
+        return
+    rollups.add(log)
+    rollups.size, rollups.mtime = file_identity(path)
+    rollups.unsaved += 1
+    _keep(rollups, path)
+
+
+def record_rollup_delete(log, previous_dead, path='work_log.txt'):
+    '''
+    Updates the rollups after a log has been deleted (tombstoned)
+
+    Arguments: Dictionary (The deleted log), Integer (Size of the tombstone
+    file before the delete -- see tombstones_size()), String (Path to the
+    work log)
+    '''
+    rollups = _find(path, dead=previous_dead)
+    if rollups is None:
+        return
+    rollups.remove(log)
+    rollups.dead = tombstones_size(path)
+    rollups.unsaved += 1
+    _keep(rollups, path)
@@ -0,0 +1,178 @@
+'''
+Searches that run in the background while the terminal stays responsive
+
+run_search() runs a search on an asyncio event loop: the search itself
+(loading and parsing the logs, then filtering them) runs in a worker
+thread, while the loop shows a live count of the matches found so far and
+watches for keypresses. The user can start paging through the matches
+found so far (with Enter) while the rest are still being looked for, or
+cancel the search (with C, Q or Esc).
+
+Keypresses are read without waiting for Enter using termios (or msvcrt on
+Windows). When the program isn't run at a terminal, searches simply run in
+the foreground (see interactive()).
+'''
+import asyncio
+import os
+import sys
+import threading
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+# How often (in seconds) the count of matches is redrawn and keypresses
+# are checked for.
+REFRESH_INTERVAL = 0.05
+
+CANCEL_KEYS = ('c', 'C', 'q', 'Q', '\x1b')
+VIEW_KEYS = ('\r', '\n', ' ')
+
+
+def interactive():
+    '''Checks whether the program is being used at a terminal'''
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
+
+class _Keys():
+    '''
+    Collects keypresses while a search runs, with the terminal put in cbreak
+    mode (so keys are read as they're pressed, and not echoed) if need be
+    '''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pressed = []
+        self._saved = None
+
+    def __enter__(self):
+        if termios is not None and sys.stdin.isatty():
+            descriptor = sys.stdin.fileno()
+            self._saved = termios.tcgetattr(descriptor)
+            tty.setcbreak(descriptor)
+            self.loop.add_reader(descriptor, self._read, descriptor)
+        return self
+
+    def __exit__(self, *exception):
+        if self._saved is not None:
+            descriptor = sys.stdin.fileno()
+            self.loop.remove_reader(descriptor)
+            termios.tcsetattr(descriptor, termios.TCSADRAIN, self._saved)
+
+    def _read(self, descriptor):
+        self.pressed.extend(os.read(descriptor, 32).decode('utf-8', 'ignore'))
+
+    def take(self):
+        '''Returns the keys pressed since the last call'''
+        if msvcrt is not None:
+            while msvcrt.kbhit():
+                self.pressed.append(msvcrt.getwch())
+        pressed, self.pressed = self.pressed, []
+        return pressed
+
+
+def _in_thread(loop, function, *args):
+    '''
+    Runs a function in a new daemon thread, returning an asyncio future of
+    its result
+
+    The loop's default executor isn't used, as a search the user has
+    cancelled may still be running (e.g. stuck on a slow regex): its thread
+    is simply abandoned, and mustn't stop the program from exiting.
+    '''
+    future = loop.create_future()
+
+    def finish(result, error):
+        if not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def run():
+        try:
+            result, error = function(*args), None
+        except BaseException as exception:
+            result, error = None, exception
+        try:
+            loop.call_soon_threadsafe(finish, result, error)
+        except RuntimeError:
+            # The loop has finished (the search was cancelled).
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _status(text):
+    '''Shows a line of status text, in place of the last'''
+    sys.stdout.write('\r{:<79}'.format(text))
+    sys.stdout.flush()
+
+
+async def _run_search(cancel, find, args):
+    '''Runs a search, returning a ResultCursor (see run_search())'''
+    # Imported here as search imports this module.
+    from search import ResultCursor
+
+    loop = asyncio.get_running_loop()
+    with _Keys(loop) as keys:
+        try:
+            # Starting the search loads the logs, and for some searches
+            # (e.g. parallel scans) finds every match, so it runs in a
+            # worker thread too.
+            matches = _in_thread(loop, find, *args)
+            while not matches.done():
+                _status('Searching... ([C] to cancel)')
+                await asyncio.wait([matches], timeout=REFRESH_INTERVAL)
+                if any(key in CANCEL_KEYS for key in keys.take()):
+                    cancel()
+                    results = ResultCursor([])
+                    results.cancel()
+                    return results
+
+            results = ResultCursor(matches.result())
+            results.count_in_background()
+            while results.searching:
+                _status(
+                    'Searching... {} found so far '
+                    '([Enter] to view them, [C] to cancel)'.format(
+                        results.count()
+                    )
+                )
+                await asyncio.sleep(REFRESH_INTERVAL)
+                pressed = keys.take()
+                if any(key in CANCEL_KEYS for key in pressed):
+                    results.cancel()
+                    cancel()
+                    break
+                if any(key in VIEW_KEYS for key in pressed) and (
+                        results.count()):
+                    break
+            return results
+        finally:
+            _status('')
+            sys.stdout.write('\r')
+
+
+def run_search(cancel, find, *args):
+    '''
+    Runs a search in the background, showing a live count of its matches,
+    until it finishes or the user chooses to view the matches found so far
+    (the rest are then found while they page) or cancels it
+
+    Arguments: Function (Called to stop the search if it's cancelled, e.g.
+    LogSearch.cancel()), Function (The search, e.g. LogSearch.find_by_date)
+    and its arguments
+    Returns: ResultCursor (Of the search's matches, whose cancelled
+    attribute is True if the search was cancelled)
+    Raises: Whatever the search raises (e.g. parallel_scan.ScanTimeout)
+    '''
+    return asyncio.run(_run_search(cancel, find, args))
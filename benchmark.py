@@ -0,0 +1,463 @@
+'''
+Benchmarks of the work log's hot paths
+
+For each size of work log, a synthetic work_log.txt is generated (see
+synthetic_logs.py) in a scratch directory, and each case below is run in a
+fresh process, so every case starts without cached logs and its peak
+resident memory can be measured along with its wall time. The interactive
+searches are driven with scripted answers in place of input().
+
+The startup cases instead launch work_logs.py itself, as a user would, and
+time how long it takes to show the main menu and then the first result of
+a search for a word (with the answers typed straight away, so the logs
+loaded in the background at startup are waited for). startup_cold starts
+without the saved snapshot of the logs (see log_cache.py), startup with it.
+
+The results are written as JSON. Passing an earlier results file with
+--compare prints how much faster or slower each case has become. Other
+storage backends can be benchmarked with --backend; their work log is made
+from the synthetic work_log.txt before the first case is timed.
+
+Usage: python benchmark.py [--sizes 10k 100k 1M] [--cases CASE ...]
+       [--repeat N] [--writers N] [--backend BACKEND] [--output FILE]
+       [--compare OLD_FILE]
+'''
+import argparse
+import builtins
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import csv_functions
+from csv_functions import (clear_all_logs, discard_sidecars, fetch_logs,
+                           initialize_work_log)
+from log import Log
+from search import Search
+from storage import get_storage
+from synthetic_logs import SIZES, START_DATE, write_work_log
+
+
+# The cases benchmarked, in the order they are run. Cases that change the
+# work log come last.
+CASES = (
+    'startup_cold',
+    'startup',
+    'fetch_logs',
+    'search_init_cold',
+    'search_init',
+    'search_by_date',
+    'search_by_date_range',
+    'search_by_time_spent',
+    'search_by_string',
+    'search_by_pattern',
+    'add_log',
+    'concurrent_add_log',
+    'delete_log',
+    'clear_all_logs'
+)
+
+DEFAULT_SIZES = ('10k', '100k', '1M')
+
+# How many logs the add_log and delete_log cases add or delete, and how
+# many processes add logs at once in the concurrent_add_log case.
+OPERATIONS = 100
+WRITERS = 4
+
+# The answers given to each interactive search's prompts.
+_RANGE_END = START_DATE + datetime.timedelta(days=90)
+SEARCH_ANSWERS = {
+    'search_by_date': ['1'],
+    'search_by_date_range': [
+        START_DATE.strftime('%d/%m/%Y'), _RANGE_END.strftime('%d/%m/%Y')
+    ],
+    'search_by_time_spent': ['30'],
+    'search_by_string': ['deploy'],
+    'search_by_pattern': [r'sprint\s+retro']
+}
+
+
+# The answers typed into work_logs.py by the startup cases: past the
+# greeting, then Search Logs, Search by Word or Phrase and the word. What
+# the program prints once it shows the main menu, and once it shows the
+# first result (or that there are none).
+STARTUP_ANSWERS = ['', '2', '4', 'deploy']
+FIRST_MENU = b'Choose an option (1-5)'
+FIRST_RESULT = (b'Displaying result 1 of', b'no results matched')
+
+PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'work_logs.py')
+
+
+def _peak_rss_kb():
+    '''Returns the peak resident memory of this process so far, in KB'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and KB elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _script_input(answers):
+    '''Replaces input() with one that gives the answers in turn'''
+    answers = iter(answers)
+    builtins.input = lambda prompt='': next(answers)
+
+
+def _run(case):
+    '''
+    Runs one case in the current directory, returning how many operations
+    (e.g. search results) it did
+    '''
+    if case == 'fetch_logs':
+        return len(fetch_logs())
+
+    if case in ('search_init_cold', 'search_init'):
+        return len(Search().logs)
+
+    if case in SEARCH_ANSWERS:
+        search = Search()
+        _script_input(SEARCH_ANSWERS[case])
+        getattr(search, case)()
+        # Page all the way to the end, so every result is found.
+        last = search.search_results.last_index()
+        return 0 if last is None else last + 1
+
+    if case == 'add_log':
+        for number in range(OPERATIONS):
+            Log(
+                date=START_DATE.strftime('%d/%m/%Y'),
+                task_name='Benchmark task {}'.format(number),
+                time_spent='30',
+                note='Added by the benchmark'
+            ).add_log()
+        return OPERATIONS
+
+    if case == 'clear_all_logs':
+        _script_input(['clear', ''])
+        clear_all_logs()
+        return 1
+
+    raise ValueError('Unknown case {!r}'.format(case))
+
+
+def run_case(case, directory, backend='csv'):
+    '''
+    Times one case against the work log in a directory
+
+    Meant to be run in a fresh process (see benchmark()), as it changes the
+    working directory and the peak memory measured is the process's.
+
+    Arguments: String (Name of the case), String (Directory holding the
+    work_log.txt to use), String (Storage backend to use)
+    Returns: Dictionary (seconds, operations, baseline and peak RSS in KB)
+    '''
+    os.chdir(directory)
+    csv_functions.backend = backend
+    # The searches clear the screen and print as they go; keep that out of
+    # the benchmark's output (the results come back through a pipe).
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+    if backend != 'csv':
+        # Makes the backend's work log from work_log.txt the first time.
+        initialize_work_log(backend)
+    if case == 'search_init_cold':
+        discard_sidecars(csv_functions.work_log_path())
+    setup = None
+    if case == 'delete_log':
+        # Finding the logs to delete isn't part of what's timed. They are
+        # deleted by identity, as the detail view deletes them.
+        search = Search()
+        setup = [
+            Log(
+                record_id=log.record_id, generation=search.generation,
+                **log.as_dict()
+            )
+            for _, log in zip(
+                range(OPERATIONS), search.find_by_time_spent(30)
+            )
+        ]
+
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    if setup is None:
+        operations = _run(case)
+    else:
+        for log in setup:
+            log.delete_log()
+        operations = len(setup)
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': seconds,
+        'operations': operations,
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': _peak_rss_kb()
+    }
+
+
+def run_startup(directory, backend='csv', cold=False):
+    '''
+    Times how long work_logs.py takes to show its main menu, and the first
+    result of a search, when launched in a directory
+
+    Arguments: String (Directory holding work_log.txt), String (Storage
+    backend), Boolean (Whether to remove the sidecar files first, including
+    the saved snapshot of the logs)
+    Returns: Dictionary (seconds to the first result, seconds to the first
+    menu and the program's peak RSS in KB)
+    '''
+    if cold:
+        discard_sidecars(
+            os.path.join(directory, csv_functions.BACKEND_FILES[backend])
+        )
+    environment = dict(
+        os.environ, WORK_LOG_BACKEND=backend, PYTHONUNBUFFERED='1'
+    )
+    start = time.perf_counter()
+    program = subprocess.Popen(
+        [sys.executable, PROGRAM], cwd=directory, env=environment,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    program.stdin.write(
+        ''.join(answer + '\n' for answer in STARTUP_ANSWERS).encode()
+    )
+    program.stdin.flush()
+
+    output = b''
+    first_menu = first_result = None
+    while first_result is None:
+        data = os.read(program.stdout.fileno(), 65536)
+        if not data:
+            raise RuntimeError('work_logs.py exited before showing a result')
+        output += data
+        if first_menu is None and FIRST_MENU in output:
+            first_menu = time.perf_counter() - start
+        if any(marker in output for marker in FIRST_RESULT):
+            first_result = time.perf_counter() - start
+
+    program.kill()
+    _, _, usage = os.wait4(program.pid, 0)
+    # ru_maxrss is in bytes on macOS, and KB elsewhere.
+    peak = usage.ru_maxrss
+    return {
+        'seconds': first_result,
+        'first_menu_seconds': first_menu,
+        'operations': 1,
+        'baseline_rss_kb': 0,
+        'peak_rss_kb': peak // 1024 if sys.platform == 'darwin' else peak
+    }
+
+
+def _count_logs(directory, backend):
+    '''Returns the number of live logs in a directory's work log'''
+    storage = get_storage(backend)
+    storage.path = os.path.join(directory, storage.path)
+    return sum(1 for _ in storage.iter_records())
+
+
+def run_concurrent_writers(directory, context, writers=WRITERS,
+                           backend='csv'):
+    '''
+    Times several processes adding logs to the same work log at once
+
+    Each writer adds OPERATIONS logs (see run_case()), so the throughput is
+    for the writers as a whole. Afterwards the work log is checked to make
+    sure no log was lost or mangled by the concurrent appends.
+
+    Arguments: String (Directory holding work_log.txt), multiprocessing
+    context, Integer (Number of writer processes), String (Storage backend)
+    Returns: Dictionary (seconds, operations, logs lost, throughput and the
+    largest peak RSS of the writers in KB)
+    '''
+    before = _count_logs(directory, backend)
+    with concurrent.futures.ProcessPoolExecutor(
+            writers, mp_context=context) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(
+            run_case, ['add_log'] * writers, [directory] * writers,
+            [backend] * writers
+        ))
+        seconds = time.perf_counter() - start
+    operations = sum(result['operations'] for result in results)
+    return {
+        'seconds': seconds,
+        'operations': operations,
+        'writers': writers,
+        'lost': before + operations - _count_logs(directory, backend),
+        'operations_per_second': operations / seconds,
+        'baseline_rss_kb': max(r['baseline_rss_kb'] for r in results),
+        'peak_rss_kb': max(r['peak_rss_kb'] for r in results)
+    }
+
+
+def benchmark(sizes, cases=CASES, repeat=1, writers=WRITERS,
+              report=sys.stderr, backend='csv'):
+    '''
+    Runs the benchmarks
+
+    Arguments: Iterable of Strings (Size names, see synthetic_logs.SIZES),
+    Iterable of Strings (Cases to run), Integer (Times to run each case),
+    Integer (Writer processes for concurrent_add_log), File (Where to report
+    progress), String (Storage backend)
+    Returns: List of Dictionaries (One result per run of a case)
+    '''
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        rows = SIZES[size]
+        directory = tempfile.mkdtemp(prefix='work_log_benchmark_')
+        try:
+            print('Generating {} logs...'.format(rows), file=report)
+            path = os.path.join(directory, 'work_log.txt')
+            write_work_log(path, rows)
+            pristine = path + '.pristine'
+            shutil.copyfile(path, pristine)
+
+            for case in cases:
+                for run in range(repeat):
+                    if case == 'clear_all_logs' and run:
+                        # Clear a full work log every time.
+                        shutil.copyfile(pristine, path)
+                        discard_sidecars(path)
+                        if backend != 'csv':
+                            # The backend's work log is made again from it.
+                            made = csv_functions.BACKEND_FILES[backend]
+                            for name in os.listdir(directory):
+                                if name.startswith(made):
+                                    made_path = os.path.join(directory, name)
+                                    if os.path.isdir(made_path):
+                                        shutil.rmtree(made_path)
+                                    else:
+                                        os.remove(made_path)
+                    if case in ('startup_cold', 'startup'):
+                        result = run_startup(
+                            directory, backend, case == 'startup_cold'
+                        )
+                    elif case == 'concurrent_add_log':
+                        result = run_concurrent_writers(
+                            directory, context, writers, backend
+                        )
+                    else:
+                        with concurrent.futures.ProcessPoolExecutor(
+                                1, mp_context=context) as executor:
+                            result = executor.submit(
+                                run_case, case, directory, backend
+                            ).result()
+                    result.update(
+                        size=size, rows=rows, case=case, run=run,
+                        backend=backend
+                    )
+                    results.append(result)
+                    print(
+                        '{:>5} {:<22} {:9.4f}s  peak {:>8} KB'.format(
+                            size, case, result['seconds'],
+                            result['peak_rss_kb']
+                        ),
+                        file=report
+                    )
+                    if 'first_menu_seconds' in result:
+                        print(
+                            '{:>5} {:<22} {:9.4f}s'.format(
+                                '', '  (first menu)',
+                                result['first_menu_seconds']
+                            ),
+                            file=report
+                        )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def best_times(results):
+    '''Returns the fastest time of each (size, case) in a list of results'''
+    best = {}
+    for result in results:
+        key = (result['size'], result['case'])
+        best[key] = min(best.get(key, float('inf')), result['seconds'])
+    return best
+
+
+def compare(old_results, new_results, report=sys.stderr):
+    '''Prints how each case's best time has changed between two runs'''
+    old = best_times(old_results)
+    for key, seconds in sorted(best_times(new_results).items()):
+        if key not in old:
+            continue
+        ratio = seconds / old[key] if old[key] else float('inf')
+        print(
+            '{:>5} {:<22} {:9.4f}s -> {:9.4f}s  x{:.2f}{}'.format(
+                key[0], key[1], old[key], seconds, ratio,
+                '  SLOWER' if ratio > 1.1 else ''
+            ),
+            file=report
+        )
+
+
+def main(arguments=None):
+    '''Runs the benchmarks from the command line'''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the work log against synthetic work logs.'
+    )
+    parser.add_argument(
+        '--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES,
+        help='work log sizes to run (default {})'.format(
+            ' '.join(DEFAULT_SIZES)
+        )
+    )
+    parser.add_argument(
+        '--cases', nargs='+', choices=CASES, default=CASES,
+        help='cases to run (default all)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='times to run each case (default 1)'
+    )
+    parser.add_argument(
+        '--writers', type=int, default=WRITERS,
+        help='processes adding logs at once in concurrent_add_log '
+             '(default {})'.format(WRITERS)
+    )
+    parser.add_argument(
+        '--backend', choices=sorted(csv_functions.BACKEND_FILES),
+        default='csv',
+        help='work log backend to benchmark (default csv)'
+    )
+    parser.add_argument(
+        '--output', default='benchmark_results.json',
+        help='file to write the results to (default benchmark_results.json)'
+    )
+    parser.add_argument(
+        '--compare',
+        help='earlier results file to compare against'
+    )
+    options = parser.parse_args(arguments)
+
+    # Run the cases in their usual order, whatever order they were given in.
+    cases = [case for case in CASES if case in options.cases]
+    results = benchmark(
+        options.sizes, cases, max(options.repeat, 1), max(options.writers, 1),
+        backend=options.backend
+    )
+    with open(options.output, 'w') as output:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'results': results
+        }, output, indent=2)
+
+    if options.compare:
+        with open(options.compare) as old:
+            compare(json.load(old)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import csv
+import mmap
+import struct
+
+from date_index import date_ordinal
+from instrumentation import timed
+from locking import atomic_rewrite
+from log_table import INTERN_LIMIT, LogTable, _is_canonical_date
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+# File header: magic, format version, number of fields per record.
+MAGIC = b'WLOGBIN1'
+VERSION = 1
+_HEADER = struct.Struct('<8sHH')
+
+# Record header: byte length of the record's (utf-8) text, followed by the
+# lengths, in characters, of the date, task_name and time_spent fields. The
+# note is whatever text remains. Storing character lengths means a record is
+# decoded in one go and then split by slicing.
+_RECORD = struct.Struct('<IIII')
+
+
+def pack_record(log):
+    '''
+    Packs a log into a length-prefixed binary record
+
+    Argument: Dictionary (A log, with date, task_name, time_spent and note)
+    Returns: Bytes (The record)
+    '''
+    date, task_name, time_spent, note = (log[field] for field in FIELDS)
+    data = (date + task_name + time_spent + note).encode('utf-8')
+    return _RECORD.pack(
+        len(data), len(date), len(task_name), len(time_spent)
+    ) + data
+
+
+def create_binary_log(path='work_log.bin'):
+    '''
+    Creates an empty binary work log (just the header), replacing any
+    existing one with an atomic rewrite (see locking.atomic_rewrite())
+    '''
+    with atomic_rewrite(path) as work_log:
+        work_log.write(_HEADER.pack(MAGIC, VERSION, len(FIELDS)))
+
+
+def is_binary_log(path='work_log.bin'):
+    '''Returns True if the file at path starts with a valid binary header'''
+    try:
+        with open(path, 'rb') as work_log:
+            header = work_log.read(_HEADER.size)
+    except OSError:
+        return False
+    return (
+        len(header) == _HEADER.size and
+        _HEADER.unpack(header) == (MAGIC, VERSION, len(FIELDS))
+    )
+
+
+def append_binary_logs(logs, path='work_log.bin'):
+    '''Appends logs (as dictionaries) to a binary work log'''
+    with open(path, 'ab') as work_log:
+        work_log.write(b''.join(pack_record(log) for log in logs))
+
+
+def iter_binary_records(path='work_log.bin', start_offset=None):
+    '''
+    Reads a binary work log, yielding each log along with its byte offset
+
+    The file is memory mapped, and each record is located from the lengths
+    in its header, so reading never has to tokenize any text. A partially
+    written record at the end of the file (e.g. from an interrupted append)
+    is ignored.
+
+    Arguments: String (Path to the binary work log), Integer or None (Byte
+    offset of the first record to read -- None starts after the header)
+    Yields: Tuples (Byte offset of the record, Dictionary of the log)
+    '''
+    with open(path, 'rb') as work_log:
+        with mmap.mmap(work_log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if _HEADER.unpack_from(data) != (MAGIC, VERSION, len(FIELDS)):
+                raise ValueError(
+                    '{} is not a binary work log'.format(path)
+                )
+            offset = _HEADER.size if start_offset is None else start_offset
+            end = len(data)
+            unpack_from = _RECORD.unpack_from
+
+            while offset + _RECORD.size <= end:
+                size, date, task_name, time_spent = unpack_from(data, offset)
+                start = offset + _RECORD.size
+                if start + size > end:
+                    break
+                text = data[start:start + size].decode('utf-8')
+                task_end = date + task_name
+                time_end = task_end + time_spent
+                yield offset, {
+                    'date': text[:date],
+                    'task_name': text[date:task_end],
+                    'time_spent': text[task_end:time_end],
+                    'note': text[time_end:],
+                }
+                offset = start + size
+
+
+def _column_ordinal(date):
+    '''
+    Returns the ordinal a LogTable stores for an encoded date, or 0 if the
+    date has to be kept raw (see LogTable.append())
+    '''
+    date = date.decode('utf-8')
+    ordinal = date_ordinal(date)
+    return ordinal if _is_canonical_date(date) else 0
+
+
+def _column_minutes(time_spent):
+    '''
+    Returns the minutes a LogTable stores for an encoded time spent, or
+    None if the time has to be kept raw (see LogTable.append())
+    '''
+    try:
+        minutes = int(time_spent)
+    except ValueError:
+        return None
+    if (str(minutes).encode('ascii') != time_spent or
+            not -2**31 <= minutes < 2**31):
+        return None
+    return minutes
+
+
+@timed('read_binary_table')
+def read_binary_table(path='work_log.bin', start_offset=None,
+                      end_offset=None, dead=(), pool=None):
+    '''
+    Reads a binary work log straight into a LogTable (in file order)
+
+    This is what loading the logs uses (see log_cache.py), and it never
+    builds a dictionary per log: the fields of each record are sliced from
+    the memory mapped file and appended to the table's columns, with the
+    dates and times looked up in small caches (there are far fewer of them
+    than logs), task names interned, and the text of task names and notes
+    added to the string pool as it is encoded, all at once at the end.
+    Only records the table would store raw values for (e.g. a date not
+    written DD/MM/YYYY) or whose text isn't ASCII (the field lengths being
+    in characters) are decoded into a dictionary and appended as
+    iter_binary_records() would yield them.
+
+    Arguments: String (Path to the binary work log), Integers or None
+    (Byte offsets to start reading at -- None starts after the header --
+    and to stop reading at -- None reads to the end), Set (Record ids of
+    deleted logs to skip), StringPool or None (Pool the table shares)
+    Returns: LogTable (With each log's byte offset as its record id)
+    '''
+    table = LogTable(pool)
+    pool = table.pool
+    append_record_id = table.record_ids.append
+    append_date = table.dates.append
+    append_minutes = table.time_spent.append
+    append_task_name = table.task_names.append
+    append_note = table.notes.append
+    # The encoded strings waiting to be added to the pool (the first of
+    # them will have the id first), and the ids of task names seen.
+    pending = []
+    first = len(pool)
+    task_names = {}
+    ordinals = {}
+    minutes_spent = {}
+
+    with open(path, 'rb') as work_log:
+        with mmap.mmap(work_log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if _HEADER.unpack_from(data) != (MAGIC, VERSION, len(FIELDS)):
+                raise ValueError(
+                    '{} is not a binary work log'.format(path)
+                )
+            offset = _HEADER.size if start_offset is None else start_offset
+            end = len(data)
+            if end_offset is not None:
+                end = min(end, end_offset)
+            unpack_from = _RECORD.unpack_from
+
+            while offset + _RECORD.size <= end:
+                size, date, task_name, time_spent = unpack_from(data, offset)
+                start = offset + _RECORD.size
+                stop = start + size
+                if stop > end:
+                    break
+                if dead and offset in dead:
+                    offset = stop
+                    continue
+                text = data[start:stop]
+                task_end = date + task_name
+                time_end = task_end + time_spent
+
+                ordinal = minutes = None
+                if text.isascii():
+                    ordinal = ordinals.get(text[:date])
+                    if ordinal is None:
+                        ordinal = ordinals[text[:date]] = _column_ordinal(
+                            text[:date]
+                        )
+                    minutes = minutes_spent.get(
+                        text[task_end:time_end], False
+                    )
+                    if minutes is False:
+                        minutes = minutes_spent[text[task_end:time_end]] = (
+                            _column_minutes(text[task_end:time_end])
+                        )
+
+                if not ordinal or minutes is None:
+                    # The table works out what to keep raw, from the
+                    # decoded log, once the strings so far are pooled.
+                    pool.add_encoded(pending)
+                    pending = []
+                    text = text.decode('utf-8')
+                    table.append({
+                        'date': text[:date],
+                        'task_name': text[date:task_end],
+                        'time_spent': text[task_end:time_end],
+                        'note': text[time_end:],
+                    }, offset)
+                    first = len(pool)
+                    offset = stop
+                    continue
+
+                append_record_id(offset)
+                append_date(ordinal)
+                append_minutes(minutes)
+                task_name = text[date:task_end]
+                string_id = task_names.get(task_name)
+                if string_id is None:
+                    string_id = first + len(pending)
+                    pending.append(task_name)
+                    if len(task_names) < INTERN_LIMIT:
+                        task_names[task_name] = string_id
+                append_task_name(string_id)
+                append_note(first + len(pending))
+                pending.append(text[time_end:])
+                offset = stop
+
+    pool.add_encoded(pending)
+    return table
+
+
+def iter_binary_offsets(path='work_log.bin', start_offset=None):
+    '''
+    Yields the byte offset of each record of a binary work log, reading
+    only the record headers (see iter_binary_records())
+    '''
+    with open(path, 'rb') as work_log:
+        with mmap.mmap(work_log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = _HEADER.size if start_offset is None else start_offset
+            end = len(data)
+            while offset + _RECORD.size <= end:
+                size = _RECORD.unpack_from(data, offset)[0]
+                if offset + _RECORD.size + size > end:
+                    break
+                yield offset
+                offset += _RECORD.size + size
+
+
+def csv_to_binary(csv_path='work_log.txt', binary_path='work_log.bin'):
+    '''
+    Converts a csv work log into a binary work log
+
+    Arguments: Strings (Path of the csv work log to read, path of the binary
+    work log to (over)write)
+    Returns: Integer (Number of logs converted)
+    '''
+    # Imported here to avoid a circular import (csv_functions picks the
+    # backend and so imports this module).
+    from csv_functions import iter_logs
+
+    count = 0
+    with atomic_rewrite(binary_path) as work_log:
+        work_log.write(_HEADER.pack(MAGIC, VERSION, len(FIELDS)))
+        for log in iter_logs(csv_path):
+            work_log.write(pack_record(log))
+            count += 1
+    return count
+
+
+def binary_to_csv(binary_path='work_log.bin', csv_path='work_log.txt'):
+    '''
+    Converts a binary work log back into a csv work log
+
+    The csv is written the same way Log.add_log() writes rows, so converting
+    a csv log to binary and back gives the same file.
+
+    Arguments: Strings (Path of the binary work log to read, path of the
+    csv work log to (over)write)
+    Returns: Integer (Number of logs converted)
+    '''
+    count = 0
+    with atomic_rewrite(csv_path, 'w', newline='') as work_log:
+        work_log.write('date,task_name,time_spent,note\n')
+        logwriter = csv.writer(
+            work_log,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL
+        )
+        for _, log in iter_binary_records(binary_path):
+            logwriter.writerow([log[field] for field in FIELDS])
+            count += 1
+    return count
@@ -0,0 +1,15 @@
+import pytest
+
+import csv_functions
+
+
+@pytest.fixture
+def work_log(tmp_path, monkeypatch):
+    '''
+    Runs a test in an empty directory, with a new csv work log (the work
+    logs live in the current directory)
+    '''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(csv_functions, 'backend', 'csv')
+    csv_functions.initialize_work_log()
+    return tmp_path / 'work_log.txt'
@@ -1,7 +1,58 @@
 import csv
+import os
 import sys
 
-from user_navigation_functions import clear_screen
+from aggregates import ROLLUP_SUFFIX
+from binary_log import (MAGIC, create_binary_log, csv_to_binary,
+                        is_binary_log, iter_binary_offsets,
+                        iter_binary_records)
+from date_index import INDEX_SUFFIX as DATE_INDEX_SUFFIX
+from instrumentation import timed
+from locking import atomic_rewrite, recover_work_log, work_log_lock
+from text_index import INDEX_SUFFIX as TEXT_INDEX_SUFFIX
+from tombstones import TOMBSTONE_SUFFIX, compact_work_log, load_tombstones
+
+
+# The storage backends the work log can use (see storage.py), and the file
+# each one keeps the logs in. The backend is chosen at startup by
+# initialize_work_log(), defaulting to the WORK_LOG_BACKEND environment
+# variable (or csv).
+BACKEND_FILES = {
+    'csv': 'work_log.txt',
+    'binary': 'work_log.bin',
+    'sqlite': 'work_log.db',
+    'partitioned': 'work_logs'
+}
+backend = os.environ.get('WORK_LOG_BACKEND', 'csv')
+
+
+def work_log_path():
+    '''Returns the path of the work log used by the current backend'''
+    return BACKEND_FILES[backend]
+
+
+def discard_sidecars(path='work_log.txt'):
+    '''
+    Removes the files kept alongside a work log (its tombstones, indexes
+    and rollups), which must happen whenever the work log is rewritten, as the
+    record ids they hold no longer mean anything
+    '''
+    # Imported here as log_cache imports this module.
+    from log_cache import SNAPSHOT_SUFFIX
+    for suffix in (TOMBSTONE_SUFFIX, DATE_INDEX_SUFFIX, TEXT_INDEX_SUFFIX,
+                   ROLLUP_SUFFIX, SNAPSHOT_SUFFIX):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _clear_screen():
+    '''Clears the screen before an error message is shown'''
+    # Imported here so that non-interactive tools (e.g. query_cli.py) can
+    # set up the work log without loading the interactive modules.
+    from user_navigation_functions import clear_screen
+    clear_screen()
 
 
 def clear_all_logs():
@@ -9,8 +60,9 @@ def clear_all_logs():
     confirm = input("Enter 'CLEAR' to clear all logs.").lower()
 
     if confirm == 'clear':
-        with open('work_log.txt', 'w+') as work_log:
-            work_log.write('date,task_name,time_spent,note\n')
+        # Imported here as storage imports this module.
+        from storage import get_storage
+        get_storage().clear()
         input(
             "All work logs have been cleared. "
             "Hit 'Enter' to return to the Main Menu."
@@ -23,55 +75,246 @@ def clear_all_logs():
         )
 
 
-def initialize_work_log():
+def initialize_work_log(storage_backend=None):
     '''
     Checks to make sure work_log.txt exists and has the appropriate headers
+
+    Also selects the storage backend ('csv', 'binary', 'sqlite' or
+    'partitioned') used for the rest of the session. When another backend
+    than csv is chosen and its work log (binary work log, database or
+    directory of partitions) doesn't exist yet, it is created from
+    work_log.txt.
+
+    Any rewrite of the work logs that was interrupted (e.g. by a crash) is
+    recovered first, and the checks are made holding the work logs' locks,
+    so other processes sharing them never see them half set up.
+
+    Argument: String or None (Backend to use -- None keeps the default)
     '''
+    global backend
+    if storage_backend is not None:
+        backend = storage_backend
+    if backend not in BACKEND_FILES:
+        sys.exit(
+            "Unknown work log backend '{}'. Choose one of: {}".format(
+                backend, ', '.join(BACKEND_FILES)
+            )
+        )
+
+    # Finish (or undo) any rewrite of the work logs that was interrupted.
+    recover_work_log('work_log.txt')
+    recover_work_log(work_log_path())
+
+    with work_log_lock('work_log.txt'), work_log_lock(work_log_path()):
+        return _check_work_logs()
+
+
+def _check_work_logs():
+    '''Creates, checks and compacts the work logs (see initialize_work_log)'''
+    # An existing binary work log only needs its header checking.
+    if backend == 'binary' and os.path.exists(work_log_path()):
+        if not is_binary_log(work_log_path()):
+            _clear_screen()
+            print(
+                "Oh no! It looks like {} is not a binary work log.\n\n"
+                "Remove it (it will be rebuilt from work_log.txt), then try "
+                "opening the program again.".format(work_log_path())
+            )
+            sys.exit()
+        compact_work_log(work_log_path())
+        return
+
+    # Likewise an existing work log database; SQLite looks after it.
+    if backend == 'sqlite' and os.path.exists(work_log_path()):
+        # Imported here as sqlite_storage imports this module (and so that
+        # sqlite3 is only loaded when it's used).
+        from sqlite_storage import is_sqlite_log
+        if not is_sqlite_log(work_log_path()):
+            _clear_screen()
+            print(
+                "Oh no! It looks like {} is not a work log database.\n\n"
+                "Remove it (it will be rebuilt from work_log.txt), then try "
+                "opening the program again.".format(work_log_path())
+            )
+            sys.exit()
+        return
+
+    # And an existing partitioned work log, whose partitions are each
+    # recovered and compacted like work_log.txt.
+    if backend == 'partitioned' and os.path.isdir(work_log_path()):
+        from partitions import check_partitions
+        check_partitions(work_log_path())
+        return
+
+    # The header is read as the file is opened, so it's only opened once.
     try:
-        log = open("work_log.txt")
-        log.close()
-        
+        with open("work_log.txt", "r") as work_log:
+            header = work_log.readline()
+
     # If no work_log.txt, create file with appropriate headers.
     except FileNotFoundError:
-        with open("work_log.txt", "w+") as work_log:
+        with atomic_rewrite("work_log.txt", "w") as work_log:
             work_log.write('date,task_name,time_spent,note\n')
+        if backend == 'binary':
+            create_binary_log(work_log_path())
+        elif backend in ('sqlite', 'partitioned'):
+            _convert_work_log()
         return True
 
     # If pre_existing work_log.txt uses wrong (or no) headers, exit the program
     # while prompting the user to fix the headers.
     else:
-        with open("work_log.txt", "r") as work_log:
-            if work_log.readline() != 'date,task_name,time_spent,note\n':
-                clear_screen()
-                print(
-                    "Oh no! It looks like the header in work_log.txt "
-                    "is not formatted properly.\n\nMake sure the first "
-                    "line of work_log.txt is 'date,title,duration,note', "
-                    "then try opening the program again."
-                )
-                sys.exit()
+        if header != 'date,task_name,time_spent,note\n':
+            _clear_screen()
+            print(
+                "Oh no! It looks like the header in work_log.txt "
+                "is not formatted properly.\n\nMake sure the first "
+                "line of work_log.txt is 'date,title,duration,note', "
+                "then try opening the program again."
+            )
+            sys.exit()
+
+        # Rewrite work_log.txt without its deleted logs, if enough of them
+        # have built up.
+        compact_work_log('work_log.txt')
+
+        # Build the binary work log from the (valid) csv work log.
+        if backend == 'binary':
+            csv_to_binary('work_log.txt', work_log_path())
+
+        # Or move the logs into a new work log database, or partitions.
+        elif backend in ('sqlite', 'partitioned'):
+            _convert_work_log()
+
+
+def _convert_work_log():
+    '''Creates the work log database or partitions from work_log.txt'''
+    if backend == 'sqlite':
+        from sqlite_storage import migrate_to_sqlite
+        migrate_to_sqlite('work_log.txt', work_log_path())
+    else:
+        from partitions import partition_work_log
+        partition_work_log('work_log.txt', work_log_path())
+
+
+@timed('iter_log_records')
+def iter_log_records(path=None, start_offset=None, include_deleted=False):
+    '''
+    Lazily reads a work log, yielding each log along with its byte offset
+
+    Rows are parsed one line at a time (work logs never span lines), so
+    nothing beyond the current row is held in memory. Reading can be resumed
+    part way through the file by passing the byte offset of a row, e.g. one
+    previously yielded by this function or the file's old size after an
+    append. Rows are built the same way csv.DictReader builds them.
+
+    Binary work logs (see binary_log.py) are recognised by their header and
+    read with iter_binary_records() instead.
+
+    A log's byte offset is also its record id. Logs that have been deleted
+    (see tombstones.py) are skipped, unless include_deleted is True.
+
+    Arguments: String or None (Path to the work log -- None uses the current
+    backend's work log), Integer or None (Byte offset of the first row to
+    read -- None reads from just after the header), Boolean (Whether to
+    include deleted logs)
+    Yields: Tuples (Byte offset of the row, Dictionary of the log)
+    '''
+    if path is None:
+        path = work_log_path()
+
+    records = _iter_records(path, start_offset)
+    if include_deleted:
+        return records
+    dead = load_tombstones(path)
+    if not dead:
+        return records
+    return (
+        (offset, log) for offset, log in records if offset not in dead
+    )
+
+
+def _iter_records(path, start_offset):
+    '''Reads every record of a work log (see iter_log_records())'''
+    with open(path, 'rb') as work_log:
+        if work_log.read(len(MAGIC)) == MAGIC:
+            yield from iter_binary_records(path, start_offset)
+            return
+        work_log.seek(0)
+
+        header = work_log.readline().decode('utf-8')
+        fieldnames = next(csv.reader([header], quotechar='|'), [])
+        if start_offset is not None:
+            work_log.seek(start_offset)
+        offset = work_log.tell()
+
+        for line in work_log:
+            row_offset = offset
+            offset += len(line)
+            row = next(
+                csv.reader([line.decode('utf-8')], quotechar='|'), []
+            )
+            # Skip blank lines, as csv.DictReader does.
+            if not row:
+                continue
+
+            log = dict(zip(fieldnames, row))
+            if len(row) > len(fieldnames):
+                log[None] = row[len(fieldnames):]
             else:
-                pass
+                for key in fieldnames[len(row):]:
+                    log[key] = None
+            yield row_offset, log
 
 
-def fetch_logs():
+def iter_record_offsets(path=None):
     '''
-    Reads a csv and returns all logs (as a list of dictionaries)
-    
-    Using csv.DictReader(), work_log.txt is read and dictionaries
-    corresponding to each line in the file are added to a list.
-    
-    Argument: None
-    Returns: List of Dictionaries (all logs in work_log.txt)
+    Yields the byte offset (record id) of every record of a work log,
+    deleted or not, finding where each record starts without parsing it
+
+    Argument: String or None (Path to the work log -- None uses the current
+    backend's work log)
+    Yields: Integers (Byte offsets, in file order)
     '''
-    logs = []
+    if path is None:
+        path = work_log_path()
+    with open(path, 'rb') as work_log:
+        if work_log.read(len(MAGIC)) == MAGIC:
+            yield from iter_binary_offsets(path)
+            return
+        work_log.seek(0)
+        offset = len(work_log.readline())
+        for line in work_log:
+            # Blank lines aren't records (see _iter_records()).
+            if line.rstrip(b'\r\n'):
+                yield offset
+            offset += len(line)
 
-    with open("work_log.txt", newline='') as work_log:
-        reader = csv.DictReader(work_log, quotechar='|')
-        for row in reader:
-            logs.append(row)
 
-    return logs
+def iter_logs(path=None, start_offset=None):
+    '''
+    Lazily reads a work log, yielding logs (as dictionaries) one at a time
 
+    Arguments: String or None (Path to the work log -- None uses the current
+    backend's work log), Integer or None (Byte offset to resume reading
+    from -- see iter_log_records())
+    Yields: Dictionaries (logs in work_log.txt, in file order)
+    '''
+    for _, log in iter_log_records(path, start_offset):
+        yield log
 
 
+@timed('fetch_logs')
+def fetch_logs():
+    '''
+    Reads a csv and returns all logs (as a list of dictionaries)
+    
+    The current backend's storage (work_log.txt, work_log.bin with the
+    binary backend or work_log.db with the sqlite backend) is read and
+    dictionaries corresponding to each log are added to a list.
+    
+    Argument: None
+    Returns: List of Dictionaries (all logs in the work log)
+    '''
+    from storage import get_storage
+    return list(get_storage().iter_logs())
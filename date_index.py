@@ -0,0 +1,251 @@
+import array
+import bisect
+import datetime
+import heapq
+import os
+import struct
+
+from instrumentation import timed
+from locking import atomic_write
+
+
+# The sidecar index lives next to the work log it describes, e.g.
+# work_log.txt -> work_log.txt.dateidx
+INDEX_SUFFIX = '.dateidx'
+
+# Header: magic, log file size, log file mtime (ns), number of entries.
+_MAGIC = b'WLDATE02'
+_HEADER = struct.Struct('<8sqqI')
+
+
+def date_ordinal(date):
+    '''
+    Converts a DD/MM/YYYY date string into an ordinal integer
+
+    The ordinal is the same one datetime.date.toordinal() returns, so ordinals
+    sort chronologically and can be compared directly. Dates that can't be
+    parsed are given an ordinal of 0 (sorting them before every real date),
+    leaving detail_view to complain about the malformed log.
+
+    Argument: String (Date with format DD/MM/YYYY)
+    Returns: Integer (Ordinal of the date)
+    '''
+    try:
+        day, month, year = date.split('/')
+        return datetime.date(int(year), int(month), int(day)).toordinal()
+    except (AttributeError, ValueError):
+        return 0
+
+
+def file_identity(path):
+    '''Returns the (size, mtime) pair used to validate an index'''
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@timed('sorting')
+def chronological_order(dates):
+    '''
+    Returns the positions of an array of date ordinals in chronological order
+
+    sorted() is stable, so logs sharing a date keep their file order.
+    '''
+    return sorted(range(len(dates)), key=dates.__getitem__)
+
+
+class DateIndex():
+    '''
+    The work log's records in chronological order, keyed by date ordinal
+
+    ordinals[i] is the date of the log with record id record_ids[i] (see
+    tombstones.py). Each log's ordinal is worked out once, when the log is
+    written (see record_append()), and ordinals is kept sorted (logs sharing
+    a date stay in file order), so the index is a persistent chronological
+    ordering of the work log that never has to be re-sorted. It also means a
+    date range can be found with two binary searches.
+
+    The index is keyed by record id, not row number, so deleting a log
+    doesn't invalidate it; deleted logs are just skipped by order().
+    '''
+
+    def __init__(self, ordinals=None, record_ids=None, size=0, mtime=0):
+        self.ordinals = ordinals if ordinals is not None else array.array('i')
+        self.record_ids = (
+            record_ids if record_ids is not None else array.array('q')
+        )
+        self.size = size
+        self.mtime = mtime
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    @classmethod
+    def build(cls, logs, path='work_log.txt'):
+        '''
+        Builds an index from a LogTable of the logs (in the order they
+        appear in the work log file), stamped with the file's current size
+        and mtime
+        '''
+        rows = chronological_order(logs.dates)
+        size, mtime = file_identity(path)
+        return cls(
+            array.array('i', [logs.dates[row] for row in rows]),
+            array.array('q', [logs.record_ids[row] for row in rows]),
+            size,
+            mtime
+        )
+
+    @classmethod
+    def load(cls, path='work_log.txt', identity=None, allow_growth=False):
+        '''
+        Reads the sidecar index for a work log
+
+        The index is only returned if it was written for a file with the
+        given (size, mtime) identity -- by default the log file's current
+        identity. With allow_growth, an index written before logs were
+        appended to the file is returned too (for extend() to catch up). A
+        missing, corrupt or stale index returns None.
+        '''
+        if identity is None:
+            try:
+                identity = file_identity(path)
+            except FileNotFoundError:
+                return None
+        try:
+            with open(path + INDEX_SUFFIX, 'rb') as index_file:
+                magic, size, mtime, count = _HEADER.unpack(
+                    index_file.read(_HEADER.size)
+                )
+                if magic != _MAGIC:
+                    return None
+                if (size, mtime) != identity and not (
+                        allow_growth and size < identity[0]):
+                    return None
+                ordinals = array.array('i')
+                record_ids = array.array('q')
+                ordinals.fromfile(index_file, count)
+                record_ids.fromfile(index_file, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        return cls(ordinals, record_ids, size, mtime)
+
+    def save(self, path='work_log.txt'):
+        '''Writes the index to its sidecar file (atomically)'''
+        with atomic_write(path + INDEX_SUFFIX) as index_file:
+            index_file.write(_HEADER.pack(
+                _MAGIC, self.size, self.mtime, len(self.ordinals)
+            ))
+            self.ordinals.tofile(index_file)
+            self.record_ids.tofile(index_file)
+
+    def insert(self, ordinal, record_id):
+        '''Adds a log to the index, keeping the ordinals sorted'''
+        position = bisect.bisect_right(self.ordinals, ordinal)
+        self.ordinals.insert(position, ordinal)
+        self.record_ids.insert(position, record_id)
+
+    def extend(self, logs, rows):
+        '''
+        Merges some rows of a LogTable (e.g. logs appended to the file since
+        the index was saved) into the index
+
+        Only the new rows are sorted; they are then merged with the index in
+        a single linear pass.
+        '''
+        rows = list(rows)
+        new = [rows[i] for i in chronological_order(
+            [logs.dates[row] for row in rows]
+        )]
+        merged = list(heapq.merge(
+            zip(self.ordinals, self.record_ids),
+            ((logs.dates[row], logs.record_ids[row]) for row in new)
+        ))
+        self.ordinals = array.array('i', [ordinal for ordinal, _ in merged])
+        self.record_ids = array.array('q', [rid for _, rid in merged])
+
+    def order(self, logs):
+        '''
+        Returns the rows of a LogTable (of every live log, in file order) in
+        chronological order, or None if the index doesn't cover every row
+        '''
+        rows = {
+            record_id: row for row, record_id in enumerate(logs.record_ids)
+        }
+        order = [
+            rows[record_id] for record_id in self.record_ids
+            if record_id in rows
+        ]
+        return order if len(order) == len(rows) else None
+
+    def date_range(self, start, end):
+        '''Finds the slice of the index falling between two ordinals'''
+        return date_range(self.ordinals, start, end)
+
+
+def date_range(ordinals, start, end):
+    '''
+    Finds the slice of a sorted array of ordinals falling between two
+    ordinals (inclusive), using two binary searches
+
+    Arguments: Sorted Array (Ordinals), Integers (Start and end ordinals)
+    Returns: Tuple (Start and stop positions of the slice)
+    '''
+    low = bisect.bisect_left(ordinals, start)
+    high = bisect.bisect_right(ordinals, end, low)
+    return low, high
+
+
+@timed('get_chronological_order')
+def get_chronological_order(logs, path='work_log.txt'):
+    '''
+    Returns the rows of a LogTable in chronological order, using the index
+
+    logs must hold every live log of the work log, in file order. The
+    sidecar index is loaded and, if logs have been appended to the file
+    since it was saved, they are merged in (merge-on-read). Only when there
+    is no usable index is one built -- the one time the logs are sorted --
+    and either way the up to date index is saved for next time.
+
+    Arguments: LogTable (Logs in file order), String (Path to the work log)
+    Returns: List of Integers (Rows of logs, in chronological order)
+    '''
+    identity = file_identity(path)
+    index = DateIndex.load(path, identity, allow_growth=True)
+    order = None
+    if index is not None:
+        stale = (index.size, index.mtime) != identity
+        if stale:
+            first_new = bisect.bisect_left(logs.record_ids, index.size)
+            index.extend(logs, range(first_new, len(logs)))
+            index.size, index.mtime = identity
+        order = index.order(logs)
+
+    if order is None:
+        index = DateIndex.build(logs, path)
+        order = index.order(logs)
+        stale = True
+    if stale:
+        try:
+            index.save(path)
+        except OSError:
+            pass
+    return order
+
+
+def record_append(date, previous_identity, path='work_log.txt'):
+    '''
+    Updates the sidecar index after a log has been appended to the work log
+
+    The new log's date ordinal is worked out here, once, and inserted in
+    place, if the index matched the work log before the append. Otherwise
+    the index is left to catch up the next time the logs are read.
+
+    Arguments: String (Date of the new log), Tuple (size, mtime of the work
+    log before the append -- the size being the new log's record id)
+    '''
+    index = DateIndex.load(path, previous_identity)
+    if index is None:
+        return
+    index.insert(date_ordinal(date), previous_identity[0])
+    index.size, index.mtime = file_identity(path)
+    index.save(path)
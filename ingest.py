@@ -0,0 +1,215 @@
+'''
+Bulk, non-interactive import of work logs
+
+Reads logs from a csv or jsonl file (or stdin), checks each one with the
+same rules the interactive prompts use, and appends the valid ones to the
+work log in large buffered batches with a single fsync at the end.
+
+With the sqlite backend, the logs are inserted into the work log database
+instead, one transaction per batch, and with the partitioned backend each
+batch is split between the partitions.
+
+Usage: python ingest.py [FILE] [--format csv|jsonl]
+       [--backend csv|binary|sqlite|partitioned]
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import csv_functions
+from binary_log import pack_record
+from csv_functions import initialize_work_log, work_log_path
+from locking import work_log_lock
+from storage import FileStorage, get_storage
+from user_input_functions import (validate_date_format, validate_string,
+                                  validate_time_spent)
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+# How many logs are buffered before being written out.
+BATCH_SIZE = 10000
+
+
+def read_csv(source, quotechar='"'):
+    '''
+    Yields the logs (as dictionaries) in a csv file with a header row
+
+    Arguments: File (Open csv file), String (Quote character -- exports from
+    other trackers normally use '"', work_log.txt uses '|')
+    '''
+    for log in csv.DictReader(source, quotechar=quotechar):
+        yield log
+
+
+def read_jsonl(source):
+    '''
+    Yields the logs (as dictionaries) in a jsonl file
+
+    A line that isn't valid JSON is yielded as a ValueError rather than
+    raised, so it is reported and skipped like any other invalid log (see
+    _ingest_batches()) and the rest of the file is still read.
+    '''
+    for line in source:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield ValueError('invalid JSON ({})'.format(error))
+
+
+def validate_log(log):
+    '''
+    Checks a log with the rules used by the interactive prompts
+
+    Argument: Dictionary (A log read from the import file)
+    Returns: Dictionary (The log's four fields, as strings)
+    Raises: ValueError (describing the first problem found)
+    '''
+    try:
+        fields = {field: log[field] for field in FIELDS}
+    except KeyError as error:
+        raise ValueError('missing field {}'.format(error))
+    fields['time_spent'] = str(fields['time_spent'])
+    validate_date_format(fields['date'])
+    fields['task_name'] = validate_string(fields['task_name'], 'task name')
+    validate_time_spent(fields['time_spent'])
+    fields['note'] = validate_string(fields['note'], 'note')
+    return fields
+
+
+def _write_batch(work_log, batch):
+    '''Writes a batch of logs to an open work log file (in either format)'''
+    if csv_functions.backend == 'binary':
+        work_log.write(b''.join(pack_record(log) for log in batch))
+    else:
+        rows = io.StringIO(newline='')
+        writer = csv.writer(
+            rows,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL
+        )
+        writer.writerows([log[field] for field in FIELDS] for log in batch)
+        work_log.write(rows.getvalue().encode('utf-8'))
+
+
+def _ingest_batches(logs, write_batch, errors):
+    '''
+    Checks logs and hands the valid ones to write_batch() in batches of
+    BATCH_SIZE, returning (number written, number rejected)
+    '''
+    written = rejected = 0
+    batch = []
+    for number, log in enumerate(logs, 1):
+        try:
+            if isinstance(log, ValueError):
+                raise log
+            batch.append(validate_log(log))
+        except (TypeError, ValueError) as error:
+            rejected += 1
+            print(
+                'Skipping log {}: {}'.format(
+                    number, ' '.join(str(error).split())
+                ),
+                file=errors
+            )
+            continue
+        if len(batch) >= BATCH_SIZE:
+            write_batch(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        write_batch(batch)
+        written += len(batch)
+    return written, rejected
+
+
+def ingest(logs, errors=sys.stderr):
+    '''
+    Appends logs to the work log in batches
+
+    Invalid logs are reported (with their position in the input) and
+    skipped. The work log is opened once, written in batches of BATCH_SIZE
+    logs and fsynced once at the end. The date and text indexes catch up
+    with the new logs the next time the logs are read. With the sqlite and
+    partitioned backends, each batch is added by the storage instead.
+
+    Arguments: Iterable of Dictionaries (Logs to import), File (Where to
+    report invalid logs)
+    Returns: Tuple (Number of logs written, number rejected)
+    '''
+    storage = get_storage()
+    if not isinstance(storage, FileStorage):
+        return _ingest_batches(logs, storage.append_many, errors)
+
+    path = work_log_path()
+    # The import holds the work log's lock throughout, so logs written by
+    # other processes can't end up in the middle of a batch.
+    with work_log_lock(path), \
+            open(path, 'ab', buffering=1024 * 1024) as work_log:
+        counts = _ingest_batches(
+            logs, lambda batch: _write_batch(work_log, batch), errors
+        )
+        work_log.flush()
+        os.fsync(work_log.fileno())
+    return counts
+
+
+def main(arguments=None):
+    '''Runs the importer from the command line'''
+    parser = argparse.ArgumentParser(
+        description='Import work logs in bulk from a csv or jsonl file.'
+    )
+    parser.add_argument(
+        'file', nargs='?',
+        help='file to import (defaults to stdin)'
+    )
+    parser.add_argument(
+        '--format', choices=('csv', 'jsonl'),
+        help='format of the input (guessed from the file name if not given)'
+    )
+    parser.add_argument(
+        '--quotechar', default='"',
+        help="quote character of csv input (default '\"')"
+    )
+    parser.add_argument(
+        '--backend', choices=sorted(csv_functions.BACKEND_FILES),
+        help='work log backend to import into'
+    )
+    options = parser.parse_args(arguments)
+
+    input_format = options.format
+    if input_format is None:
+        is_jsonl = options.file and options.file.endswith(('.jsonl', '.json'))
+        input_format = 'jsonl' if is_jsonl else 'csv'
+
+    initialize_work_log(options.backend)
+
+    if options.file:
+        source = open(options.file, newline='', encoding='utf-8')
+    else:
+        source = sys.stdin
+    start = time.perf_counter()
+    with source:
+        if input_format == 'jsonl':
+            logs = read_jsonl(source)
+        else:
+            logs = read_csv(source, options.quotechar)
+        written, rejected = ingest(logs)
+    elapsed = time.perf_counter() - start
+
+    print(
+        'Imported {} logs ({} rejected) in {:.2f}s: {:.0f} rows/sec'.format(
+            written, rejected, elapsed, written / elapsed if elapsed else 0
+        ),
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    main()
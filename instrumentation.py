@@ -0,0 +1,148 @@
+'''
+Opt-in timings and counts of the work log's hot paths
+
+Set WORK_LOG_INSTRUMENT to turn instrumentation on for a session: every
+function decorated with timed() then records how often it was called and
+how long it took, and a summary is printed to stderr when the program exits
+(or appended to a file, if WORK_LOG_INSTRUMENT is set to its path rather
+than to 1). Set WORK_LOG_PROFILE to a path to also profile the whole session
+with cProfile; the stats are saved there (for pstats or snakeviz) and the
+slowest functions are added to the summary.
+
+When neither is set, timed() returns functions unchanged, so there is no
+overhead at all.
+'''
+import atexit
+import functools
+import io
+import os
+import sys
+import time
+import types
+
+
+ENABLED = os.environ.get('WORK_LOG_INSTRUMENT', '') not in ('', '0')
+PROFILE_PATH = os.environ.get('WORK_LOG_PROFILE') or None
+
+# Timings by name: [number of calls, total seconds, longest call in seconds],
+# and plain counts by name (see count()).
+_timings = {}
+_counts = {}
+_profiler = None
+
+
+def record(name, seconds):
+    '''Adds one timed call to the named timing'''
+    timing = _timings.get(name)
+    if timing is None:
+        timing = _timings[name] = [0, 0.0, 0.0]
+    timing[0] += 1
+    timing[1] += seconds
+    timing[2] = max(timing[2], seconds)
+
+
+def count(name, amount=1):
+    '''Adds to a named count (e.g. of cache hits), if instrumenting'''
+    if ENABLED:
+        _counts[name] = _counts.get(name, 0) + amount
+
+
+def _timed_generator(name, generator):
+    '''
+    Yields from a generator, recording the time spent producing its items
+    (as one call, once it's finished or abandoned)
+    '''
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                seconds += time.perf_counter() - start
+                return
+            seconds += time.perf_counter() - start
+            yield item
+    finally:
+        record(name, seconds)
+
+
+def timed(name):
+    '''
+    Decorator recording the calls to a function under a name
+
+    Searches return generators that do their filtering as results are
+    pulled, so when a function returns a generator, the time spent pulling
+    its items is recorded too (under name + ' (results)').
+
+    Argument: String (Name the timings are recorded under)
+    '''
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+            if isinstance(result, types.GeneratorType):
+                result = _timed_generator(name + ' (results)', result)
+            return result
+        return wrapper
+    return decorator
+
+
+def summary():
+    '''
+    Returns the session's timings and counts as lines of text, slowest
+    first
+    '''
+    lines = ['Work log instrumentation summary (inclusive times)']
+    lines.append('{:<40} {:>8} {:>11} {:>10} {:>10}'.format(
+        'name', 'calls', 'total s', 'mean ms', 'max ms'
+    ))
+    for name, (calls, total, longest) in sorted(
+            _timings.items(), key=lambda item: -item[1][1]):
+        lines.append('{:<40} {:>8} {:>11.4f} {:>10.3f} {:>10.3f}'.format(
+            name, calls, total, total / calls * 1000, longest * 1000
+        ))
+    for name, amount in sorted(_counts.items()):
+        lines.append('{:<40} {:>8}'.format(name, amount))
+    return lines
+
+
+def _profile_lines(limit=20):
+    '''Returns the slowest functions of the profiled session, as text'''
+    import pstats
+    output = io.StringIO()
+    pstats.Stats(_profiler, stream=output).sort_stats(
+        'cumulative'
+    ).print_stats(limit)
+    return output.getvalue().splitlines()
+
+
+def _report():
+    '''Prints the summary (and saves the profile) as the program exits'''
+    lines = summary() if ENABLED else []
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(PROFILE_PATH)
+        lines += ['', 'cProfile stats saved to {}'.format(PROFILE_PATH)]
+        lines += _profile_lines()
+    destination = os.environ.get('WORK_LOG_INSTRUMENT', '1')
+    if destination in ('1', 'stderr') or not ENABLED:
+        print('\n'.join(lines), file=sys.stderr)
+    else:
+        with open(destination, 'a') as summary_file:
+            summary_file.write('\n'.join(lines) + '\n')
+
+
+if PROFILE_PATH:
+    import cProfile
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+if ENABLED or PROFILE_PATH:
+    atexit.register(_report)
@@ -0,0 +1,326 @@
+'''
+A load test of the work log server (see server.py)
+
+Several clients, each in its own thread, send requests to the server as
+fast as it answers them: a mix of the five searches, reports and (with
+--writes) new logs, with search terms taken from a sample of the logs the
+server holds. The latency of every request is measured, and the 50th and
+99th percentiles are reported for each kind of request and overall, along
+with the throughput.
+
+The server can be started for the test (--serve), in the current
+directory, or an already running one tested (--url).
+
+Usage: python load_test.py [--url URL | --serve [--backend BACKEND]]
+       [--clients N] [--requests N] [--writes FRACTION] [--seed N]
+       [--output FILE]
+'''
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import csv_functions
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+# The kinds of request sent, in the order they are reported.
+KINDS = (
+    'date', 'date_range', 'time_spent', 'string', 'pattern', 'report', 'add'
+)
+
+# How many days' logs are sampled for search terms.
+SAMPLE_DAYS = 50
+
+# How long (in seconds) a server started with --serve has to come up.
+START_TIMEOUT = 60
+
+
+def percentile(values, percent):
+    '''
+    Returns the nearest-rank percentile of a list of numbers (as
+    aggregates.Stats.percentile() does), or None if it's empty
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)), 1) - 1]
+
+
+def _get(url, path, parameters=None):
+    '''Sends a GET request, returning the decoded JSON response'''
+    if parameters:
+        path += '?' + urllib.parse.urlencode(parameters)
+    with urllib.request.urlopen(url + path) as response:
+        return json.loads(response.read())
+
+
+def _post(url, path, body):
+    '''Sends a POST request with a JSON body, returning the response'''
+    request = urllib.request.Request(
+        url + path, json.dumps(body).encode('utf-8'),
+        {'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def sample_logs(url, rng):
+    '''
+    Returns a sample of the logs the server holds: those of SAMPLE_DAYS
+    days picked at random (from the days the daily report lists)
+    '''
+    days = [
+        row['group'][0]
+        for row in _get(url, '/report', {'group': 'day'})['rows']
+        if row['group'][0] != 'invalid date'
+    ]
+    if not days:
+        sys.exit('The work log is empty, so there is nothing to search.')
+    logs = []
+    for day in rng.sample(days, min(len(days), SAMPLE_DAYS)):
+        date = datetime.date.fromisoformat(day).strftime('%d/%m/%Y')
+        logs.extend(_get(url, '/search/date', {'date': date})['logs'])
+    return logs
+
+
+def make_request(kind, logs, rng):
+    '''
+    Returns a request of the given kind as a function of the server's URL,
+    with its search terms taken from a random sampled log
+    '''
+    log = rng.choice(logs)
+    if kind == 'date':
+        return lambda url: _get(url, '/search/date', {'date': log['date']})
+    if kind == 'date_range':
+        start = datetime.datetime.strptime(log['date'], '%d/%m/%Y')
+        end = start + datetime.timedelta(days=rng.randint(1, 30))
+        return lambda url: _get(url, '/search/date_range', {
+            'from': log['date'], 'to': end.strftime('%d/%m/%Y')
+        })
+    if kind == 'time_spent':
+        return lambda url: _get(
+            url, '/search/time_spent', {'minutes': log['time_spent']}
+        )
+    words = re.findall(r'\w{3,}', log['task_name']) or ['the']
+    word = rng.choice(words)
+    if kind == 'string':
+        return lambda url: _get(url, '/search/string', {'text': word})
+    if kind == 'pattern':
+        regex = r'{}\s+\w+'.format(re.escape(word))
+        return lambda url: _get(url, '/search/pattern', {'regex': regex})
+    if kind == 'report':
+        group = rng.choice(('day', 'week', 'month', 'task'))
+        return lambda url: _get(url, '/report', {'group': group})
+    new_log = {field: log[field] for field in FIELDS}
+    return lambda url: _post(url, '/logs', new_log)
+
+
+def run_load(url, logs, clients, requests, writes=0.0, rng=None):
+    '''
+    Sends requests from several client threads at once
+
+    Arguments: String (Server URL), List (Sampled logs), Integers (Number
+    of clients, number of requests in all), Float (Fraction of requests
+    that add a log), random.Random or None
+    Returns: Tuple (Dictionary of latencies in seconds by kind, Dictionary
+    of error counts by kind, Float (Seconds taken))
+    '''
+    if rng is None:
+        rng = random.Random()
+    searches = [kind for kind in KINDS if kind != 'add']
+    plan = [
+        ('add' if rng.random() < writes else rng.choice(searches))
+        for _ in range(requests)
+    ]
+    plan = [(kind, make_request(kind, logs, rng)) for kind in plan]
+
+    latencies = {kind: [] for kind in KINDS}
+    errors = {kind: 0 for kind in KINDS}
+    lock = threading.Lock()
+    position = iter(plan)
+
+    def client():
+        while True:
+            with lock:
+                kind, request = next(position, (None, None))
+            if request is None:
+                return
+            start = time.perf_counter()
+            try:
+                request(url)
+            except (OSError, ValueError):
+                with lock:
+                    errors[kind] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[kind].append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarize(latencies, errors, seconds):
+    '''
+    Works out the figures reported: the count, errors and p50/p99 latency
+    (in milliseconds) of each kind of request and of all of them, and the
+    requests answered per second
+    '''
+    def figures(values, failed):
+        return {
+            'requests': len(values),
+            'errors': failed,
+            'p50_ms': _milliseconds(percentile(values, 50)),
+            'p99_ms': _milliseconds(percentile(values, 99))
+        }
+
+    every = [value for kind in KINDS for value in latencies[kind]]
+    summary = {
+        kind: figures(latencies[kind], errors[kind])
+        for kind in KINDS if latencies[kind] or errors[kind]
+    }
+    summary['all'] = figures(every, sum(errors.values()))
+    summary['all']['per_second'] = len(every) / seconds if seconds else 0
+    return summary
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def print_summary(summary):
+    '''Prints the figures as a table'''
+    print('{:<12} {:>9} {:>7} {:>10} {:>10}'.format(
+        'Request', 'Count', 'Errors', 'p50 (ms)', 'p99 (ms)'
+    ))
+    for kind, figures in summary.items():
+        print('{:<12} {:>9} {:>7} {:>10} {:>10}'.format(
+            kind, figures['requests'], figures['errors'],
+            figures['p50_ms'], figures['p99_ms']
+        ))
+    print('{:.0f} requests/sec'.format(summary['all']['per_second']))
+
+
+def _free_port():
+    '''Returns a port nothing is listening on'''
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(backend=None):
+    '''
+    Starts server.py on a free port, in the current directory, and waits
+    until it answers
+
+    Returns: Tuple (subprocess.Popen, String (Its URL))
+    '''
+    port = _free_port()
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+        '--port', str(port)
+    ]
+    if backend is not None:
+        command += ['--backend', backend]
+    server = subprocess.Popen(command)
+    url = 'http://127.0.0.1:{}'.format(port)
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            _get(url, '/health')
+            return server, url
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                sys.exit('The server could not be started.')
+            time.sleep(0.1)
+
+
+def main(arguments=None):
+    '''Runs the load test from the command line'''
+    parser = argparse.ArgumentParser(
+        description='Load test the work log server, reporting p50/p99 '
+                    'latency.'
+    )
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument(
+        '--url', default='http://127.0.0.1:8080',
+        help='URL of a running server (default http://127.0.0.1:8080)'
+    )
+    target.add_argument(
+        '--serve', action='store_true',
+        help='start a server on the work log in the current directory'
+    )
+    parser.add_argument(
+        '--backend', choices=sorted(csv_functions.BACKEND_FILES),
+        help='work log backend of the server started with --serve'
+    )
+    parser.add_argument(
+        '--clients', type=int, default=16,
+        help='clients sending requests at once (default 16)'
+    )
+    parser.add_argument(
+        '--requests', type=int, default=2000,
+        help='requests to send in all (default 2000)'
+    )
+    parser.add_argument(
+        '--writes', type=float, default=0.0,
+        help='fraction of requests that add a log (default 0)'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='random seed for the requests (default 0)'
+    )
+    parser.add_argument(
+        '--output',
+        help='file to write the figures to, as JSON'
+    )
+    options = parser.parse_args(arguments)
+    if options.clients < 1 or options.requests < 1:
+        parser.error('--clients and --requests must be at least 1')
+    if not 0 <= options.writes <= 1:
+        parser.error('--writes must be between 0 and 1')
+
+    server = None
+    url = options.url.rstrip('/')
+    if options.serve:
+        server, url = start_server(options.backend)
+    try:
+        rng = random.Random(options.seed)
+        logs = sample_logs(url, rng)
+        latencies, errors, seconds = run_load(
+            url, logs, options.clients, options.requests, options.writes,
+            rng
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(latencies, errors, seconds)
+    print_summary(summary)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
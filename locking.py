@@ -0,0 +1,294 @@
+'''
+Safe access to a work log shared by several processes
+
+Writers (adding, deleting, editing, importing, clearing or compacting logs)
+hold an exclusive advisory lock on the work log, and readers building a
+snapshot of it hold a shared one (see work_log_lock()). The lock is taken on
+a separate lock file, e.g. work_log.txt.lock, so it isn't lost when the work
+log itself is replaced.
+
+The work log is never rewritten in place. A new version is written to a
+temporary file alongside it, which then replaces the work log with a single
+rename (see atomic_rewrite()). A small write-ahead journal records the
+rename before it happens, so that if the program is interrupted part way
+through, recover_work_log() can finish (or undo) the rewrite the next time
+the work log is opened.
+
+Every rewrite also moves the work log on to its next generation (see
+work_log_generation()). Record ids are byte offsets, which a rewrite
+reassigns, so a record id is only trusted along with the generation it
+was noted in.
+
+Locking uses fcntl, and is skipped where that isn't available (e.g. on
+Windows); the rewrites are atomic everywhere.
+'''
+import contextlib
+import glob
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+LOCK_SUFFIX = '.lock'
+JOURNAL_SUFFIX = '.journal'
+TEMP_SUFFIX = '.tmp-'
+# Unlike the other sidecar files, the generation outlives rewrites.
+GENERATION_SUFFIX = '.generation'
+
+# The locks this process holds, by work log path: a thread lock (so threads
+# of this process take turns too) and the lock file and modes held, so that
+# locks can be taken again by code that already holds them.
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class _HeldLock():
+    '''The state of one work log's lock within this process'''
+
+    def __init__(self):
+        self.thread_lock = threading.RLock()
+        self.lock_file = None
+        self.modes = []
+
+
+def _flock(lock_file, exclusive):
+    '''Takes (or converts to) a shared or exclusive lock on a lock file'''
+    if fcntl is not None:
+        fcntl.flock(
+            lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        )
+
+
+@contextlib.contextmanager
+def work_log_lock(path='work_log.txt', shared=False):
+    '''
+    Holds an advisory lock on a work log for the duration of a with block
+
+    An exclusive lock (the default) waits for every other reader and writer
+    to finish; shared locks can be held by several readers at once. Locks
+    can be nested: taking a lock the process already holds (e.g. edit_log()
+    calling add_log()) doesn't wait for itself.
+
+    Arguments: String (Path to the work log), Boolean (Whether a shared
+    lock, for reading, is enough)
+    '''
+    key = os.path.abspath(path)
+    with _locks_guard:
+        held = _locks.get(key)
+        if held is None:
+            held = _locks[key] = _HeldLock()
+
+    with held.thread_lock:
+        exclusive = not shared
+        was_exclusive = any(held.modes)
+        if held.lock_file is None:
+            held.lock_file = open(path + LOCK_SUFFIX, 'a')
+            _flock(held.lock_file, exclusive)
+        elif exclusive and not was_exclusive:
+            _flock(held.lock_file, True)
+        held.modes.append(exclusive)
+        try:
+            yield
+        finally:
+            held.modes.pop()
+            if not held.modes:
+                held.lock_file.close()
+                held.lock_file = None
+            elif exclusive and not was_exclusive:
+                # Go back to the shared lock this was nested in.
+                _flock(held.lock_file, False)
+
+
+def _fsync_directory(path):
+    '''Makes a rename within a file's directory durable (where possible)'''
+    try:
+        directory = os.open(
+            os.path.dirname(os.path.abspath(path)), os.O_RDONLY
+        )
+    except OSError:
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+
+def _temporary_file(path, mode, newline=None):
+    '''
+    Opens a new temporary file next to path, with the permissions path has
+    (or would have if it were created normally)
+    '''
+    descriptor, temp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + TEMP_SUFFIX,
+        dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        permissions = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        permissions = 0o666 & ~umask
+    with contextlib.suppress(OSError):
+        os.chmod(temp_path, permissions)
+    if 'b' in mode:
+        return os.fdopen(descriptor, mode), temp_path
+    return os.fdopen(descriptor, mode, newline=newline), temp_path
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', newline=None):
+    '''
+    Writes a file by writing a temporary file and renaming it into place,
+    so readers see either the old or the new version, never part of one
+
+    Used for files that can simply be rebuilt if lost, such as the sidecar
+    indexes; the work log itself is rewritten with atomic_rewrite().
+
+    Arguments: String (Path of the file to write), String (File mode),
+    String or None (Newline translation, for text modes)
+    '''
+    temp, temp_path = _temporary_file(path, mode, newline)
+    try:
+        with temp:
+            yield temp
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_rewrite(path='work_log.txt', mode='wb', newline=None):
+    '''
+    Rewrites a work log as a whole, without ever leaving it half written
+
+    The new version is written to a temporary file (the with block writes to
+    the file object yielded) and flushed to disk. The rename that puts it in
+    place is then recorded in the work log's journal, the rename is done,
+    the sidecar files (tombstones, indexes and rollups), whose record ids no
+    longer hold, are discarded, and finally the journal is removed. If the
+    with block raises, the work log is left as it was.
+
+    The caller should hold the work log's exclusive lock.
+
+    Arguments: String (Path to the work log), String (File mode), String or
+    None (Newline translation, for text modes)
+    '''
+    temp, temp_path = _temporary_file(path, mode, newline)
+    try:
+        with temp:
+            yield temp
+            temp.flush()
+            os.fsync(temp.fileno())
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+    journal_path = path + JOURNAL_SUFFIX
+    with open(journal_path, 'w') as journal:
+        json.dump({'target': path, 'temp': temp_path}, journal)
+        journal.flush()
+        os.fsync(journal.fileno())
+    _fsync_directory(path)
+
+    _commit(path, temp_path)
+
+
+def _commit(path, temp_path):
+    '''Puts a journalled rewrite in place and clears up after it'''
+    # Imported here as csv_functions imports this module.
+    from csv_functions import discard_sidecars
+
+    if os.path.exists(temp_path):
+        os.replace(temp_path, path)
+        _fsync_directory(path)
+    # (A rewrite recovered after the generation was bumped is bumped again,
+    # which only means older record ids are checked more carefully.)
+    next_generation(path)
+    discard_sidecars(path)
+    os.remove(path + JOURNAL_SUFFIX)
+
+
+def work_log_generation(path='work_log.txt'):
+    '''
+    Returns the generation of a work log: how many times it has been
+    rewritten or cleared (0 if it never has)
+
+    A log's record id refers to the same log for as long as the work log's
+    generation stays the same.
+
+    Argument: String (Path to the work log)
+    Returns: Integer
+    '''
+    try:
+        with open(path + GENERATION_SUFFIX) as generation:
+            return int(generation.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def next_generation(path='work_log.txt'):
+    '''
+    Moves a work log on to its next generation, e.g. when it's rewritten
+    (the caller should hold the work log's exclusive lock)
+
+    Argument: String (Path to the work log)
+    Returns: Integer (The new generation)
+    '''
+    generation = work_log_generation(path) + 1
+    with atomic_write(path + GENERATION_SUFFIX, 'w') as generation_file:
+        generation_file.write(str(generation))
+    return generation
+
+
+def recover_work_log(path='work_log.txt'):
+    '''
+    Finishes or undoes a rewrite of a work log that was interrupted
+
+    If the journal is complete, the rewrite was about to be put in place (or
+    had been, but not cleared up after), so it is committed. Otherwise the
+    work log was never touched, and the journal and any temporary files
+    left behind are removed.
+
+    Argument: String (Path to the work log)
+    Returns: Boolean (True if anything needed recovering)
+    '''
+    journal_path = path + JOURNAL_SUFFIX
+    temp_paths = glob.glob(glob.escape(path) + TEMP_SUFFIX + '*')
+    if not os.path.exists(journal_path) and not temp_paths:
+        return False
+
+    with work_log_lock(path):
+        recovered = False
+        try:
+            with open(journal_path) as journal:
+                entry = json.load(journal)
+            temp_path = entry['temp']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            # The journal itself was only partly written, so the rename it
+            # describes never happened.
+            os.remove(journal_path)
+            recovered = True
+        else:
+            _commit(path, temp_path)
+            recovered = True
+
+        # Any temporary files left are from rewrites that never got as far
+        # as the journal.
+        for temp_path in glob.glob(glob.escape(path) + TEMP_SUFFIX + '*'):
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+                recovered = True
+    return recovered
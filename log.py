@@ -1,6 +1,5 @@
-import csv
-
-from csv_functions import fetch_logs
+from instrumentation import timed
+from storage import get_storage
 from user_navigation_functions import (clear_screen, confirm_user_action, menu)
 from user_input_functions import (get_valid_date_format, get_valid_string,
                                   get_valid_time_spent)
@@ -54,19 +53,30 @@ class Log():
                 n=self.note)
         )
      
+    @timed('add_log')
     def add_log(self):
-        '''Appends comma separated attributes of a work log to work_log.txt'''
-        with open('work_log.txt', 'a+', newline='') as work_log:
-            logwriter = csv.writer(
-                work_log,
-                delimiter=',',
-                quotechar='|',
-                quoting=csv.QUOTE_MINIMAL
-            )
-            logwriter.writerow(
-                [self.date] + [self.task_name] +
-                [self.time_spent] + [self.note]
-            )
+        '''
+        Adds the attributes of a work log to the work log
+
+        The log is stored by the current backend's Storage (see storage.py):
+        as a comma separated row of work_log.txt with the csv backend, a
+        binary record of work_log.bin with the binary backend, or a row of
+        work_log.db with the sqlite backend. The log's record_id is set to
+        the one the storage gave it, and its generation to the storage's
+        (noted before the append, so that if the work log is rewritten in
+        between, the record id is treated as stale rather than trusted).
+        '''
+        storage = get_storage()
+        generation = storage.generation()
+        record_id = storage.append({
+            'date': self.date,
+            'task_name': self.task_name,
+            'time_spent': self.time_spent,
+            'note': self.note
+        })
+        if record_id is not None:
+            self.record_id = record_id
+            self.generation = generation
     
     def create_new_log(self):
         '''Get a new log from the user and write it to work_log.txt'''
@@ -77,44 +87,35 @@ class Log():
         self.display_log()
         input("\nHit 'Enter' to return to the Main Menu.")
     
+    @timed('delete_log')
     def delete_log(self):
         '''
-        Deletes a log from work_log.txt
+        Deletes a log from the work log
     
-        This rewrites the work_log.txt file, excluding a specific log the user
-        has chosen to delete. To do this, first, all the logs from fetch_logs()
-        are given their line numbers in the csv (with enumerate). Then the log
-        to be deleted is matched with its line number, allowing the file to be
-        rewritten with the exclusion of the line number associated with the
-        log to be deleted.
+        With the file backends, rather than rewriting the work log, this
+        marks the log as deleted by appending its record id (its byte offset
+        in the file) to the work log's tombstones, which readers then skip.
+        The space is reclaimed when compact_work_log() next rewrites the
+        file. The log is also removed from the text index and the report
+        rollups. With the sqlite backend, its row is deleted.
+
+        Logs that were found by a search know their record id, and the
+        generation of the work log it's from, so exactly that log is
+        deleted, even if others are identical to it. For a log that doesn't
+        (e.g. one built by hand), or whose record id is from before the
+        work log was last rewritten, the first log with matching details is
+        deleted instead.
         '''
-        # Create a list of logs matched with their "line numbers" by using
-        # enumerate.
-        logs_with_line_numbers = list(enumerate(fetch_logs(), 1))
-    
-        # For any log in that numbered list, if it has details that match the
-        # log scheduled for deletion, add its "line number" to a list of line
-        # numbers to be deleted.
-        line_numbers_to_delete = []
-        for num, log in logs_with_line_numbers:
-            if {
+        get_storage().delete(
+            {
                 'date': self.date,
                 'task_name': self.task_name,
                 'time_spent': self.time_spent,
                 'note': self.note
-            } == log:
-                line_numbers_to_delete.append(num)
-
-        # Re-write the work_logs.txt file, excluding any lines with
-        # line numbers that were scheduled for deletion. Line numbers are again
-        # generated with enumerate (and the header line is set to be 0).
-        with open("work_log.txt", "r+") as work_log:
-            data = work_log.readlines()
-            work_log.seek(0)
-            for line_num, line in enumerate(data, 0):
-                if line_num not in line_numbers_to_delete:
-                    work_log.write(line)
-            work_log.truncate()
+            },
+            getattr(self, 'record_id', None),
+            getattr(self, 'generation', None)
+        )
 
     def edit_log(self):
         '''
@@ -123,8 +124,8 @@ class Log():
         Using a dictionary of options to generate a menu, this asks whether the
         user would like to edit the date, title, duration, and/or note for a
         work log. The desired fields are retrieved, then a new log with the
-        editted and original fields (if any) is appended to work_log.txt --
-        while the original log is deleted from work_log.txt
+        editted and original fields (if any) is appended to the work log --
+        while the original log is deleted from the work log
         '''
         edit_options = {
             '1': 'Date',
@@ -180,5 +181,8 @@ class Log():
             # Update work_log.txt if the user confirms their edits by adding
             # the editted log, and deleting the original log.
             if confirm_user_action():
-                edited_log.add_log()
-                self.delete_log()
+                # Both changes are made under one lock, so no other process
+                # sees the work log with both versions (or neither).
+                with get_storage().lock():
+                    edited_log.add_log()
+                    self.delete_log()
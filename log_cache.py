@@ -0,0 +1,262 @@
+import array
+import atexit
+import os
+import struct
+
+from binary_log import is_binary_log, read_binary_table
+from csv_functions import iter_log_records, work_log_path
+from date_index import chronological_order, get_chronological_order
+from instrumentation import timed
+from locking import atomic_write, work_log_lock
+from log_table import LogTable
+from tombstones import TOMBSTONE_SUFFIX, load_tombstones
+
+
+# How many bytes from the end of the cached part of a work log are kept, to
+# check that a file which has grown was only appended to (not rewritten).
+_CHECK_BYTES = 64
+
+# Whether snapshots are also saved to disk (alongside the work log, e.g.
+# work_log.txt.snapshot), so the next run of the program starts with the
+# logs already parsed and sorted. Set WORK_LOG_SNAPSHOTS=0 to turn it off.
+SAVE_SNAPSHOTS = os.environ.get('WORK_LOG_SNAPSHOTS', '1') != '0'
+SNAPSHOT_SUFFIX = '.snapshot'
+
+# A saved snapshot starts with a header: magic (which changes whenever
+# Snapshot or LogTable change shape, so snapshots saved by an older version
+# are ignored rather than misread), the work log's inode, size and mtime,
+# whether it had tombstones and their inode, size and mtime, and the length
+# of the check bytes. The check bytes and the logs (see LogTable.tofile())
+# follow.
+_MAGIC = b'WLSNAP02'
+_HEADER = struct.Struct('<8sQqq?QqqI')
+
+# The process-wide cache of parsed logs: one Snapshot per work log path,
+# and the identity of the work log each saved snapshot was taken of.
+_snapshots = {}
+_saved = {}
+
+
+def _stat(path):
+    '''Returns (inode, size, mtime) for a file, or None if it's missing'''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _read_bytes(path, start, end):
+    '''Returns the bytes of a file between two offsets'''
+    with open(path, 'rb') as data:
+        data.seek(start)
+        return data.read(end - start)
+
+
+def _read_table(path, start_offset, end_offset, pool=None):
+    '''
+    Reads the live logs of a work log between two byte offsets into a
+    LogTable, in file order (binary work logs straight into its columns,
+    see binary_log.read_binary_table())
+    '''
+    if is_binary_log(path):
+        return read_binary_table(
+            path, start_offset, end_offset, load_tombstones(path), pool
+        )
+    table = LogTable(pool)
+    for record_id, log in iter_log_records(path, start_offset):
+        if record_id < end_offset:
+            table.append(log, record_id)
+    return table
+
+
+class Snapshot():
+    '''
+    The parsed, chronologically sorted logs of a work log at one point in
+    time, along with what's needed to tell how the file has changed since
+    '''
+
+    def __init__(self, path, saved=None):
+        self.path = path
+        # A snapshot saved by an earlier run (see _load_saved()) is given
+        # as (identity, tombstones, check bytes, logs).
+        if saved is not None:
+            self.identity, self.tombstones, self.check, self.logs = saved
+            return
+        self.identity = _stat(path)
+        self.tombstones = _stat(path + TOMBSTONE_SUFFIX)
+        # Only logs within the size noted above are read, so anything
+        # appended while reading is picked up by the next refresh().
+        logs = _read_table(path, None, self.identity[1])
+        self.logs = logs.take(get_chronological_order(logs, path))
+        self.check = self._tail_bytes()
+
+    def _tail_bytes(self):
+        '''Returns the last few bytes of the part of the file parsed'''
+        size = self.identity[1]
+        return _read_bytes(self.path, max(size - _CHECK_BYTES, 0), size)
+
+    def refresh(self):
+        '''
+        Brings the snapshot up to date with the work log
+
+        Returns False if the work log was truncated or rewritten (so the
+        snapshot has to be rebuilt). Otherwise, logs appended since the
+        snapshot was taken are parsed (and only those) and merged in, and
+        logs deleted since are dropped.
+        '''
+        identity = _stat(self.path)
+        tombstones = _stat(self.path + TOMBSTONE_SUFFIX)
+        if identity is None:
+            return False
+
+        if identity != self.identity:
+            inode, size, _ = self.identity
+            if identity[0] != inode or identity[1] < size:
+                return False
+            if self._tail_bytes() != self.check:
+                return False
+            tail = _read_table(self.path, size, identity[1], self.logs.pool)
+            tail = tail.take(chronological_order(tail.dates))
+            self.logs = self.logs.merged(tail)
+            self.identity = identity
+            self.check = self._tail_bytes()
+
+        if tombstones != self.tombstones:
+            old_size = 0
+            if (self.tombstones is not None and tombstones is not None and
+                    tombstones[0] == self.tombstones[0] and
+                    tombstones[1] >= self.tombstones[1]):
+                old_size = self.tombstones[1]
+            elif self.tombstones is not None:
+                # The tombstones were cleared or rewritten, which only
+                # happens when the work log itself is rewritten.
+                return False
+            dead = array.array('q')
+            if tombstones is not None:
+                data = _read_bytes(
+                    self.path + TOMBSTONE_SUFFIX, old_size, tombstones[1]
+                )
+                dead.frombytes(data[:len(data) - len(data) % dead.itemsize])
+            dead = set(dead)
+            if dead:
+                self.logs = self.logs.take(
+                    row for row, record_id in enumerate(self.logs.record_ids)
+                    if record_id not in dead
+                )
+            self.tombstones = tombstones
+        return True
+
+
+def _load_saved(path):
+    '''
+    Returns the snapshot of a work log saved by an earlier run, or None if
+    there isn't a usable one
+
+    The snapshot is only used if refresh() can bring it up to date, i.e.
+    the work log still has the inode, size and mtime it was taken at, or has
+    only been appended to since. The file is plain data (arrays, and JSON
+    for raw values), never anything that gets executed, as the directory
+    may be shared with other users (see locking.py).
+    '''
+    try:
+        with open(path + SNAPSHOT_SUFFIX, 'rb') as saved:
+            (magic, inode, size, mtime, has_tombstones, dead_inode,
+             dead_size, dead_mtime, check_size) = _HEADER.unpack(
+                saved.read(_HEADER.size)
+            )
+            if magic != _MAGIC:
+                return None
+            check = saved.read(check_size)
+            if len(check) != check_size:
+                return None
+            logs = LogTable.fromfile(saved)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # A snapshot that can't be read (e.g. truncated, or written by an
+        # older version) is simply taken again.
+        return None
+    identity = (inode, size, mtime)
+    tombstones = None
+    if has_tombstones:
+        tombstones = (dead_inode, dead_size, dead_mtime)
+    _saved[path] = identity
+    return Snapshot(path, (identity, tombstones, check, logs))
+
+
+def _save(snapshot):
+    '''Saves a snapshot alongside its work log (see load_logs())'''
+    tombstones = snapshot.tombstones or (0, 0, 0)
+    with atomic_write(snapshot.path + SNAPSHOT_SUFFIX) as saved:
+        saved.write(_HEADER.pack(
+            _MAGIC, *snapshot.identity, snapshot.tombstones is not None,
+            *tombstones, len(snapshot.check)
+        ))
+        saved.write(snapshot.check)
+        snapshot.logs.tofile(saved)
+    _saved[snapshot.path] = snapshot.identity
+
+
+def save_snapshots():
+    '''
+    Saves the snapshots that have changed since they were last saved (e.g.
+    as logs were added), so the next run doesn't parse those logs again
+
+    Called when the program exits, if SAVE_SNAPSHOTS is set.
+    '''
+    for path, snapshot in list(_snapshots.items()):
+        if _saved.get(path) != snapshot.identity:
+            try:
+                _save(snapshot)
+            except OSError:
+                pass
+
+
+if SAVE_SNAPSHOTS:
+    atexit.register(save_snapshots)
+
+
+@timed('load_logs')
+def load_logs(path=None):
+    '''
+    Returns the chronologically sorted logs of a work log (as a LogTable)
+
+    The parsed logs are cached for the life of the process, keyed by the
+    file's identity (inode, size and mtime). A later call only parses the
+    logs appended since the last one and merges them in, and drops any that
+    have been deleted; the whole file is only read again if it has been
+    truncated or rewritten (e.g. by clear_all_logs() or compaction).
+
+    If SAVE_SNAPSHOTS is set, the snapshot is also kept on disk between
+    runs: the first call loads the saved snapshot (refreshing it as above)
+    instead of parsing the whole work log, and a snapshot parsed from
+    scratch is saved straight away. (Snapshots changed by later appends or
+    deletions are saved when the program exits, see save_snapshots().)
+
+    The table returned is never modified afterwards, so it can be shared by
+    every Search.
+
+    Argument: String or None (Path to the work log -- None uses the current
+    backend's work log)
+    Returns: LogTable (Chronologically sorted logs)
+    '''
+    if path is None:
+        path = work_log_path()
+    # Writers are kept out while the snapshot is brought up to date, so the
+    # work log and its tombstones are read in a consistent state.
+    with work_log_lock(path, shared=True):
+        snapshot = _snapshots.get(path)
+        if snapshot is None and SAVE_SNAPSHOTS:
+            snapshot = _load_saved(path)
+        if snapshot is None or not snapshot.refresh():
+            snapshot = Snapshot(path)
+            if SAVE_SNAPSHOTS:
+                try:
+                    _save(snapshot)
+                except OSError:
+                    # Saving is only an optimisation (e.g. the directory
+                    # may be read only).
+                    pass
+        _snapshots[path] = snapshot
+    return snapshot.logs
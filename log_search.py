@@ -0,0 +1,257 @@
+import array
+import collections
+import os
+import threading
+
+from binary_log import is_binary_log
+from csv_functions import work_log_path
+from date_index import date_ordinal, date_range
+from instrumentation import count, timed
+from parallel_scan import PARALLEL_THRESHOLD, cancel_scans, parallel_search
+from query import compile_pattern, matches_text, phrase_regex
+from query_engine import QueryEngine
+from storage import get_storage
+from text_index import get_text_index, regex_trigrams
+
+
+# The results of recent queries run by LogSearch.find(): for each query
+# (and work log), the table of logs it was run over and the rows of that
+# table that matched. Up to RESULT_CACHE_ROWS rows are kept in all, the
+# least recently used results being dropped first.
+RESULT_CACHE_ROWS = 1 << 20
+_results = collections.OrderedDict()
+_results_guard = threading.Lock()
+
+
+class LogSearch():
+    '''
+    Searches over the work logs that don't involve the user
+
+    Each find_by_* method takes its search terms as arguments and returns
+    the matching logs (as LogRows) in chronological order -- lazily, where
+    it can. Search builds its interactive search_by_* methods on top of
+    these, and query_cli.py uses them directly (without importing anything
+    that prompts the user).
+
+    When the backend's storage runs searches itself (e.g. as SQL queries,
+    see sqlite_storage.py), each search is handed to it.
+
+    The table of all the logs is only loaded when first needed, so a search
+    can be set up straight away and the logs loaded as part of running it
+    (e.g. in the background, see async_search.py).
+    '''
+
+    def __init__(self):
+        self.storage = get_storage()
+        self._logs = None
+        # The generation of the storage the logs found are from. It's noted
+        # before they are loaded, so that a rewrite while they load makes
+        # their record ids look stale (see Storage.delete()), not current.
+        self.generation = self.storage.generation()
+
+    @property
+    def logs(self):
+        '''The chronologically sorted LogTable of every log'''
+        # With the file backends, the logs come from the process-wide cache,
+        # which only re-reads the work log when it has changed (and then, if
+        # logs were only appended, only reads the new ones).
+        if self._logs is None:
+            self._logs = self.storage.load_logs()
+        return self._logs
+
+    def cancel(self):
+        '''
+        Stops any parallel scan or storage query a search is running (e.g.
+        in another thread), where it can
+        '''
+        cancel_scans()
+        self.storage.cancel()
+
+    @timed('find')
+    def find(self, query):
+        '''
+        Finds the logs matching a query (see query.py), planning how to run
+        it from the storage's indexes
+
+        Results are remembered (as rows of the table of logs, 8 bytes a
+        match), so running a recent query again doesn't search again. A
+        change to the work log means a new table of logs (see log_cache.py),
+        so a remembered result is only used while the table it was found in
+        is still the current one.
+
+        Argument: Query
+        Returns: Iterator of LogRows (in chronological order)
+        '''
+        # A storage running searches itself keeps its own indexes and
+        # caches.
+        if self.storage.pushdown:
+            return query.find(self)
+
+        key = (os.path.abspath(self.storage.path), query)
+        table = self.logs
+        with _results_guard:
+            cached = _results.get(key)
+            if cached is not None and cached[0] is table:
+                _results.move_to_end(key)
+                count('query_cache_hit')
+                return (table[row] for row in cached[1])
+            # Results found in an older table of this work log are of no
+            # more use (and mustn't keep the old table in memory).
+            for stale in [
+                    other for other, (other_table, _) in _results.items()
+                    if other[0] == key[0] and other_table is not table]:
+                del _results[stale]
+        count('query_cache_miss')
+        return self._remember(key, table, query.find(self))
+
+    def _remember(self, key, table, matches):
+        '''
+        Yields a query's matches, remembering them (see find()) once they
+        have all been found
+        '''
+        rows = array.array('q')
+        for log in matches:
+            rows.append(log.row)
+            yield log
+        if len(rows) > RESULT_CACHE_ROWS:
+            return
+        with _results_guard:
+            _results[key] = (table, rows)
+            _results.move_to_end(key)
+            total = sum(len(rows) for _, rows in _results.values())
+            while total > RESULT_CACHE_ROWS:
+                _, (_, dropped) = _results.popitem(last=False)
+                total -= len(dropped)
+
+    def logs_with_record_ids(self, record_ids):
+        '''
+        Yields the logs (in chronological order) whose record ids are in a
+        set, e.g. the candidates found by an index
+        '''
+        for row, record_id in enumerate(self.logs.record_ids):
+            if record_id in record_ids:
+                yield self.logs[row]
+
+    def dates(self):
+        '''Returns the unique dates of the logs, in chronological order'''
+        if self.storage.pushdown:
+            return self.storage.dates()
+        # dict.fromkeys() drops repeated dates but keeps the order.
+        return list(dict.fromkeys(log['date'] for log in self.logs))
+
+    @timed('find_by_date')
+    def find_by_date(self, date):
+        '''
+        Finds the logs with a given date
+
+        Argument: String (Date, as written in the work log)
+        Returns: Iterator of LogRows
+        '''
+        if self.storage.pushdown:
+            return self.storage.find_by_date(date)
+
+        # The logs with the same date ordinal are found by binary search,
+        # then compared as strings in case dates were written differently.
+        ordinal = date_ordinal(date)
+        low, high = date_range(self.logs.dates, ordinal, ordinal)
+        return (
+            self.logs[row] for row in range(low, high)
+            if self.logs.value(row, 'date') == date
+        )
+
+    @timed('find_by_date_range')
+    def find_by_date_range(self, start_date, end_date):
+        '''
+        Finds the logs with dates between two dates (inclusive)
+
+        Since self.logs is in chronological order, the range check is done
+        with two binary searches over its column of date ordinals, and the
+        matching logs are a single run of rows of self.logs (whose LogRows
+        are only made as they are needed).
+
+        Arguments: Strings (Start and end dates, DD/MM/YYYY)
+        Returns: Iterator of LogRows
+        '''
+        if self.storage.pushdown:
+            return self.storage.find_by_date_range(start_date, end_date)
+
+        low, high = date_range(
+            self.logs.dates, date_ordinal(start_date), date_ordinal(end_date)
+        )
+        return (self.logs[row] for row in range(low, high))
+
+    @timed('find_by_time_spent')
+    def find_by_time_spent(self, minutes):
+        '''
+        Finds the logs with a given duration
+
+        Minutes are compared as numbers (so '030' matches 30) using a
+        QueryEngine over the table's time_spent column.
+
+        Argument: Integer (Minutes)
+        Returns: Iterator of LogRows
+        '''
+        if self.storage.pushdown:
+            return self.storage.find_by_time_spent(minutes)
+
+        matches = QueryEngine.of(self.logs).equals('time_spent', int(minutes))
+        return (self.logs[row] for row in matches.rows())
+
+    @timed('find_by_string')
+    def find_by_string(self, text):
+        '''
+        Finds the logs with titles or notes containing a string
+
+        The string is searched for as it is, ignoring case (so '.' or '('
+        only match themselves, see query.phrase_regex()), narrowed down by
+        the text index (see _find_text()).
+
+        Argument: String (Word or phrase)
+        Returns: Iterator of LogRows
+        '''
+        if self.storage.pushdown:
+            return self.storage.find_by_string(text)
+        return self._find_text(phrase_regex(text))
+
+    @timed('find_by_pattern')
+    def find_by_pattern(self, regex):
+        '''
+        Finds the logs with titles or notes matching a regex (see
+        _find_text())
+
+        Argument: Compiled Regex (or a pattern String)
+        Returns: Iterator of LogRows
+        '''
+        if self.storage.pushdown:
+            return self.storage.find_by_pattern(regex)
+
+        if isinstance(regex, str):
+            regex = compile_pattern(regex)
+        return self._find_text(regex)
+
+    def _find_text(self, regex):
+        '''
+        Finds the logs with titles or notes matching a regex
+
+        When the regex needs some literal text, the trigram index finds the
+        logs that could match it (see text_index.py), and only those are
+        checked. Otherwise, large csv work logs are scanned by several
+        processes at once (see parallel_scan.py), with the matches put back
+        in chronological order; if that scan takes too long,
+        parallel_scan.ScanTimeout is raised. Failing both, every log is
+        checked.
+        '''
+        path = work_log_path()
+        candidates = None
+        if regex_trigrams(regex) is not None:
+            candidates = get_text_index(path).regex_candidates(
+                regex, len(self.logs)
+            )
+        if candidates is not None:
+            logs = self.logs_with_record_ids(candidates)
+        elif (os.path.getsize(path) >= PARALLEL_THRESHOLD and
+                not is_binary_log(path)):
+            return self.logs_with_record_ids(parallel_search(regex, path))
+        else:
+            logs = self.logs
+        return (log for log in logs if matches_text(regex, log))
@@ -0,0 +1,415 @@
+import array
+import datetime
+import heapq
+import itertools
+import json
+import struct
+
+from date_index import date_ordinal, date_range
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+# Only this many distinct strings are interned (deduplicated) in a table's
+# string pool. Task names repeat a lot and are always interned; past the
+# limit, new one-off notes are simply appended, which keeps the intern map
+# from growing as large as the logs themselves.
+INTERN_LIMIT = 1 << 16
+
+# The headers written by StringPool.tofile() (number of strings, bytes of
+# text and interned strings) and LogTable.tofile() (number of rows, bytes of
+# raw values).
+_POOL_HEADER = struct.Struct('<qqq')
+_TABLE_HEADER = struct.Struct('<qq')
+
+
+def _read_exactly(source, size):
+    '''Reads a number of bytes from a file, raising EOFError if it's short'''
+    data = source.read(size)
+    if len(data) != size:
+        raise EOFError
+    return data
+
+
+def _format_date(ordinal):
+    '''Formats a date ordinal as a DD/MM/YYYY string'''
+    date = datetime.date.fromordinal(ordinal)
+    return '{:02d}/{:02d}/{:04d}'.format(date.day, date.month, date.year)
+
+
+def _is_canonical_date(date):
+    '''
+    Checks that a date string is exactly what _format_date() would produce
+    for its ordinal (i.e. zero padded DD/MM/YYYY), so it needn't be kept raw
+    '''
+    return (
+        len(date) == 10 and date.isascii() and
+        date[2] == date[5] == '/' and
+        (date[:2] + date[3:5] + date[6:]).isdigit()
+    )
+
+
+class StringPool():
+    '''
+    An append-only pool of utf-8 encoded strings, referenced by id
+
+    All strings are stored in one bytearray, string i spanning the bytes
+    starts[i]:starts[i + 1], so a string costs its encoded length plus an
+    8 byte offset instead of a whole Python str object.
+    '''
+
+    def __init__(self):
+        self._data = bytearray()
+        self._starts = array.array('q', [0])
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._starts) - 1
+
+    def add(self, text):
+        '''Adds a string to the pool and returns its id'''
+        string_id = self._ids.get(text)
+        if string_id is None:
+            string_id = len(self)
+            self._data += text.encode('utf-8')
+            self._starts.append(len(self._data))
+            if len(self._ids) < INTERN_LIMIT:
+                self._ids[text] = string_id
+        return string_id
+
+    def add_encoded(self, strings):
+        '''
+        Adds a list of utf-8 encoded strings to the pool in one go, without
+        interning them, and returns the id of the first (the rest follow
+        in order)
+        '''
+        first = len(self)
+        self._starts.extend(itertools.islice(
+            itertools.accumulate(map(len, strings), initial=len(self._data)),
+            1, None
+        ))
+        self._data += b''.join(strings)
+        return first
+
+    def get(self, string_id):
+        '''Returns the string with the given id'''
+        return self._data[
+            self._starts[string_id]:self._starts[string_id + 1]
+        ].decode('utf-8')
+
+    def tofile(self, target):
+        '''Writes the pool to a binary file (see fromfile())'''
+        interned = array.array('q', self._ids.values())
+        target.write(_POOL_HEADER.pack(len(self), len(self._data),
+                                       len(interned)))
+        self._starts.tofile(target)
+        target.write(self._data)
+        interned.tofile(target)
+
+    @classmethod
+    def fromfile(cls, source):
+        '''
+        Reads a pool written by tofile()
+
+        Raises EOFError or ValueError if the file is short or the pool
+        doesn't add up.
+        '''
+        pool = cls()
+        count, size, interned_count = _POOL_HEADER.unpack(
+            _read_exactly(source, _POOL_HEADER.size)
+        )
+        starts = array.array('q')
+        starts.fromfile(source, count + 1)
+        if starts[0] != 0 or starts[-1] != size:
+            raise ValueError('string pool offsets are inconsistent')
+        pool._starts = starts
+        pool._data = bytearray(_read_exactly(source, size))
+        interned = array.array('q')
+        interned.fromfile(source, interned_count)
+        if not all(0 <= string_id < count for string_id in interned):
+            raise ValueError('interned string id out of range')
+        pool._ids = {pool.get(string_id): string_id for string_id in interned}
+        return pool
+
+
+class LogRow():
+    '''
+    A lightweight view of one row of a LogTable
+
+    Rows behave like the dictionaries csv.DictReader produces (log['date'],
+    log.keys(), Log(**log)) and also expose the fields as attributes, but
+    only hold a reference to their table and a row number. A row's
+    record_id identifies the log in the work log file (see tombstones.py).
+    '''
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, field):
+        return self.table.value(self.row, field)
+
+    def keys(self):
+        return self.table.fields(self.row)
+
+    def as_dict(self):
+        '''Returns the row as a plain dictionary'''
+        return {field: self[field] for field in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, LogRow):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __repr__(self):
+        return 'LogRow({!r})'.format(self.as_dict())
+
+    @property
+    def record_id(self):
+        return self.table.record_ids[self.row]
+
+    @property
+    def date(self):
+        return self['date']
+
+    @property
+    def task_name(self):
+        return self['task_name']
+
+    @property
+    def time_spent(self):
+        return self['time_spent']
+
+    @property
+    def note(self):
+        return self['note']
+
+
+class LogTable():
+    '''
+    A columnar, compact store of work logs
+
+    Instead of one dictionary of four strings per log, each field is a
+    column: dates as an array of ordinals, time spent as an array of
+    integers, and task names and notes as arrays of ids into a shared
+    StringPool. Indexing a table gives LogRow views, so code written against
+    lists of log dictionaries keeps working. Each row also keeps the record
+    id of its log (-1 if it isn't known).
+
+    Values that can't be stored exactly in a column (dates or times that
+    aren't in their canonical form, missing fields and so on) are kept,
+    as read, in a small per-row dictionary of raw values, so a table always
+    returns exactly what was in the work log.
+    '''
+
+    def __init__(self, pool=None):
+        self.dates = array.array('i')
+        self.time_spent = array.array('i')
+        self.task_names = array.array('i')
+        self.notes = array.array('i')
+        self.record_ids = array.array('q')
+        self.pool = pool if pool is not None else StringPool()
+        self.raw = {}
+        # The QueryEngine over the table, built the first time it's queried
+        # (see QueryEngine.of()).
+        self.query_engine = None
+
+    @classmethod
+    def from_logs(cls, logs):
+        '''Builds a table from an iterable of log dictionaries'''
+        table = cls()
+        for log in logs:
+            table.append(log)
+        return table
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Builds a table from an iterable of (record id, log dictionary) pairs,
+        as yielded by iter_log_records()
+        '''
+        table = cls()
+        for record_id, log in records:
+            table.append(log, record_id)
+        return table
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        for row in range(len(self.dates)):
+            yield LogRow(self, row)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [LogRow(self, r) for r in range(len(self.dates))[row]]
+        if row < 0:
+            row += len(self.dates)
+        if not 0 <= row < len(self.dates):
+            raise IndexError(row)
+        return LogRow(self, row)
+
+    def append(self, log, record_id=-1):
+        '''Adds a log (a dictionary, as read from the work log) to the table'''
+        row = len(self.dates)
+        raw = {}
+        self.record_ids.append(record_id)
+
+        date = log.get('date')
+        ordinal = date_ordinal(date)
+        if not ordinal or not _is_canonical_date(date):
+            raw['date'] = date
+        self.dates.append(ordinal)
+
+        time_spent = log.get('time_spent')
+        try:
+            minutes = int(time_spent)
+            if str(minutes) != time_spent or not -2**31 <= minutes < 2**31:
+                raise ValueError
+        except (TypeError, ValueError):
+            raw['time_spent'] = time_spent
+            minutes = 0
+        self.time_spent.append(minutes)
+
+        for field, column in (('task_name', self.task_names),
+                              ('note', self.notes)):
+            text = log.get(field)
+            if isinstance(text, str):
+                column.append(self.pool.add(text))
+            else:
+                raw[field] = text
+                column.append(-1)
+
+        # Fields beyond the usual four (e.g. csv.DictReader's None key for
+        # extra values) are kept too.
+        for field in log:
+            if field not in FIELDS:
+                raw[field] = log[field]
+        if len(log) < len(FIELDS):
+            raw['_missing'] = tuple(f for f in FIELDS if f not in log)
+
+        if raw:
+            self.raw[row] = raw
+
+    def tofile(self, target):
+        '''
+        Writes the table (and its string pool) to a binary file: the
+        columns as arrays, and the raw values as JSON
+        '''
+        raw = json.dumps([
+            [row, list(values.items())] for row, values in self.raw.items()
+        ]).encode('utf-8')
+        target.write(_TABLE_HEADER.pack(len(self), len(raw)))
+        for column in (self.dates, self.time_spent, self.task_names,
+                       self.notes, self.record_ids):
+            column.tofile(target)
+        target.write(raw)
+        self.pool.tofile(target)
+
+    @classmethod
+    def fromfile(cls, source):
+        '''
+        Reads a table written by tofile()
+
+        Raises EOFError or ValueError if the file is short or malformed.
+        '''
+        table = cls()
+        rows, raw_size = _TABLE_HEADER.unpack(
+            _read_exactly(source, _TABLE_HEADER.size)
+        )
+        for column in (table.dates, table.time_spent, table.task_names,
+                       table.notes, table.record_ids):
+            column.fromfile(source, rows)
+        for row, values in json.loads(_read_exactly(source, raw_size)):
+            values = dict(values)
+            if '_missing' in values:
+                values['_missing'] = tuple(values['_missing'])
+            table.raw[row] = values
+        table.pool = StringPool.fromfile(source)
+        return table
+
+    def fields(self, row):
+        '''Returns the field names a row has (normally just FIELDS)'''
+        raw = self.raw.get(row)
+        if raw is None:
+            return FIELDS
+        missing = raw.get('_missing', ())
+        return tuple(f for f in FIELDS if f not in missing) + tuple(
+            f for f in raw if f not in FIELDS and f != '_missing'
+        )
+
+    def value(self, row, field):
+        '''Returns the value of a field for a row, as read from the work log'''
+        raw = self.raw.get(row)
+        if raw is not None and field in raw:
+            return raw[field]
+        if field == 'date':
+            return _format_date(self.dates[row])
+        if field == 'time_spent':
+            return str(self.time_spent[row])
+        if field == 'task_name':
+            return self.pool.get(self.task_names[row])
+        if field == 'note':
+            return self.pool.get(self.notes[row])
+        raise KeyError(field)
+
+    def find_log(self, log):
+        '''
+        Finds the row of the first log (in storage order) with the same
+        details as a given log, or None if there isn't one
+
+        The table must be in chronological order, as load_logs() returns
+        it. Only the rows of the log's date need checking, and those are
+        found with a binary search; logs sharing a date are in storage
+        order (see date_index.chronological_order()), so the first match
+        is the earliest stored.
+
+        Argument: Dictionary (A log)
+        Returns: Integer (Row) or None
+        '''
+        ordinal = date_ordinal(log.get('date'))
+        low, high = date_range(self.dates, ordinal, ordinal)
+        for row in range(low, high):
+            if LogRow(self, row) == log:
+                return row
+        return None
+
+    def _copy_row(self, source, row):
+        '''Appends a row of another table (sharing this one's pool)'''
+        if row in source.raw:
+            self.raw[len(self.dates)] = source.raw[row]
+        self.dates.append(source.dates[row])
+        self.time_spent.append(source.time_spent[row])
+        self.task_names.append(source.task_names[row])
+        self.notes.append(source.notes[row])
+        self.record_ids.append(source.record_ids[row])
+
+    def take(self, rows):
+        '''
+        Returns a new table holding the given rows, in the given order
+
+        The new table shares this table's string pool, so reordering a table
+        (e.g. chronologically) only copies its integer columns.
+        '''
+        table = LogTable(self.pool)
+        for row in rows:
+            table._copy_row(self, row)
+        return table
+
+    def merged(self, other):
+        '''
+        Returns a new table holding the rows of this table and another
+
+        Both tables must be in chronological order and share a string pool.
+        The rows are merged (rather than sorted) into chronological order,
+        with this table's rows coming before the other's on the same date.
+        '''
+        table = LogTable(self.pool)
+        rows = heapq.merge(
+            ((date, 0, row) for row, date in enumerate(self.dates)),
+            ((date, 1, row) for row, date in enumerate(other.dates))
+        )
+        for _, source, row in rows:
+            table._copy_row(other if source else self, row)
+        return table
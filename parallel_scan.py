@@ -0,0 +1,211 @@
+import concurrent.futures
+import csv
+import os
+import re
+import threading
+import time
+
+from instrumentation import timed
+
+
+# Settings for parallel regex scans, each of which can be set with an
+# environment variable: how many worker processes to use, roughly how many
+# bytes of the work log each worker scans at a time, how many seconds to
+# wait for a scan before cancelling it, and how big (in bytes) a work log
+# must be before a scan is worth running in parallel.
+WORKERS = int(os.environ.get('WORK_LOG_SCAN_WORKERS', os.cpu_count() or 1))
+CHUNK_SIZE = int(os.environ.get('WORK_LOG_SCAN_CHUNK_SIZE', 8 * 1024 * 1024))
+TIMEOUT = float(os.environ.get('WORK_LOG_SCAN_TIMEOUT', 30))
+PARALLEL_THRESHOLD = int(
+    os.environ.get('WORK_LOG_SCAN_THRESHOLD', 32 * 1024 * 1024)
+)
+
+# How often (in seconds) a running scan checks whether it's been cancelled.
+POLL_INTERVAL = 0.1
+
+# The cancellation events of the scans running in this process.
+_running = set()
+_running_guard = threading.Lock()
+
+
+class ScanTimeout(Exception):
+    '''Raised when a parallel scan is cancelled for taking too long'''
+
+
+class ScanCancelled(ScanTimeout):
+    '''Raised when a parallel scan is cancelled by cancel_scans()'''
+
+
+def cancel_scans():
+    '''
+    Cancels every parallel scan running in this process, e.g. when the user
+    cancels a search running in another thread (see async_search.py)
+    '''
+    with _running_guard:
+        for cancelled in _running:
+            cancelled.set()
+
+
+def split_ranges(path='work_log.txt', chunk_size=None):
+    '''
+    Splits a csv work log into newline aligned byte ranges
+
+    Each range starts at the beginning of a row and ends just after a
+    newline (or at the end of the file), so every row falls in exactly one
+    range. The header row isn't included in any range.
+
+    Arguments: String (Path to the csv work log), Integer or None (Rough
+    size of each range in bytes -- CHUNK_SIZE by default)
+    Returns: List of Tuples (Start and end byte offsets of each range)
+    '''
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    ranges = []
+    with open(path, 'rb') as work_log:
+        work_log.readline()
+        start = work_log.tell()
+        size = os.fstat(work_log.fileno()).st_size
+        while start < size:
+            work_log.seek(start + max(chunk_size, 1) - 1)
+            work_log.readline()
+            end = min(work_log.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _scan_range(path, start, end, pattern, flags):
+    '''
+    Finds the rows in one byte range of a csv work log matching a regex
+
+    Runs in a worker process, so only the record ids (byte offsets) of the
+    matching rows are sent back.
+    '''
+    regex = re.compile(pattern, flags)
+    matches = []
+    with open(path, 'rb') as work_log:
+        header = work_log.readline().decode('utf-8')
+        fieldnames = next(csv.reader([header], quotechar='|'), [])
+        task_name = fieldnames.index('task_name')
+        note = fieldnames.index('note')
+
+        work_log.seek(start)
+        offset = start
+        for line in work_log.read(end - start).splitlines(keepends=True):
+            text = line.decode('utf-8')
+            # Only rows with quoted fields need the csv module to split them.
+            if '|' in text:
+                row = next(csv.reader([text], quotechar='|'), [])
+            else:
+                row = text.rstrip('\r\n').split(',')
+            if len(row) > max(task_name, note) and (
+                    regex.search(row[task_name]) or regex.search(row[note])):
+                matches.append(offset)
+            offset += len(line)
+    return matches
+
+
+def _cancel(executor):
+    '''Stops an executor's queued and running work straight away'''
+    # A worker stuck in a catastrophic regex never checks for cancellation,
+    # so its process has to be terminated. (Shutting down the executor
+    # forgets its processes, so they are gathered first.)
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+@timed('parallel_search')
+def parallel_search(regex, path='work_log.txt', workers=None,
+                    chunk_size=None, timeout=None):
+    '''
+    Searches a csv work log for a regex using several processes
+
+    The file is split into newline aligned ranges (see split_ranges()) and
+    each range is scanned by a ProcessPoolExecutor worker. If the scan takes
+    longer than timeout seconds, or is interrupted with Ctrl-C, the workers
+    are killed and ScanTimeout (or KeyboardInterrupt) is raised. Likewise
+    if cancel_scans() is called, when ScanCancelled is raised.
+
+    Arguments: Compiled Regex, String (Path to the csv work log), Integers
+    or None (Number of workers, rough range size in bytes), Float or None
+    (Seconds to wait) -- None uses the module's settings
+    Returns: Set of Integers (Record ids of the matching rows, including any
+    deleted ones)
+    '''
+    return parallel_search_files(
+        regex, [path], workers, chunk_size, timeout
+    )[path]
+
+
+@timed('parallel_search_files')
+def parallel_search_files(regex, paths, workers=None, chunk_size=None,
+                          timeout=None):
+    '''
+    Searches several csv work logs for a regex at once, using several
+    processes (see parallel_search())
+
+    The ranges of every file are scanned by the same pool of workers, so
+    many small files (e.g. the partitions of a partitioned work log) are
+    searched as quickly as one large one.
+
+    Arguments: Compiled Regex, List of Strings (Paths to the csv work logs),
+    Integers or None (Number of workers, rough range size in bytes), Float
+    or None (Seconds to wait) -- None uses the module's settings
+    Returns: Dictionary (Path -> Set of Integers, the record ids of the
+    matching rows in that file, including any deleted ones)
+    '''
+    if workers is None:
+        workers = WORKERS
+    if timeout is None:
+        timeout = TIMEOUT
+
+    cancelled = threading.Event()
+    with _running_guard:
+        _running.add(cancelled)
+    executor = concurrent.futures.ProcessPoolExecutor(max(workers, 1))
+    try:
+        try:
+            futures = {
+                executor.submit(
+                    _scan_range, path, start, end, regex.pattern,
+                    regex.flags
+                ): path
+                for path in paths
+                for start, end in split_ranges(path, chunk_size)
+            }
+            # Wait for the workers a little at a time, so a cancellation
+            # is noticed promptly.
+            deadline = time.monotonic() + timeout
+            not_done = set(futures)
+            while not_done and not cancelled.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _, not_done = concurrent.futures.wait(
+                    not_done, min(remaining, POLL_INTERVAL)
+                )
+        except KeyboardInterrupt:
+            _cancel(executor)
+            raise
+        finally:
+            with _running_guard:
+                _running.discard(cancelled)
+        if not_done:
+            _cancel(executor)
+            if cancelled.is_set():
+                raise ScanCancelled('Search cancelled')
+            raise ScanTimeout(
+                'Search cancelled after {} seconds'.format(timeout)
+            )
+        executor.shutdown()
+
+        matches = {path: set() for path in paths}
+        for future, path in futures.items():
+            matches[path].update(future.result())
+        return matches
+    finally:
+        # Whatever went wrong (e.g. a file replaced part way through the
+        # scan), the pool's processes aren't left running.
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,523 @@
+'''
+A work log split into one csv file per month
+
+With the partitioned backend, the logs are kept in a directory, work_logs,
+holding one csv work log per month of dates (e.g. work_logs/2018-04.csv,
+with any logs whose date can't be read in work_logs/undated.csv) and a small
+manifest, work_logs/manifest.json, recording each partition's earliest and
+latest date and how many logs it holds. Each partition is an ordinary csv
+work log, with its own tombstones, indexes and rollups (see FileStorage).
+
+Searches by date only open the partitions whose dates overlap the search
+(partition pruning), and text and regex searches of large work logs scan
+every partition at once (see parallel_scan.parallel_search_files()).
+
+A log's record id combines the number of its partition (see
+partition_number()) with its byte offset within the partition. The
+directory has a generation (e.g. work_logs.generation, see
+locking.work_log_generation()), moved on whenever any partition is
+rewritten or the logs are cleared.
+'''
+import array
+import csv
+import datetime
+import json
+import os
+import shutil
+
+from aggregates import Stats, report
+from csv_functions import discard_sidecars, iter_log_records
+from date_index import date_ordinal, date_range
+from locking import (TEMP_SUFFIX, atomic_write, next_generation,
+                     recover_work_log, work_log_generation, work_log_lock)
+from log_cache import load_logs
+from log_table import FIELDS, LogTable
+from parallel_scan import PARALLEL_THRESHOLD, parallel_search_files
+from query import compile_pattern, phrase_regex
+from query_engine import QueryEngine
+from storage import FileStorage, Storage
+from text_index import get_text_index, regex_trigrams
+from tombstones import compact_work_log
+
+
+HEADER = 'date,task_name,time_spent,note\n'
+MANIFEST = 'manifest.json'
+PARTITION_SUFFIX = '.csv'
+UNDATED = 'undated'
+
+# Record ids are the partition number shifted left by this many bits, plus
+# the byte offset, which leaves room for partitions of up to 1 TB.
+PARTITION_SHIFT = 40
+
+
+def partition_key(date):
+    '''
+    Returns the key of the partition a log with a given date belongs in:
+    'YYYY-MM', or 'undated' if the date can't be read
+    '''
+    ordinal = date_ordinal(date)
+    if not ordinal:
+        return UNDATED
+    date = datetime.date.fromordinal(ordinal)
+    return '{:04d}-{:02d}'.format(date.year, date.month)
+
+
+def partition_number(key):
+    '''
+    Returns the number of a partition: 0 for undated logs, then one number
+    per month, so partitions sort chronologically by number
+    '''
+    if key == UNDATED:
+        return 0
+    year, month = key.split('-')
+    return int(year) * 12 + int(month)
+
+
+def split_record_id(record_id):
+    '''Returns the partition key and byte offset a record id refers to'''
+    number = record_id >> PARTITION_SHIFT
+    offset = record_id & ((1 << PARTITION_SHIFT) - 1)
+    if not number:
+        return UNDATED, offset
+    year, month = divmod(number - 1, 12)
+    return '{:04d}-{:02d}'.format(year, month + 1), offset
+
+
+def partition_keys(directory='work_logs'):
+    '''Returns the keys of the partitions in a directory, in order'''
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (name[:-len(PARTITION_SUFFIX)] for name in names
+         if name.endswith(PARTITION_SUFFIX)),
+        key=partition_number
+    )
+
+
+class Manifest():
+    '''
+    The partitions of a partitioned work log, with the earliest and latest
+    date (as ISO dates, None for the undated partition) and the number of
+    logs of each
+
+    When logs are deleted, a partition's dates are left as they were: they
+    are still bounds on its dates, which is all pruning needs.
+    '''
+
+    def __init__(self, partitions=None):
+        self.partitions = partitions if partitions is not None else {}
+
+    def keys(self):
+        '''Returns the partition keys, in chronological order'''
+        return sorted(self.partitions, key=partition_number)
+
+    def add(self, key, log):
+        '''Counts a log added to a partition'''
+        entry = self.partitions.setdefault(
+            key, {'min_date': None, 'max_date': None, 'rows': 0}
+        )
+        entry['rows'] += 1
+        ordinal = date_ordinal(log['date'])
+        if ordinal:
+            date = datetime.date.fromordinal(ordinal).isoformat()
+            if entry['min_date'] is None or date < entry['min_date']:
+                entry['min_date'] = date
+            if entry['max_date'] is None or date > entry['max_date']:
+                entry['max_date'] = date
+
+    def remove(self, key, count=1):
+        '''Stops counting logs deleted from a partition'''
+        entry = self.partitions.get(key)
+        if entry is not None:
+            entry['rows'] = max(entry['rows'] - count, 0)
+
+    def overlapping(self, start, end):
+        '''
+        Returns the keys of the partitions that could hold logs dated
+        between two ordinals (inclusive), in chronological order
+        '''
+        keys = []
+        for key in self.keys():
+            entry = self.partitions[key]
+            # Undated logs have an ordinal of 0 (see date_ordinal()).
+            low = high = 0
+            if entry['min_date'] is not None:
+                low = datetime.date.fromisoformat(
+                    entry['min_date']
+                ).toordinal()
+                high = datetime.date.fromisoformat(
+                    entry['max_date']
+                ).toordinal()
+            if low <= end and high >= start:
+                keys.append(key)
+        return keys
+
+    @classmethod
+    def build(cls, directory='work_logs'):
+        '''Builds the manifest by reading every partition'''
+        manifest = cls()
+        for key in partition_keys(directory):
+            manifest.partitions[key] = {
+                'min_date': None, 'max_date': None, 'rows': 0
+            }
+            path = os.path.join(directory, key + PARTITION_SUFFIX)
+            for _, log in iter_log_records(path):
+                manifest.add(key, log)
+        return manifest
+
+    @classmethod
+    def load(cls, directory='work_logs'):
+        '''Loads the saved manifest, or returns None if it can't be read'''
+        try:
+            with open(os.path.join(directory, MANIFEST)) as manifest:
+                return cls(json.load(manifest)['partitions'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, directory='work_logs'):
+        with atomic_write(os.path.join(directory, MANIFEST), 'w') as manifest:
+            json.dump(
+                {'partitions': self.partitions}, manifest, indent=2,
+                sort_keys=True
+            )
+
+
+def get_manifest(directory='work_logs'):
+    '''
+    Returns the manifest of a partitioned work log, rebuilding it if it is
+    missing or doesn't list exactly the partitions in the directory
+    '''
+    manifest = Manifest.load(directory)
+    if manifest is None or manifest.keys() != partition_keys(directory):
+        manifest = Manifest.build(directory)
+        try:
+            manifest.save(directory)
+        except OSError:
+            pass
+    return manifest
+
+
+def partition_work_log(csv_path='work_log.txt', directory='work_logs'):
+    '''
+    Copies every log of a csv work log into a new partitioned work log
+
+    The partitions are written to a temporary directory alongside, which is
+    only renamed into place once complete, so an interrupted copy leaves no
+    partitioned work log behind (and is simply run again).
+
+    Arguments: String (Path to the csv work log), String (Directory of the
+    partitioned work log to create)
+    Returns: Integer (Number of logs copied)
+    '''
+    temp_directory = directory + TEMP_SUFFIX + 'partition'
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+
+    manifest = Manifest()
+    partitions = {}
+    writers = {}
+    try:
+        for _, log in iter_log_records(csv_path):
+            key = partition_key(log['date'])
+            writer = writers.get(key)
+            if writer is None:
+                partition = partitions[key] = open(
+                    os.path.join(temp_directory, key + PARTITION_SUFFIX),
+                    'w', newline=''
+                )
+                partition.write(HEADER)
+                writer = writers[key] = csv.writer(
+                    partition,
+                    delimiter=',',
+                    quotechar='|',
+                    quoting=csv.QUOTE_MINIMAL
+                )
+            writer.writerow([log[field] for field in FIELDS])
+            manifest.add(key, log)
+        for partition in partitions.values():
+            partition.flush()
+            os.fsync(partition.fileno())
+    finally:
+        for partition in partitions.values():
+            partition.close()
+
+    manifest.save(temp_directory)
+    os.rename(temp_directory, directory)
+    return sum(entry['rows'] for entry in manifest.partitions.values())
+
+
+def check_partitions(directory='work_logs'):
+    '''
+    Recovers any interrupted rewrite of each partition, compacts those with
+    enough deleted logs and makes sure the manifest is up to date
+    '''
+    rewritten = False
+    for key in partition_keys(directory):
+        path = os.path.join(directory, key + PARTITION_SUFFIX)
+        if recover_work_log(path):
+            rewritten = True
+        if compact_work_log(path):
+            rewritten = True
+    # The record ids of a rewritten partition have changed.
+    if rewritten:
+        next_generation(directory)
+    get_manifest(directory)
+
+
+class PartitionedStorage(Storage):
+    '''
+    A work log kept as one csv file per month (see the module docstring)
+
+    Changes are made holding the lock of the whole directory, as well as
+    (by FileStorage) the lock of the partition changed.
+    '''
+
+    pushdown = True
+
+    def __init__(self, path='work_logs'):
+        super().__init__(path)
+        # The table of logs of each partition (from log_cache) and a copy
+        # of it whose record ids are those of the whole work log.
+        self._tables = {}
+
+    def partition_path(self, key):
+        '''Returns the path of a partition's csv file'''
+        return os.path.join(self.path, key + PARTITION_SUFFIX)
+
+    def manifest(self):
+        '''Returns the up to date manifest'''
+        with work_log_lock(self.path, shared=True):
+            return get_manifest(self.path)
+
+    def _partition(self, key):
+        '''
+        Returns a partition's chronologically sorted logs twice: with the
+        partition's record ids, and with the whole work log's
+        '''
+        logs = load_logs(self.partition_path(key))
+        cached = self._tables.get(key)
+        if cached is None or cached[0] is not logs:
+            table = logs.take(range(len(logs)))
+            base = partition_number(key) << PARTITION_SHIFT
+            table.record_ids = array.array(
+                'q', (base | record_id for record_id in logs.record_ids)
+            )
+            cached = self._tables[key] = (logs, table)
+        return cached
+
+    def _rows(self, keys, select):
+        '''
+        Yields, in chronological order, the rows chosen from each of the
+        partitions by select(), a function taking a partition's key and two
+        tables (see _partition()) and returning the rows wanted
+        '''
+        for key in keys:
+            logs, table = self._partition(key)
+            for row in select(key, logs, table):
+                yield table[row]
+
+    def _scan(self, regex):
+        '''
+        Finds the logs whose titles or notes match a regex
+
+        When the regex needs some literal text, each partition's trigram
+        index narrows the search down (see text_index.py). Otherwise large
+        work logs are scanned in parallel, every partition at once, and
+        smaller ones in this process.
+        '''
+        keys = self.manifest().keys()
+        paths = [self.partition_path(key) for key in keys]
+        indexed = regex_trigrams(regex) is not None
+        if not indexed and sum(
+                os.path.getsize(path) for path in paths) >= PARALLEL_THRESHOLD:
+            matches = parallel_search_files(regex, paths)
+
+            def select(key, logs, table):
+                found = matches[self.partition_path(key)]
+                return (
+                    row for row, record_id in enumerate(logs.record_ids)
+                    if record_id in found
+                )
+            return self._rows(keys, select)
+
+        def select(key, logs, table):
+            rows = range(len(logs))
+            if indexed:
+                candidates = get_text_index(
+                    self.partition_path(key)
+                ).regex_candidates(regex, len(logs))
+                if candidates is not None:
+                    rows = (
+                        row for row, record_id in enumerate(logs.record_ids)
+                        if record_id in candidates
+                    )
+            return (
+                row for row in rows
+                if regex.search(logs.value(row, 'task_name')) or
+                regex.search(logs.value(row, 'note'))
+            )
+        return self._rows(keys, select)
+
+    def iter_records(self):
+        for key in self.manifest().keys():
+            base = partition_number(key) << PARTITION_SHIFT
+            for offset, log in iter_log_records(self.partition_path(key)):
+                yield base | offset, log
+
+    def load_logs(self):
+        # The partitions are in chronological order, so the logs of all of
+        # them, one partition after another, are too.
+        return LogTable.from_records(
+            (log.record_id, log.as_dict())
+            for log in self._rows(
+                self.manifest().keys(),
+                lambda key, logs, table: range(len(table))
+            )
+        )
+
+    def dates(self):
+        '''Returns the unique dates of the logs, in chronological order'''
+        return list(dict.fromkeys(
+            log['date'] for log in self._rows(
+                self.manifest().keys(),
+                lambda key, logs, table: range(len(table))
+            )
+        ))
+
+    def find_by_date(self, date):
+        # Only the partition holding the date is opened.
+        ordinal = date_ordinal(date)
+
+        def select(key, logs, table):
+            low, high = date_range(logs.dates, ordinal, ordinal)
+            return (
+                row for row in range(low, high)
+                if logs.value(row, 'date') == date
+            )
+        keys = self.manifest().overlapping(ordinal, ordinal)
+        return self._rows(keys, select)
+
+    def find_by_date_range(self, start_date, end_date):
+        # Only the partitions overlapping the range are opened.
+        start, end = date_ordinal(start_date), date_ordinal(end_date)
+        return self._rows(
+            self.manifest().overlapping(start, end),
+            lambda key, logs, table: range(*date_range(logs.dates, start, end))
+        )
+
+    def find_by_time_spent(self, minutes):
+        return self._rows(
+            self.manifest().keys(),
+            lambda key, logs, table: QueryEngine.of(logs).equals(
+                'time_spent', int(minutes)
+            ).rows()
+        )
+
+    def find_by_string(self, text):
+        return self._scan(phrase_regex(text))
+
+    def find_by_pattern(self, regex):
+        if isinstance(regex, str):
+            regex = compile_pattern(regex)
+        return self._scan(regex)
+
+    def _append_to(self, key, manifest):
+        '''
+        Returns the path of a partition to append to, creating the partition
+        (and the directory) if need be
+        '''
+        path = self.partition_path(key)
+        if key not in manifest.partitions:
+            os.makedirs(self.path, exist_ok=True)
+            with open(path, 'a') as partition:
+                if not partition.tell():
+                    partition.write(HEADER)
+        return path
+
+    def append(self, log):
+        key = partition_key(log['date'])
+        with self.lock():
+            manifest = get_manifest(self.path)
+            offset = FileStorage(self._append_to(key, manifest)).append(log)
+            manifest.add(key, log)
+            manifest.save(self.path)
+        return partition_number(key) << PARTITION_SHIFT | offset
+
+    def append_many(self, logs):
+        '''
+        Adds a batch of logs at once, appending the logs of each partition
+        in one write (their indexes catch up the next time they are read)
+        '''
+        batches = {}
+        for log in logs:
+            batches.setdefault(partition_key(log['date']), []).append(log)
+        with self.lock():
+            manifest = get_manifest(self.path)
+            for key, batch in batches.items():
+                path = self._append_to(key, manifest)
+                with work_log_lock(path), \
+                        open(path, 'a', newline='') as partition:
+                    csv.writer(
+                        partition,
+                        delimiter=',',
+                        quotechar='|',
+                        quoting=csv.QUOTE_MINIMAL
+                    ).writerows(
+                        [log[field] for field in FIELDS] for log in batch
+                    )
+                    partition.flush()
+                    os.fsync(partition.fileno())
+                for log in batch:
+                    manifest.add(key, log)
+            manifest.save(self.path)
+
+    def generation(self):
+        return work_log_generation(self.path)
+
+    def delete(self, log, record_id=None, generation=None):
+        with self.lock():
+            # A log without a (current) record id can only be in its date's
+            # partition.
+            if generation is not None and generation != self.generation():
+                record_id = None
+            if record_id is not None and record_id >= 0:
+                key, offset = split_record_id(record_id)
+            else:
+                key, offset = partition_key(log['date']), None
+            manifest = get_manifest(self.path)
+            if key not in manifest.partitions:
+                return 0
+            deleted = FileStorage(self.partition_path(key)).delete(
+                log, offset
+            )
+            manifest.remove(key, deleted)
+            manifest.save(self.path)
+        return deleted
+
+    def clear(self):
+        with self.lock():
+            for key in partition_keys(self.path):
+                path = self.partition_path(key)
+                os.remove(path)
+                discard_sidecars(path)
+            os.makedirs(self.path, exist_ok=True)
+            Manifest().save(self.path)
+            next_generation(self.path)
+
+    def report(self, bucket=None, by_task=False):
+        # Each partition's rollups are kept up to date as logs are added
+        # and deleted; the groups they share (e.g. weeks spanning two
+        # months) are combined.
+        histograms = {}
+        for key in self.manifest().keys():
+            for group, stats in report(
+                    bucket, by_task, self.partition_path(key)):
+                histogram = histograms.setdefault(group, {})
+                for value, count in stats.histogram.items():
+                    histogram[value] = histogram.get(value, 0) + count
+        return sorted(
+            (group, Stats(histogram))
+            for group, histogram in histograms.items()
+        )
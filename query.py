@@ -0,0 +1,349 @@
+'''
+Searches that combine several conditions
+
+A query is built from predicates -- OnDate, DateRange, TimeSpent, Phrase
+and Pattern, one for each of LogSearch's find_by_* searches -- joined with
+& (both must match) and | (either may match), e.g.
+
+    DateRange('01/01/2016', '31/01/2016') & (Phrase('deploy') | TimeSpent(30))
+
+and run with LogSearch.find(), which returns the matching logs in
+chronological order, like the find_by_* searches.
+
+Queries are planned rather than run one predicate after another. Every
+predicate can check a single log (matches()), and can find its logs with
+its find_by_* search, which uses whatever index the storage has (the date
+order of the logs, the text index, SQL indexes and so on). For an AND, only
+the predicate expected to match the fewest logs is searched for; the logs
+it finds are then checked against the others, cheapest check first,
+stopping at the first that fails. An OR unions the logs its predicates
+find, unless one of them has no index to use, when every log is checked
+once instead.
+'''
+import functools
+import re
+
+from date_index import date_ordinal, date_range
+from query_engine import QueryEngine
+from text_index import regex_trigrams
+
+
+# How many compiled regexes compile_pattern() keeps.
+PATTERN_CACHE_SIZE = 128
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern, flags=0):
+    '''
+    Compiles a regex, remembering recently used ones (so a search repeated,
+    or run for each partition or row, compiles its pattern once)
+    '''
+    return re.compile(pattern, flags)
+
+
+def phrase_regex(text):
+    '''
+    Returns the compiled regex finding a phrase: the text itself, not
+    treated as a regex (so '.' and '(' only match themselves), ignoring case
+    '''
+    return compile_pattern(re.escape(text), re.I)
+
+
+def matches_text(regex, log):
+    '''Checks whether a regex is found in a log's title or note'''
+    return bool(
+        regex.search(log['task_name'] or '') or regex.search(log['note'] or '')
+    )
+
+
+class Query():
+    '''
+    A condition on logs (see the module docstring)
+
+    Queries are compared and hashed by their terms, so they can be used as
+    keys (e.g. of LogSearch's cache of recent results).
+    '''
+
+    # Roughly how expensive checking one log is, relative to the other
+    # predicates, and whether the logs matching the query can be found
+    # without checking every log.
+    cost = 1
+    indexed = True
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def key(self):
+        '''Returns the terms of the query, as a hashable tuple'''
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__, ', '.join(map(repr, self.key()[1:]))
+        )
+
+    def matches(self, log):
+        '''Checks whether a log (a LogRow or dictionary) matches'''
+        raise NotImplementedError
+
+    def estimate(self, search):
+        '''
+        Returns roughly how many logs match, if that can be told cheaply
+        (or None)
+        '''
+        return None
+
+    def find(self, search):
+        '''
+        Finds the matching logs
+
+        Argument: LogSearch
+        Returns: Iterator of LogRows (in chronological order)
+        '''
+        raise NotImplementedError
+
+
+class OnDate(Query):
+    '''Logs with a given date (see LogSearch.find_by_date())'''
+
+    def __init__(self, date):
+        self.date = date
+
+    def key(self):
+        return ('date', self.date)
+
+    def matches(self, log):
+        return log['date'] == self.date
+
+    def estimate(self, search):
+        if search.storage.pushdown:
+            return None
+        ordinal = date_ordinal(self.date)
+        low, high = date_range(search.logs.dates, ordinal, ordinal)
+        return high - low
+
+    def find(self, search):
+        return search.find_by_date(self.date)
+
+
+class DateRange(Query):
+    '''
+    Logs with dates between two dates, inclusive (see
+    LogSearch.find_by_date_range())
+    '''
+
+    cost = 2
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self._start = date_ordinal(start_date)
+        self._end = date_ordinal(end_date)
+
+    def key(self):
+        return ('date_range', self.start_date, self.end_date)
+
+    def matches(self, log):
+        return self._start <= date_ordinal(log['date']) <= self._end
+
+    def estimate(self, search):
+        if search.storage.pushdown:
+            return None
+        low, high = date_range(search.logs.dates, self._start, self._end)
+        return high - low
+
+    def find(self, search):
+        return search.find_by_date_range(self.start_date, self.end_date)
+
+
+class TimeSpent(Query):
+    '''Logs with a given duration (see LogSearch.find_by_time_spent())'''
+
+    def __init__(self, minutes):
+        self.minutes = int(minutes)
+
+    def key(self):
+        return ('time_spent', self.minutes)
+
+    def matches(self, log):
+        try:
+            return int(log['time_spent']) == self.minutes
+        except (TypeError, ValueError):
+            return False
+
+    def estimate(self, search):
+        if search.storage.pushdown:
+            return None
+        return QueryEngine.of(search.logs).equals(
+            'time_spent', self.minutes
+        ).count()
+
+    def find(self, search):
+        return search.find_by_time_spent(self.minutes)
+
+
+class Phrase(Query):
+    '''
+    Logs whose title or note contains a phrase, ignoring case (see
+    LogSearch.find_by_string())
+    '''
+
+    cost = 3
+
+    def __init__(self, text):
+        self.text = text
+        self._regex = phrase_regex(text)
+        # Phrases shorter than a trigram can't be looked up in the text
+        # index.
+        self.indexed = regex_trigrams(self._regex) is not None
+
+    def key(self):
+        return ('phrase', self.text)
+
+    def matches(self, log):
+        return matches_text(self._regex, log)
+
+    def find(self, search):
+        return search.find_by_string(self.text)
+
+
+class Pattern(Query):
+    '''
+    Logs whose title or note matches a regex (see
+    LogSearch.find_by_pattern())
+    '''
+
+    cost = 4
+
+    def __init__(self, regex):
+        if isinstance(regex, str):
+            regex = compile_pattern(regex)
+        self.regex = regex
+        # Unless the regex needs some literal text to look up in the text
+        # index, every log has to be checked (if only by a parallel scan).
+        self.indexed = regex_trigrams(regex) is not None
+
+    def key(self):
+        return ('pattern', self.regex.pattern, self.regex.flags)
+
+    def matches(self, log):
+        return matches_text(self.regex, log)
+
+    def find(self, search):
+        return search.find_by_pattern(self.regex)
+
+
+class And(Query):
+    '''Logs matching every one of several queries'''
+
+    def __init__(self, *queries):
+        # Nested ANDs are flattened, so they are planned as one.
+        self.queries = []
+        for query in queries:
+            if isinstance(query, And):
+                self.queries.extend(query.queries)
+            else:
+                self.queries.append(query)
+        # The order the queries are checked in, cheapest first.
+        self._checks = sorted(self.queries, key=lambda query: query.cost)
+        self.cost = sum(query.cost for query in self.queries)
+        self.indexed = any(query.indexed for query in self.queries)
+
+    def key(self):
+        return ('and',) + tuple(query.key() for query in self.queries)
+
+    def __repr__(self):
+        return '({})'.format(' & '.join(map(repr, self.queries)))
+
+    def matches(self, log):
+        return all(query.matches(log) for query in self._checks)
+
+    def plan(self, search):
+        '''
+        Chooses how to run the query: returns the query whose logs are
+        searched for, and the rest, which those logs are checked against
+
+        Queries with an index to use come first, then those expected to
+        match the fewest logs, then the cheapest to check.
+        '''
+        def order(query):
+            estimate = query.estimate(search)
+            return (
+                not query.indexed,
+                estimate if estimate is not None else float('inf'),
+                query.cost
+            )
+        first = min(self.queries, key=order)
+        return first, [query for query in self._checks if query is not first]
+
+    def estimate(self, search):
+        estimates = [
+            estimate for estimate in
+            (query.estimate(search) for query in self.queries)
+            if estimate is not None
+        ]
+        return min(estimates) if estimates else None
+
+    def find(self, search):
+        first, rest = self.plan(search)
+        return (
+            log for log in first.find(search)
+            if all(query.matches(log) for query in rest)
+        )
+
+
+class Or(Query):
+    '''Logs matching any of several queries'''
+
+    def __init__(self, *queries):
+        self.queries = []
+        for query in queries:
+            if isinstance(query, Or):
+                self.queries.extend(query.queries)
+            else:
+                self.queries.append(query)
+        self._checks = sorted(self.queries, key=lambda query: query.cost)
+        self.cost = sum(query.cost for query in self.queries)
+        self.indexed = all(query.indexed for query in self.queries)
+
+    def key(self):
+        return ('or',) + tuple(query.key() for query in self.queries)
+
+    def __repr__(self):
+        return '({})'.format(' | '.join(map(repr, self.queries)))
+
+    def matches(self, log):
+        return any(query.matches(log) for query in self._checks)
+
+    def estimate(self, search):
+        estimates = [query.estimate(search) for query in self.queries]
+        if None in estimates:
+            return None
+        return sum(estimates)
+
+    def find(self, search):
+        # If any of the queries would check every log anyway, every log is
+        # checked once, against each query in turn.
+        if not self.indexed:
+            return (log for log in search.logs if self.matches(log))
+
+        # Otherwise each query's logs are found, and put back in
+        # chronological order: by date, then in the order they were
+        # stored (which is the order of their record ids).
+        found = {}
+        for query in self.queries:
+            for log in query.find(search):
+                found.setdefault(log.record_id, log)
+        return iter(sorted(
+            found.values(),
+            key=lambda log: (date_ordinal(log['date']), log.record_id)
+        ))
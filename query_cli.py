@@ -0,0 +1,196 @@
+'''
+Non-interactive queries of the work log, for scripts and pipelines
+
+Runs the same searches as the Search Logs menu, taking the search terms as
+flags instead of prompting, and streams the matching logs (in chronological
+order) to stdout as jsonl or csv. When several flags are given, only logs
+matching all of them are output -- or, with --any, logs matching any of
+them. The flags are combined into one query (see query.py), which is
+planned to use the work log's indexes.
+
+Usage: python query_cli.py [--date DATE] [--from DATE --to DATE]
+       [--time-spent MINUTES] [--phrase TEXT] [--regex PATTERN] [--any]
+       [--format jsonl|csv] [--limit N] [--count-only] [--backend BACKEND]
+'''
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+
+import csv_functions
+from csv_functions import initialize_work_log
+from log_search import LogSearch
+from parallel_scan import ScanTimeout
+from query import And, DateRange, OnDate, Or, Pattern, Phrase, TimeSpent
+from user_input_functions import validate_date_format, validate_time_spent
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+
+def build_query(options):
+    '''
+    Builds the query asked for on the command line
+
+    Argument: argparse.Namespace (Parsed command line)
+    Returns: Query (see query.py), or None if no search was asked for
+    '''
+    queries = []
+    if options.date is not None:
+        queries.append(OnDate(options.date))
+    if options.start_date is not None:
+        queries.append(DateRange(options.start_date, options.end_date))
+    if options.time_spent is not None:
+        queries.append(TimeSpent(options.time_spent))
+    if options.phrase is not None:
+        queries.append(Phrase(options.phrase))
+    if options.regex is not None:
+        queries.append(Pattern(options.regex))
+    if not queries:
+        return None
+    if len(queries) == 1:
+        return queries[0]
+    return Or(*queries) if options.any else And(*queries)
+
+
+def find_matches(log_search, options):
+    '''
+    Runs the searches asked for on the command line
+
+    Arguments: LogSearch, argparse.Namespace (Parsed command line)
+    Returns: Iterator of LogRows (Logs matching every search, or any of
+    them with --any, in chronological order), or None if no search was
+    asked for
+    '''
+    query = build_query(options)
+    if query is None:
+        return None
+    return log_search.find(query)
+
+
+def write_logs(logs, output_format, output=sys.stdout):
+    '''
+    Writes logs to a file as they are found
+
+    Arguments: Iterable of LogRows, String ('jsonl' or 'csv'), File
+    Returns: Integer (Number of logs written)
+    '''
+    count = 0
+    if output_format == 'csv':
+        writer = csv.DictWriter(output, FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for log in logs:
+            writer.writerow(log.as_dict())
+            count += 1
+    else:
+        for log in logs:
+            output.write(json.dumps(
+                {field: log[field] for field in FIELDS}
+            ) + '\n')
+            count += 1
+    return count
+
+
+def parse_arguments(arguments=None):
+    '''Parses and checks the command line'''
+    parser = argparse.ArgumentParser(
+        description='Search the work log without prompting, writing the '
+                    'matching logs to stdout.'
+    )
+    parser.add_argument(
+        '--date',
+        help='logs with this date (DD/MM/YYYY)'
+    )
+    parser.add_argument(
+        '--from', dest='start_date',
+        help='logs on or after this date (DD/MM/YYYY, needs --to)'
+    )
+    parser.add_argument(
+        '--to', dest='end_date',
+        help='logs on or before this date (DD/MM/YYYY, needs --from)'
+    )
+    parser.add_argument(
+        '--time-spent',
+        help='logs with this duration, in whole minutes'
+    )
+    parser.add_argument(
+        '--phrase',
+        help='logs whose title or note contains this text (ignoring case)'
+    )
+    parser.add_argument(
+        '--regex',
+        help='logs whose title or note matches this regular expression'
+    )
+    parser.add_argument(
+        '--any', action='store_true',
+        help='logs matching any of the searches given (rather than all)'
+    )
+    parser.add_argument(
+        '--format', choices=('jsonl', 'csv'), default='jsonl',
+        help='output format (default jsonl)'
+    )
+    parser.add_argument(
+        '--limit', type=int,
+        help='stop after this many matches'
+    )
+    parser.add_argument(
+        '--count-only', action='store_true',
+        help='only print the number of matches'
+    )
+    parser.add_argument(
+        '--backend', choices=sorted(csv_functions.BACKEND_FILES),
+        help='work log backend to search'
+    )
+    options = parser.parse_args(arguments)
+
+    if (options.start_date is None) != (options.end_date is None):
+        parser.error('--from and --to must be given together')
+    try:
+        for date in (options.date, options.start_date, options.end_date):
+            if date is not None:
+                validate_date_format(date)
+        if options.time_spent is not None:
+            validate_time_spent(options.time_spent)
+    except ValueError as error:
+        parser.error(str(error))
+    if options.regex is not None:
+        try:
+            re.compile(options.regex)
+        except re.error as error:
+            parser.error('invalid regex: {}'.format(error))
+    if options.limit is not None and options.limit < 0:
+        parser.error('--limit must not be negative')
+    return options
+
+
+def main(arguments=None):
+    '''Runs a query from the command line'''
+    options = parse_arguments(arguments)
+    initialize_work_log(options.backend)
+
+    log_search = LogSearch()
+    try:
+        matches = find_matches(log_search, options)
+        if matches is None:
+            matches = iter(log_search.logs)
+        if options.limit is not None:
+            matches = itertools.islice(matches, options.limit)
+
+        if options.count_only:
+            print(sum(1 for _ in matches))
+        else:
+            write_logs(matches, options.format)
+        sys.stdout.flush()
+    except ScanTimeout as error:
+        sys.exit(str(error))
+    except BrokenPipeError:
+        # The reader (e.g. head) stopped early, which is fine. Point stdout
+        # at devnull so Python doesn't complain again while exiting.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import array
+
+# NumPy is optional. When it's installed, predicates are evaluated as
+# vectorized boolean masks; otherwise the same masks are built in pure
+# Python. Importing NumPy takes longer than starting the rest of the
+# program, so it's only imported once a query needs it (see _numpy()).
+_NOT_IMPORTED = object()
+numpy = _NOT_IMPORTED
+
+
+def _numpy():
+    '''Returns the numpy module (importing it the first time), or None'''
+    global numpy
+    if numpy is _NOT_IMPORTED:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+class Mask():
+    '''
+    The rows of a table matching a predicate, as one boolean per row
+
+    Masks can be combined with & (and), | (or) and ~ (not). Each mask holds
+    either a NumPy boolean array or, without NumPy, a list of booleans.
+    '''
+
+    def __init__(self, values):
+        self.values = values
+
+    def __and__(self, other):
+        if _numpy() is not None:
+            return Mask(self.values & other.values)
+        return Mask([a and b for a, b in zip(self.values, other.values)])
+
+    def __or__(self, other):
+        if _numpy() is not None:
+            return Mask(self.values | other.values)
+        return Mask([a or b for a, b in zip(self.values, other.values)])
+
+    def __invert__(self):
+        if _numpy() is not None:
+            return Mask(~self.values)
+        return Mask([not a for a in self.values])
+
+    def rows(self):
+        '''Returns the numbers of the matching rows, in table order'''
+        if _numpy() is not None:
+            return numpy.flatnonzero(self.values).tolist()
+        return [row for row, match in enumerate(self.values) if match]
+
+    def count(self):
+        '''Returns the number of matching rows'''
+        if _numpy() is not None:
+            return int(numpy.count_nonzero(self.values))
+        return sum(self.values)
+
+
+class QueryEngine():
+    '''
+    Evaluates date and time spent predicates over a whole LogTable at once
+
+    The table's date and time_spent columns are loaded once as integer
+    arrays. Times kept raw by the table because they weren't written in
+    canonical form (e.g. '030') are parsed here, so they compare equal to
+    the number they represent; rows whose value isn't a number at all never
+    match. Times too large for the 32-bit column are kept aside as Python
+    ints (in self.large) and checked one by one.
+
+    Building an engine copies the columns, so use QueryEngine.of() to share
+    one engine between all the queries of a table.
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = len(table)
+        time_spent = array.array('i', table.time_spent)
+        valid = [True] * len(table)
+        large = {}
+        for row, raw in table.raw.items():
+            if 'time_spent' in raw:
+                try:
+                    minutes = int(raw['time_spent'])
+                except (TypeError, ValueError):
+                    valid[row] = False
+                    continue
+                try:
+                    time_spent[row] = minutes
+                except OverflowError:
+                    valid[row] = False
+                    large[row] = minutes
+        self.large = {'date': {}, 'time_spent': large}
+
+        if _numpy() is not None:
+            self.columns = {
+                'date': numpy.frombuffer(table.dates, numpy.int32).copy(),
+                'time_spent': numpy.frombuffer(time_spent, numpy.int32),
+            }
+            self.valid = {
+                # Unparsable dates have an ordinal of 0, which never falls
+                # in a real date range.
+                'date': numpy.ones(len(table), bool),
+                'time_spent': numpy.array(valid, bool),
+            }
+        else:
+            self.columns = {'date': table.dates, 'time_spent': time_spent}
+            self.valid = {'date': [True] * len(table), 'time_spent': valid}
+
+    @classmethod
+    def of(cls, table):
+        '''
+        Returns the engine of a LogTable, building it the first time
+
+        The engine is kept on the table (as table.query_engine). The tables
+        load_logs() returns are never modified, since appending logs or
+        compacting the work log gives a new table (with no engine yet), but
+        an engine is still rebuilt if the table it was built for has had
+        rows appended since.
+
+        Argument: LogTable
+        Returns: QueryEngine
+        '''
+        engine = table.query_engine
+        if engine is None or engine.rows != len(table):
+            engine = table.query_engine = cls(table)
+        return engine
+
+    def equals(self, field, value):
+        '''Returns a Mask of the rows where field == value'''
+        column = self.columns[field]
+        if _numpy() is not None:
+            mask = Mask((column == value) & self.valid[field])
+        else:
+            mask = Mask([
+                number == value and valid
+                for number, valid in zip(column, self.valid[field])
+            ])
+        return self._add_large(mask, field, lambda number: number == value)
+
+    def between(self, field, low, high):
+        '''Returns a Mask of the rows where low <= field <= high'''
+        column = self.columns[field]
+        if _numpy() is not None:
+            mask = Mask(
+                (column >= low) & (column <= high) & self.valid[field]
+            )
+        else:
+            mask = Mask([
+                low <= number <= high and valid
+                for number, valid in zip(column, self.valid[field])
+            ])
+        return self._add_large(
+            mask, field, lambda number: low <= number <= high
+        )
+
+    def _add_large(self, mask, field, matches):
+        '''Adds the rows with values too large for the column to a Mask'''
+        for row, number in self.large[field].items():
+            if matches(number):
+                mask.values[row] = True
+        return mask
+
+    def select(self, mask):
+        '''Returns the rows of the table matching a Mask (as LogRows)'''
+        return [self.table[row] for row in mask.rows()]
@@ -1,50 +1,233 @@
-import datetime
+import array
+import bisect
 import re
+import threading
 
-from csv_functions import fetch_logs
+from instrumentation import timed
+from log_search import LogSearch
+from parallel_scan import ScanTimeout
+from query import DateRange, OnDate, Pattern, Phrase, TimeSpent
 from user_input_functions import get_valid_date_format, get_valid_time_spent
 from user_navigation_functions import clear_screen, confirm_user_action, menu
 from log import Log
 
 
-def sorting(logs):
+# How many results either side of the current one the pager keeps fetched.
+WINDOW_SIZE = 50
+
+
+class ResultCursor():
     '''
-    Defines a sorting key to be used by the Search class's __init__ method
-    
-    Looks through a list of logs grabbed by fetch_logs(), splits each log's
-    date by year, month, date into a key for sorted() to then use for
-    chronological sorting of the logs.
-    
-    Argument: List of dictionaries (logs grabbed by fetch_logs())
-    Returns: Sorting Key (year, month, day)
+    A cursor for paging through a stream of search results
+
+    Wraps an iterator of matching logs (e.g. a search filter's generator),
+    pulling matches only as far as they are looked at, so the first result
+    can be displayed before the rest of the logs have been filtered.
+
+    For every match found, only its row in its LogTable of logs is kept (8
+    bytes); the logs themselves are only fetched for a window of
+    window_size results either side of the current position. Matches can
+    also be found by a background thread (see count_in_background()) while
+    the user pages, and the search cancelled part way through (see
+    cancel()).
     '''
-    splitup = logs['date'].split('/')
-    return splitup[2], splitup[1], splitup[0]
 
+    def __init__(self, matches, window_size=None):
+        self._matches = iter(matches)
+        self._rows = array.array('q')
+        # The tables the matches' rows are in: the table of the matches from
+        # each index in _table_starts on (usually there's only one, but a
+        # storage may return logs from several, see partitions.py).
+        self._tables = []
+        self._table_starts = array.array('q')
+        self._window = {}
+        self._found = threading.Condition()
+        self._stop = threading.Event()
+        self._counter = None
+        self._error = None
+        self.window_size = (
+            window_size if window_size is not None else WINDOW_SIZE
+        )
+        self.position = 0
+        self.exhausted = False
+        self.cancelled = False
+
+    def _pull(self):
+        '''Finds the next match, returning False if there are no more'''
+        try:
+            log = next(self._matches)
+        except StopIteration:
+            self.exhausted = True
+            return False
+        if not self._tables or log.table is not self._tables[-1]:
+            self._tables.append(log.table)
+            self._table_starts.append(len(self._rows))
+        self._rows.append(log.row)
+        return True
 
-class Search():
-    
-    def __init__(self):
-        '''Get a chronologically sorted list of logs from work_log.txt'''
-        self.logs = sorted(fetch_logs(), key=sorting)
+    def _fill(self, count):
+        '''Finds matches until count have been found (or there are no more)'''
+        if self._counter is None:
+            while (len(self._rows) < count and not self.exhausted and
+                   not self._stop.is_set()):
+                self._pull()
+            return
+
+        # Once the background thread is finding the matches, wait for it.
+        with self._found:
+            self._found.wait_for(
+                lambda: len(self._rows) >= count or self.exhausted or
+                self._stop.is_set() or self._error is not None
+            )
+        if self._error is not None and not self.cancelled:
+            raise self._error
+
+    def _count(self):
+        '''Finds every remaining match, waking anyone waiting for them'''
+        while not self._stop.is_set():
+            try:
+                found = self._pull()
+            except Exception as error:
+                # Shown to the user the next time a result is looked for
+                # (unless the search was cancelled, which can make a query
+                # stop with an error).
+                self._error = error
+                found = False
+            with self._found:
+                self._found.notify_all()
+            if not found:
+                return
+
+    def count_in_background(self):
+        '''Starts finding the rest of the matches in a background thread'''
+        if self._counter is None and not self.exhausted:
+            self._counter = threading.Thread(target=self._count, daemon=True)
+            self._counter.start()
+
+    def close(self):
+        '''Stops the background thread (if any) counting matches'''
+        self._stop.set()
+        with self._found:
+            self._found.notify_all()
+
+    def cancel(self):
+        '''
+        Stops the search: no more matches are looked for, leaving the ones
+        found so far
+        '''
+        self.cancelled = True
+        self.close()
+
+    def has(self, index):
+        '''Returns True if there is a result at the given index'''
+        if index < 0:
+            return False
+        self._fill(index + 1)
+        return index < len(self._rows)
+
+    @property
+    def searching(self):
+        '''Whether more matches may still be found'''
+        return not (
+            self.exhausted or self._stop.is_set() or self._error is not None
+        )
+
+    def count(self):
+        '''Returns the number of results found so far'''
+        return len(self._rows)
+
+    def last_index(self):
+        '''Finds every match, returning the index of the last (or None)'''
+        self._fill(float('inf'))
+        return len(self._rows) - 1 if self._rows else None
+
+    def _log(self, index):
+        '''Returns the result at an index that has been found'''
+        table = self._tables[
+            bisect.bisect_right(self._table_starts, index) - 1
+        ]
+        return table[self._rows[index]]
+
+    def seek(self, index):
+        '''
+        Moves the cursor to a result, fetching the window of results around
+        it (and dropping the rest)
+
+        Argument: Integer (Index of the result)
+        Returns: LogRow (The result)
+        Raises: IndexError if there is no such result
+        '''
+        # Finding the matches just past the window now means the next few
+        # pages can be shown without waiting for the filter. (A background
+        # thread finding them is left to it, rather than waited for.)
+        if self._counter is None:
+            self._fill(index + self.window_size + 1)
+        if not self.has(index):
+            raise IndexError(index)
+        low = max(index - self.window_size, 0)
+        high = min(index + self.window_size + 1, len(self._rows))
+        self._window = {
+            i: self._window.get(i) or self._log(i)
+            for i in range(low, high)
+        }
+        self.position = index
+        return self._window[index]
+
+    def __bool__(self):
+        return self.has(0)
+
+    def __getitem__(self, index):
+        if not self.has(index):
+            raise IndexError(index)
+        if index in self._window:
+            return self._window[index]
+        return self._log(index)
+
+
+class Search(LogSearch):
+
+    def _run_search(self, find, *args):
+        '''
+        Runs a search, updating self.search_results with a ResultCursor of
+        its matches
+
+        At a terminal, the search runs in the background (see
+        async_search.py) with a live count of the matches found, and the
+        user can start paging through the first matches, or cancel the
+        search, with a keypress. If a parallel scan of a large work log
+        takes too long it is cancelled, and no results are returned.
+
+        Arguments: Function (find(), or one of the find_by_* methods) and
+        its arguments
+        '''
+        # Imported here so asyncio is only loaded once a search is run.
+        from async_search import interactive, run_search
+        try:
+            if interactive():
+                self.search_results = run_search(self.cancel, find, *args)
+            else:
+                self.search_results = ResultCursor(find(*args))
+        except ScanTimeout:
+            print(
+                "\n---Sorry, that search took too long, "
+                "so it was cancelled.---"
+            )
+            self.search_results = ResultCursor([])
     
+    @timed('search_by_date')
     def search_by_date(self):
         '''
         Searches for work logs by their date
     
-        Using a list of logs--which are dictionaries retrieved by fetch_logs()
-        -- this creates a list of unique log-dates to generate a menu of date
-        options. Once the user has chosen a date from that menu, this searches
-        the work logs for logs with that date, Updating self.search_results
-        with any matches.
+        Using the table of logs in self.logs (whose rows behave like the
+        dictionaries fetch_logs() returns), this creates a list of unique
+        log-dates to generate a menu of date options. Once the user has
+        chosen a date from that menu, this searches the work logs for logs
+        with that date, Updating self.search_results with any matches.
         '''
-        # Sort logs by date (so that they can be displayed chronologically).
-        
-        # Get a list of unique dates from the fetched logs.
-        dates = []
-        for log in self.logs:
-            if log['date'] not in dates:
-                dates.append(log['date'])
+        # Get a list of unique dates from the fetched logs (in chronological
+        # order).
+        dates = self.dates()
 
         # Build a dictionary of options and have menu() display them to the
         # user. Then set date_choice to the user's date-menu selection.
@@ -58,87 +241,64 @@ class Search():
             date_choice = menu(date_options)
         
         # If there are no dates (because work_log.txt was
-        # empty or nonexistant and thus fetch_logs returned nothing), sets
-        # the date choice to None, which will return no search results.
+        # empty or nonexistant and thus fetch_logs returned nothing), there
+        # are no search results.
         else:
-            date_choice = None
+            self.search_results = ResultCursor([])
+            return
 
         # Return a list of logs that have the same date as the user's
         # date_choice.
-        self.search_results = []
-        for log in self.logs:
-            if log['date'] == date_choice:
-                self.search_results.append(log)
+        self._run_search(self.find, OnDate(date_choice))
 
+    @timed('search_by_date_range')
     def search_by_date_range(self):
         '''
         Searches for work logs by dates within a specified range
     
-        After asking the user to input a start and end date, and parsing those
-        inputs into datetime objects. This searches a list of logs -- which are
-        dictionaries grabbed by fetch_logs() -- for logs that fall between
-        the specified dates.
-    
-        The range check is done by calculating the maximum range (end date -
-        start date), then checking to see if the difference between the end
-        date and each log's date falls between 0 and the maximum range (i.e.
-        the log's date is not after the end date or before the start date).
-        Updating self.search_results with any matches.
+        After asking the user to input a start and end date, this finds the
+        logs in self.logs that fall between the specified dates (inclusive)
+        with a DateRange query. Updating self.search_results with any
+        matches.
         '''
-        # Ask user to input a start and end date, then parse that input to
-        # create datetime objects.
+        # Ask user to input a start and end date.
         print("Enter the start date for your range search.")
         start_date = get_valid_date_format()
-        start_date = datetime.datetime.strptime(start_date, '%d/%m/%Y')
-        
+
         print("Enter the end date for your range search.")
         end_date = get_valid_date_format()
-        end_date = datetime.datetime.strptime(end_date, '%d/%m/%Y')
-    
-        # Create a timedelta with a value of 0 (for the range's minimum) and
-        # calculate a timedelta that represents the maximum value allowed
-        # by the search (end_date - start_date)
-        range_start = datetime.timedelta(0)
-        range_max = end_date - start_date
 
         # Return a list of logs that have dates falling within the search
         # range.
-        self.search_results = []
-        for log in self.logs:
-            date = end_date - datetime.datetime.strptime(
-                log['date'], '%d/%m/%Y'
-            )
-            if date >= range_start and date <= range_max:
-                self.search_results.append(log)
+        self._run_search(self.find, DateRange(start_date, end_date))
 
+    @timed('search_by_time_spent')
     def search_by_time_spent(self):
         '''
         Searches for work logs with a specified duration
     
         Prompts the user for the duration of a piece of work in rounded
         minutes, then, after ensuring the user has input whole numbers,
-        searches the logs -- which are a list of dictionaries grabbed by
-        fetch_logs() -- updating self.search_results with any matches.
+        searches the logs in self.logs, updating self.search_results with any
+        matches.
         '''
         # Prompt user to enter a duration, ensuring the user enters a whole
         # number.
         time_spent_choice = get_valid_time_spent()
     
         # Return a list of logs that have the specified duration
-        self.search_results = []
-        for log in self.logs:
-            if log['time_spent'] == time_spent_choice:
-                self.search_results.append(log)
+        self._run_search(self.find, TimeSpent(time_spent_choice))
 
+    @timed('search_by_string')
     def search_by_string(self):
         '''
         Searches the work logs for a specific string of characters
     
-        Prompts the user to enter a string of characters, then using re.match,
-        searches the logs -- which are a list of dictionaries grabbed by
-        fetch_logs-- for logs with titles or notes that contain the specified
-        string (re.Ignorecase is used to allow more flexibility in terms of
-        searching). Updating self.search_results with any matches.
+        Prompts the user to enter a string of characters, then using
+        a Phrase query, searches the logs in self.logs for logs with titles
+        or notes that contain the specified string (ignoring case, to allow
+        more flexibility in terms of searching). Updating self.search_results
+        with any matches.
         '''
         # Ask user to input a string.
         ss = input(
@@ -147,20 +307,20 @@ class Search():
 
         # Return a list of logs that have titles or notes containing the
         # specified string.
-        self.search_results = []
-        for log in self.logs:
-            if (re.search(ss, log['task_name'], re.I) or
-                    re.search(ss, log['note'], re.I)):
-                self.search_results.append(log)
+        self._run_search(self.find, Phrase(ss))
 
+    @timed('search_by_pattern')
     def search_by_pattern(self):
         '''
         Searches the work logs for a specific pattern of characters
     
         Prompts the user to enter a Regex pattern, using re.compile to ensure
-        that valid regex syntax has been used. Then using re.match, searches
-        the logs -- which are a list of dictionaries grabbed by fetch_logs() --
-        updating self.search_results with any matches.
+        that valid regex syntax has been used. Then using a Pattern query,
+        searches the logs in self.logs, updating self.search_results with any
+        matches.
+
+        If a parallel scan of a large work log takes too long it is
+        cancelled, and no results are returned.
         '''
         # Ask user to input a regex pattern, check to make sure it can be
         # compiled.
@@ -178,74 +338,28 @@ class Search():
 
         # Return a list of logs with titles and/or notes that match that
         # specified pattern.
-        self.search_results = []
-        for log in self.logs:
-            if (regex.search(log['task_name']) or
-                    regex.search(log['note'])):
-                self.search_results.append(log)
+        self._run_search(self.find, Pattern(regex))
 
     def detail_view(self):
         '''
         Displays logs in self.search_results
         
         Displays logs one at a time, allowing the user to page through all
-        results, and potentially edit or delete a certain result.
+        results (or jump to the first, last or a numbered result), and
+        potentially edit or delete a certain result. Results are streamed
+        through a ResultCursor, so only the logs around the current result
+        have been fetched when it is displayed, while the rest are counted
+        in the background.
         '''
         clear_screen()
-        # If the search yielded results, display the first result and set an
-        # index to 0, which will be used for paging through the results.
+        # If the search yielded results, display the first result (while the
+        # rest are counted) and let the user page through them.
         if self.search_results:
-            index = 0
-            while True:
-                print(
-                    "Displaying result "
-                    "{} of {}".format(index + 1, len(self.search_results))
-                )
-                try:
-                    current_result = Log(**self.search_results[index])
-                    current_result.display_log()
-                except TypeError:
-                    input(
-                        "Oh no! It looks like the data in work_logs.txt is "
-                        "not formatted correctly!\nPress any key to return to "
-                        "the Search Menu."
-                    )
-                else:
-                    # Display navigation options for the search result detail
-                    # view.
-                    nav = input(
-                        "[N]ext, [P]revious, [E]dit, [D]elete, "
-                        "[R]eturn to Search Menu: "
-                    ).lower()
-
-                    # Page to next result (if any)
-                    if nav == 'n' and index != len(self.search_results) - 1:
-                        index += 1
-                
-                    # Page to previous result (if any)
-                    if nav == 'p' and index != 0:
-                        index -= 1
-            
-                    # Enter edit log dialogue.
-                    if nav == 'e':
-                        current_result.edit_log()
-                        break
-            
-                    # Enter delete log dialogue.
-                    if nav == 'd':
-                        if confirm_user_action():
-                            current_result.delete_log()
-                        break
-            
-                    # Break search result detail view loop if [R]eturn is
-                    # selected.
-                    if nav == 'r':
-                        break
-                
-                    # Keep loop going if navigation input is invalid.
-                    else:
-                        clear_screen()
-                        continue
+            self.search_results.count_in_background()
+            try:
+                self._page_results(0)
+            finally:
+                self.search_results.close()
     
         # If no search results, announce that and leave search result detail
         # view.
@@ -256,4 +370,89 @@ class Search():
             )
             pass
 
+    def _page_results(self, index):
+        '''Shows results, starting from index, until the user is done'''
+        while True:
+            # The total is only known once the filter has run to the end,
+            # until then show how many matches have been found.
+            if self.search_results.exhausted:
+                total = self.search_results.count()
+            elif self.search_results.cancelled:
+                total = '{} (search cancelled)'.format(
+                    self.search_results.count()
+                )
+            else:
+                total = 'at least {} (still counting)'.format(
+                    self.search_results.count()
+                )
+            print("Displaying result {} of {}".format(index + 1, total))
+            try:
+                result = self.search_results.seek(index)
+                current_result = Log(**result)
+                current_result.record_id = result.record_id
+                current_result.generation = self.generation
+                current_result.display_log()
+            except TypeError:
+                input(
+                    "Oh no! It looks like the data in work_logs.txt is "
+                    "not formatted correctly!\nPress any key to return to "
+                    "the Search Menu."
+                )
+                break
+
+            # Display navigation options for the search result detail view
+            # (including stopping the search, while it's still running).
+            stop = ""
+            if self.search_results.searching:
+                stop = "[S]top searching, "
+            nav = input(
+                "[N]ext, [P]revious, [F]irst, [L]ast, [J]ump to result, "
+                "[E]dit, [D]elete, " + stop + "[R]eturn to Search Menu: "
+            ).lower()
+
+            # Page to next result (if any)
+            if nav == 'n' and self.search_results.has(index + 1):
+                index += 1
+
+            # Page to previous result (if any)
+            if nav == 'p' and index != 0:
+                index -= 1
+
+            # Stop looking for more results, keeping the ones found.
+            if nav == 's' and self.search_results.searching:
+                self.search_results.cancel()
+                self.cancel()
+
+            # Jump to the first or last result.
+            if nav == 'f':
+                index = 0
 
+            if nav == 'l':
+                index = self.search_results.last_index()
+
+            # Jump to a numbered result (if there is one).
+            if nav == 'j':
+                number = input("Jump to result number: ")
+                if number.isdigit() and self.search_results.has(
+                        int(number) - 1):
+                    index = int(number) - 1
+
+            # Enter edit log dialogue.
+            if nav == 'e':
+                current_result.edit_log()
+                break
+
+            # Enter delete log dialogue.
+            if nav == 'd':
+                if confirm_user_action():
+                    current_result.delete_log()
+                break
+
+            # Break search result detail view loop if [R]eturn is selected.
+            if nav == 'r':
+                break
+
+            # Keep loop going otherwise (including for invalid input).
+            else:
+                clear_screen()
+                continue
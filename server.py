@@ -0,0 +1,532 @@
+'''
+A long-running local HTTP/JSON service for querying the work log
+
+Scripts (e.g. dashboards) that each start a new process have to parse the
+work log from scratch every time. The server parses it once and keeps the
+logs, and their indexes, in memory: a background thread tails the work log
+(see tail()), so logs appended by other processes are merged in as they
+arrive (see log_cache.py), and every request is answered from the warm
+snapshot.
+
+Endpoints (all responses are JSON):
+
+    GET  /health
+    GET  /search/date?date=DD/MM/YYYY
+    GET  /search/date_range?from=DD/MM/YYYY&to=DD/MM/YYYY
+    GET  /search/time_spent?minutes=N
+    GET  /search/string?text=TEXT
+    GET  /search/pattern?regex=PATTERN
+    GET  /search?date=...&from=...&to=...&time_spent=...&phrase=...
+         &regex=...&any=1
+    GET  /report?group=day|week|month|task|task_week|task_month|all
+    POST /logs          {"date", "task_name", "time_spent", "note"}
+    POST /logs/delete   {"record_id", "generation", "date", "task_name",
+                         "time_spent", "note"}
+
+The five /search/ endpoints are the five searches of the Search Logs menu;
+/search combines them as query_cli.py does. Searches return the number
+of matching logs, and a page of them (in chronological order; the first
+SEARCH_LIMIT unless limit and offset say otherwise) with their record ids
+and the generation of the work log they are from, which is what
+/logs/delete needs to delete exactly that log (see Storage.delete()).
+
+Requests are handled by a fixed pool of threads, so slow searches don't
+hold up the rest. Changes are queued for a single writer thread, which
+makes them in batches, holding the work log's lock once per batch.
+
+Usage: python server.py [--host HOST] [--port PORT] [--workers N]
+       [--backend BACKEND] [--verbose]
+'''
+import argparse
+import concurrent.futures
+import http.server
+import json
+import queue
+import re
+import signal
+import sys
+import threading
+import urllib.parse
+
+import csv_functions
+from aggregates import get_rollups
+from csv_functions import initialize_work_log
+from ingest import validate_log
+from log_search import LogSearch
+from parallel_scan import ScanTimeout
+from query import DateRange, OnDate, Pattern, Phrase, TimeSpent
+from query_cli import build_query
+from storage import get_storage
+from text_index import get_text_index
+from user_input_functions import validate_date_format, validate_time_spent
+
+
+FIELDS = ('date', 'task_name', 'time_spent', 'note')
+
+# How many threads answer requests.
+WORKERS = 8
+
+# How many matching logs a search returns unless it's given a limit (a
+# common word can match a fifth of the logs, megabytes of JSON).
+SEARCH_LIMIT = 100
+
+# How many queued changes the writer makes at once, at most.
+WRITE_BATCH = 256
+
+# How often (in seconds) the work log is checked for appended logs.
+TAIL_INTERVAL = 0.5
+
+# The groupings /report offers (see aggregates.report()).
+REPORT_GROUPS = {
+    'all': (None, False),
+    'day': ('day', False),
+    'week': ('week', False),
+    'month': ('month', False),
+    'task': (None, True),
+    'task_week': ('week', True),
+    'task_month': ('month', True)
+}
+
+
+class RequestError(Exception):
+    '''A request that can't be answered, with the HTTP status to send'''
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Writer():
+    '''
+    Makes every change to the work log, from a single thread
+
+    Changes are queued by submit(), and the writer takes them off the queue
+    in batches of up to WRITE_BATCH, making each batch holding the work
+    log's lock just once. Changes are made in the order they were queued.
+    '''
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, change, *args):
+        '''
+        Queues a change: a function taking the Storage and args
+
+        Returns: concurrent.futures.Future (Of the change's result)
+        '''
+        future = concurrent.futures.Future()
+        self._queue.put((future, change, args))
+        return future
+
+    def stop(self):
+        '''Makes the changes queued so far, then stops the writer'''
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        '''Makes a batch of changes, holding the work log's lock'''
+        storage = get_storage()
+        try:
+            with storage.lock():
+                for future, change, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        future.set_result(change(storage, *args))
+                    except Exception as error:
+                        future.set_exception(error)
+        except Exception as error:
+            # The lock itself couldn't be taken.
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+def _add(storage, log):
+    '''Adds a log (a change for the Writer), as Log.add_log() does'''
+    generation = storage.generation()
+    return {'record_id': storage.append(log), 'generation': generation}
+
+
+def _delete(storage, log, record_id, generation):
+    '''Deletes a log (a change for the Writer), as Log.delete_log() does'''
+    return {'deleted': storage.delete(log, record_id, generation)}
+
+
+def tail(stop, interval=None):
+    '''
+    Keeps the logs in memory up to date until stop (a threading.Event) is
+    set, checking the work log every interval seconds (TAIL_INTERVAL by
+    default)
+
+    Logs appended since the last check are parsed and merged into the
+    cached snapshot, and added to the text index and the report rollups,
+    so requests never wait for them (see log_cache.load_logs(),
+    text_index.get_text_index() and aggregates.get_rollups()).
+    '''
+    if interval is None:
+        interval = TAIL_INTERVAL
+    while True:
+        try:
+            storage = get_storage()
+            storage.preload()
+            if not storage.pushdown:
+                get_text_index(storage.path)
+                get_rollups(storage.path)
+        except Exception:
+            # A problem reading the work log (e.g. part way through being
+            # replaced) is tried again next time; requests report their
+            # own errors.
+            pass
+        if stop.wait(interval):
+            return
+
+
+def _parameter(parameters, name, required=True):
+    '''Returns a query string parameter (or None if it's optional)'''
+    values = parameters.get(name)
+    if not values:
+        if required:
+            raise RequestError('missing parameter {}'.format(name))
+        return None
+    return values[0]
+
+
+def _date(parameters, name, required=True):
+    '''Returns a query string parameter that must be a DD/MM/YYYY date'''
+    date = _parameter(parameters, name, required)
+    if date is not None:
+        try:
+            validate_date_format(date)
+        except ValueError as error:
+            raise RequestError(' '.join(str(error).split()))
+    return date
+
+
+def _minutes(parameters, name, required=True):
+    '''Returns a query string parameter that must be whole minutes'''
+    minutes = _parameter(parameters, name, required)
+    if minutes is not None:
+        try:
+            validate_time_spent(minutes)
+        except ValueError as error:
+            raise RequestError(' '.join(str(error).split()))
+    return minutes
+
+
+def _whole_number(parameters, name, default):
+    '''Returns an optional query string parameter that must be a number'''
+    number = _parameter(parameters, name, False)
+    if number is None:
+        return default
+    if not number.isdigit():
+        raise RequestError('{} must be a whole number'.format(name))
+    return int(number)
+
+
+def _regex(parameters, name, required=True):
+    '''Returns a query string parameter that must be a valid regex'''
+    pattern = _parameter(parameters, name, required)
+    if pattern is not None:
+        try:
+            re.compile(pattern)
+        except re.error as error:
+            raise RequestError('invalid regex: {}'.format(error))
+    return pattern
+
+
+def _search_query(mode, parameters):
+    '''
+    Builds the query for a search endpoint: one of the five searches of the
+    Search Logs menu, or (with no mode) any combination of them
+    '''
+    if mode == 'date':
+        return OnDate(_date(parameters, 'date'))
+    if mode == 'date_range':
+        return DateRange(
+            _date(parameters, 'from'), _date(parameters, 'to')
+        )
+    if mode == 'time_spent':
+        return TimeSpent(_minutes(parameters, 'minutes'))
+    if mode == 'string':
+        return Phrase(_parameter(parameters, 'text'))
+    if mode == 'pattern':
+        return Pattern(_regex(parameters, 'regex'))
+    if mode is not None:
+        raise RequestError('unknown search {}'.format(mode), 404)
+
+    options = argparse.Namespace(
+        date=_date(parameters, 'date', False),
+        start_date=_date(parameters, 'from', False),
+        end_date=_date(parameters, 'to', False),
+        time_spent=_minutes(parameters, 'time_spent', False),
+        phrase=_parameter(parameters, 'phrase', False),
+        regex=_regex(parameters, 'regex', False),
+        any=_parameter(parameters, 'any', False) in ('1', 'true')
+    )
+    if (options.start_date is None) != (options.end_date is None):
+        raise RequestError('from and to must be given together')
+    query = build_query(options)
+    if query is None:
+        raise RequestError('no search terms given')
+    return query
+
+
+def search(mode, parameters):
+    '''
+    Runs a search endpoint
+
+    Arguments: String or None (The search, e.g. 'date' for /search/date),
+    Dictionary (Parsed query string)
+    Returns: Dictionary (The response)
+    '''
+    query = _search_query(mode, parameters)
+    limit = _whole_number(parameters, 'limit', SEARCH_LIMIT)
+    offset = _whole_number(parameters, 'offset', 0)
+
+    log_search = LogSearch()
+    logs = []
+    matches = 0
+    try:
+        # Only the logs on the page are turned into JSON; the rest are
+        # just counted.
+        for matches, log in enumerate(log_search.find(query), 1):
+            if offset < matches <= offset + limit:
+                entry = {'record_id': log.record_id}
+                entry.update((field, log[field]) for field in FIELDS)
+                logs.append(entry)
+    except ScanTimeout as error:
+        raise RequestError(str(error), 503)
+    return {
+        'generation': log_search.generation,
+        'count': matches,
+        'logs': logs
+    }
+
+
+def report(parameters):
+    '''Runs the /report endpoint (see aggregates.report())'''
+    group = _parameter(parameters, 'group', False) or 'all'
+    if group not in REPORT_GROUPS:
+        raise RequestError(
+            'group must be one of {}'.format(', '.join(REPORT_GROUPS))
+        )
+    bucket, by_task = REPORT_GROUPS[group]
+    return {'group': group, 'rows': [
+        {
+            'group': list(key),
+            'logs': stats.count,
+            'total': stats.total,
+            'min': stats.minimum,
+            'max': stats.maximum,
+            'median': stats.percentile(50),
+            'p90': stats.percentile(90)
+        }
+        for key, stats in get_storage().report(bucket, by_task)
+    ]}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    '''Answers one request (see the module docstring)'''
+
+    server_version = 'WorkLog/1.0'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parameters = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if url.path == '/health':
+            self._answer(lambda: {'status': 'ok'})
+        elif parts[0] == 'search' and len(parts) <= 2:
+            mode = parts[1] if len(parts) == 2 else None
+            self._answer(lambda: search(mode, parameters))
+        elif url.path == '/report':
+            self._answer(lambda: report(parameters))
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/logs':
+            self._answer(self._add, 201)
+        elif path == '/logs/delete':
+            self._answer(self._delete)
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def _body(self):
+        '''Returns the request's JSON body (which must be an object)'''
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise RequestError('the body must be JSON')
+        if not isinstance(body, dict):
+            raise RequestError('the body must be a JSON object')
+        return body
+
+    def _log(self, body):
+        '''Returns the log in a request body, checked as ingest.py does'''
+        try:
+            return validate_log(body)
+        except (TypeError, ValueError) as error:
+            raise RequestError(' '.join(str(error).split()))
+
+    def _add(self):
+        log = self._log(self._body())
+        return self.server.writer.submit(_add, log).result()
+
+    def _delete(self):
+        # The log's details are needed as well as its record id, in case
+        # the record id turns out to be stale.
+        body = self._body()
+        log = self._log(body)
+        record_id = body.get('record_id')
+        generation = body.get('generation')
+        for value in (record_id, generation):
+            if value is not None and (
+                    not isinstance(value, int) or isinstance(value, bool)):
+                raise RequestError(
+                    'record_id and generation must be whole numbers'
+                )
+        return self.server.writer.submit(
+            _delete, log, record_id, generation
+        ).result()
+
+    def _answer(self, respond, status=200):
+        '''Sends the response respond() returns, or the error it raises'''
+        try:
+            response = respond()
+        except RequestError as error:
+            self._send(error.status, {'error': str(error)})
+        except Exception as error:
+            self.log_error('%s', repr(error))
+            self._send(500, {'error': 'internal error'})
+        else:
+            self._send(status, response)
+
+    def _send(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class WorkLogServer(http.server.HTTPServer):
+    '''
+    An HTTPServer that answers each request in a thread of a fixed pool,
+    and makes changes through a Writer
+    '''
+
+    def __init__(self, address, workers=None, verbose=False):
+        super().__init__(address, Handler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            workers or WORKERS
+        )
+        self.writer = Writer()
+        self.verbose = verbose
+        self._stop_tailing = threading.Event()
+        self._tail = threading.Thread(
+            target=tail, args=(self._stop_tailing,), daemon=True
+        )
+        self._tail.start()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+        self.writer.stop()
+        self._stop_tailing.set()
+
+
+def _interrupt(signal_number, frame):
+    '''Handles SIGTERM as if Ctrl+C had been pressed'''
+    raise KeyboardInterrupt
+
+
+def main(arguments=None):
+    '''Runs the server from the command line'''
+    parser = argparse.ArgumentParser(
+        description='Serve searches, reports and changes of the work log '
+                    'over HTTP, as JSON.'
+    )
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help='address to listen on (default 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--port', type=int, default=8080,
+        help='port to listen on (default 8080)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=WORKERS,
+        help='threads answering requests (default {})'.format(WORKERS)
+    )
+    parser.add_argument(
+        '--backend', choices=sorted(csv_functions.BACKEND_FILES),
+        help='work log backend to serve'
+    )
+    parser.add_argument(
+        '--verbose', action='store_true',
+        help='log every request to stderr'
+    )
+    options = parser.parse_args(arguments)
+    if options.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    initialize_work_log(options.backend)
+    server = WorkLogServer(
+        (options.host, options.port), options.workers, options.verbose
+    )
+    print(
+        'Serving {} on http://{}:{}/'.format(
+            csv_functions.work_log_path(), *server.server_address[:2]
+        ),
+        file=sys.stderr
+    )
+    # Being stopped (e.g. by kill, or load_test.py) shuts the server down as
+    # Ctrl+C does, so indexes and rollups held in memory are saved on exit.
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+'''
+A work log kept in an indexed SQLite database
+
+The logs are rows of one table, with each log's date also stored as an
+ordinal (see date_index.date_ordinal()) and its time_spent as a number of
+minutes, and indexes on those and on task_name. An FTS5 table using the
+trigram tokenizer indexes task names and notes for substring searches, kept
+in step with the logs by triggers. Each find_by_* search of LogSearch is run
+as one SQL query (see SqliteStorage.pushdown), so only the matching logs are
+ever read.
+
+A log's record id is its row id. Work logs are moved into SQLite once, by
+migrate_to_sqlite(), when the sqlite backend is first used; after that
+work_log.txt is left alone.
+'''
+import os
+import sqlite3
+
+from aggregates import GROUPINGS, Stats, group_key, minutes
+from csv_functions import iter_log_records
+from date_index import date_ordinal
+from instrumentation import count, timed
+from locking import TEMP_SUFFIX
+from log_table import LogTable
+from query import compile_pattern, phrase_regex
+from storage import Storage
+from text_index import regex_trigrams
+
+
+# The first bytes of every SQLite database file.
+MAGIC = b'SQLite format 3\x00'
+
+# How long to wait for another process's write to finish, in seconds.
+BUSY_TIMEOUT = 30
+
+# The range of an SQLite INTEGER. Times spent outside it are stored with a
+# NULL minutes column, and are matched and counted in Python instead.
+INTEGER_RANGE = range(-2**63, 2**63)
+
+# Row ids are AUTOINCREMENT so that a deleted log's record id is never
+# reused, and a stale search result can't delete a newer log.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    ordinal INTEGER NOT NULL,
+    task_name TEXT,
+    time_spent TEXT,
+    minutes INTEGER,
+    note TEXT
+);
+CREATE INDEX IF NOT EXISTS logs_ordinal ON logs (ordinal, id);
+CREATE INDEX IF NOT EXISTS logs_minutes ON logs (minutes);
+CREATE INDEX IF NOT EXISTS logs_task_name ON logs (task_name);
+'''
+
+# Logs are never updated in place (editing a log adds a new one and deletes
+# the old), so only inserts and deletes need to reach the text index.
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+    task_name, note, content='logs', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO logs_fts (rowid, task_name, note)
+    VALUES (new.id, new.task_name, new.note);
+END;
+CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, task_name, note)
+    VALUES ('delete', old.id, old.task_name, old.note);
+END;
+'''
+
+_COLUMNS = 'id, date, task_name, time_spent, note'
+_INSERT = (
+    'INSERT INTO logs (date, ordinal, task_name, time_spent, minutes, note) '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+
+
+def is_sqlite_log(path):
+    '''Checks whether a file is a SQLite database (or empty)'''
+    with open(path, 'rb') as database:
+        header = database.read(len(MAGIC))
+    return header in (MAGIC, b'')
+
+
+def _regexp(pattern, flags, value):
+    '''
+    The regexp(pattern, flags, value) SQL function: whether re.search()
+    finds the pattern in value
+    '''
+    if value is None:
+        return 0
+    return compile_pattern(pattern, flags).search(value) is not None
+
+
+def _row(log):
+    '''Returns the column values a log is stored as'''
+    value = minutes(log)
+    if value is not None and value not in INTEGER_RANGE:
+        value = None
+    return (
+        log.get('date'), date_ordinal(log.get('date')), log.get('task_name'),
+        log.get('time_spent'), value, log.get('note')
+    )
+
+
+def match_expression(query):
+    '''
+    Turns a trigram query (see text_index.regex_trigrams(), with
+    ascii_only, as FTS5 doesn't fold case quite as Python's re module does)
+    into an FTS5 MATCH expression for the text index
+    '''
+    if isinstance(query, str):
+        return '"{}"'.format(query.replace('"', '""'))
+    operator, queries = query
+    expressions = [match_expression(query) for query in queries]
+    joiner = ' OR ' if operator == 'or' else ' AND '
+    return '({})'.format(joiner.join(expressions))
+
+
+def create_schema(connection):
+    '''
+    Creates the tables, indexes and triggers of a work log database, if it
+    doesn't have them already
+
+    The text index needs FTS5 with the trigram tokenizer (SQLite 3.34 or
+    later); without it, string searches fall back to checking every log.
+    '''
+    connection.executescript(SCHEMA)
+    try:
+        connection.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        pass
+
+
+def connect(path='work_log.db'):
+    '''
+    Opens a work log database, creating its tables if need be
+
+    Connections use write-ahead logging, so searches aren't blocked while
+    another process adds a log, and wait for each other's writes rather
+    than failing. They may be used from several threads (ResultCursor counts
+    results in the background), one at a time.
+    '''
+    connection = sqlite3.connect(
+        path, timeout=BUSY_TIMEOUT, check_same_thread=False
+    )
+    connection.create_function('regexp', 3, _regexp, deterministic=True)
+    connection.execute('PRAGMA journal_mode=WAL')
+    create_schema(connection)
+    return connection
+
+
+def migrate_to_sqlite(csv_path='work_log.txt', path='work_log.db'):
+    '''
+    Copies every log of a csv work log into a new work log database
+
+    The database is built in a temporary file alongside, in one transaction,
+    and only renamed into place once it is complete, so an interrupted
+    migration leaves no database behind (and is simply run again).
+
+    Arguments: String (Path to the csv work log), String (Path of the
+    database to create)
+    Returns: Integer (Number of logs copied)
+    '''
+    temp_path = path + TEMP_SUFFIX + 'migrate'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        create_schema(connection)
+        with connection:
+            cursor = connection.executemany(
+                _INSERT, (_row(log) for _, log in iter_log_records(csv_path))
+            )
+            copied = cursor.rowcount
+        connection.execute('PRAGMA optimize')
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+    return copied
+
+
+class SqliteStorage(Storage):
+    '''
+    A work log kept in a SQLite database (see the module docstring)
+
+    Searches return LogRows, like LogSearch's searches over a LogTable, but
+    the rows come from a table built up as the query's results are read.
+    '''
+
+    pushdown = True
+
+    def __init__(self, path='work_log.db'):
+        super().__init__(path)
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = connect(self.path)
+        return self._connection
+
+    def close(self):
+        '''Closes the database connection (it's reopened if used again)'''
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def cancel(self):
+        # Makes the query running in another thread stop with an error.
+        if self._connection is not None:
+            self._connection.interrupt()
+
+    def has_text_index(self):
+        '''Checks whether the database has its FTS5 text index'''
+        return self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'logs_fts'"
+        ).fetchone() is not None
+
+    def _query(self, where='', parameters=()):
+        '''
+        Yields the logs matching a WHERE clause as LogRows, in chronological
+        order (the order LogSearch's searches return logs in)
+        '''
+        cursor = self.connection.execute(
+            'SELECT {} FROM logs {} ORDER BY ordinal, id'.format(
+                _COLUMNS, where
+            ),
+            parameters
+        )
+        table = LogTable()
+        for record_id, date, task_name, time_spent, note in cursor:
+            table.append({
+                'date': date,
+                'task_name': task_name,
+                'time_spent': time_spent,
+                'note': note
+            }, record_id)
+            yield table[len(table) - 1]
+
+    def iter_records(self):
+        cursor = self.connection.execute(
+            'SELECT {} FROM logs ORDER BY id'.format(_COLUMNS)
+        )
+        for record_id, date, task_name, time_spent, note in cursor:
+            yield record_id, {
+                'date': date,
+                'task_name': task_name,
+                'time_spent': time_spent,
+                'note': note
+            }
+
+    @timed('load_logs')
+    def load_logs(self):
+        table = LogTable()
+        for log in self._query():
+            table.append(log.as_dict(), log.record_id)
+        return table
+
+    def dates(self):
+        '''Returns the unique dates of the logs, in chronological order'''
+        return [
+            date for date, in self.connection.execute(
+                'SELECT date FROM logs GROUP BY date '
+                'ORDER BY MIN(ordinal), MIN(id)'
+            )
+        ]
+
+    def find_by_date(self, date):
+        # The ordinal finds the day through the index; the string
+        # comparison keeps LogSearch's exact-match semantics.
+        return self._query(
+            'WHERE ordinal = ? AND date = ?', (date_ordinal(date), date)
+        )
+
+    def find_by_date_range(self, start_date, end_date):
+        return self._query(
+            'WHERE ordinal BETWEEN ? AND ?',
+            (date_ordinal(start_date), date_ordinal(end_date))
+        )
+
+    def find_by_time_spent(self, minutes_spent):
+        minutes_spent = int(minutes_spent)
+        if minutes_spent in INTEGER_RANGE:
+            return self._query('WHERE minutes = ?', (minutes_spent,))
+        # Only logs whose time spent wasn't stored as a number can have one
+        # this large.
+        return (
+            log for log in self._query(
+                'WHERE minutes IS NULL AND time_spent IS NOT NULL'
+            )
+            if minutes(log) == minutes_spent
+        )
+
+    def find_by_string(self, text):
+        # A phrase is searched for as the regex matching it literally, so
+        # the regexp check gives exactly the same matches as
+        # LogSearch.find_by_string().
+        return self.find_by_pattern(phrase_regex(text))
+
+    def find_by_pattern(self, regex):
+        if isinstance(regex, str):
+            regex = compile_pattern(regex)
+        match = '(regexp(?, ?, task_name) OR regexp(?, ?, note))'
+        parameters = (regex.pattern, regex.flags) * 2
+
+        # The trigrams the regex needs narrow the search down through the
+        # text index (the trigram tokenizer's), and the regexp check then
+        # gives exactly the matches LogSearch.find_by_pattern() would.
+        query = regex_trigrams(regex, ascii_only=True)
+        if query is not None and self.has_text_index():
+            count('text_index_hit')
+            return self._query(
+                'WHERE id IN (SELECT rowid FROM logs_fts '
+                'WHERE logs_fts MATCH ?) AND ' + match,
+                (match_expression(query),) + parameters
+            )
+        count('text_index_miss')
+        return self._query('WHERE ' + match, parameters)
+
+    def append(self, log):
+        with self.connection:
+            return self.connection.execute(_INSERT, _row(log)).lastrowid
+
+    def append_many(self, logs):
+        '''Adds a batch of logs at once, in one transaction'''
+        with self.connection:
+            self.connection.executemany(_INSERT, (_row(log) for log in logs))
+
+    def delete(self, log, record_id=None, generation=None):
+        # Row ids are never reused (not even after clear()), so a record id
+        # can always be trusted, whatever its generation.
+        with self.connection:
+            if record_id is not None and record_id >= 0:
+                cursor = self.connection.execute(
+                    'DELETE FROM logs WHERE id = ?', (record_id,)
+                )
+            else:
+                cursor = self.connection.execute(
+                    'DELETE FROM logs WHERE id = ('
+                    'SELECT id FROM logs WHERE ordinal = ? AND date IS ? '
+                    'AND task_name IS ? AND time_spent IS ? AND note IS ? '
+                    'ORDER BY id LIMIT 1)',
+                    (date_ordinal(log['date']), log['date'],
+                     log['task_name'], log['time_spent'], log['note'])
+                )
+        return cursor.rowcount
+
+    def clear(self):
+        # Dropping the tables is much quicker than deleting every log (and
+        # so every entry of the text index) one at a time. That also drops
+        # the table's AUTOINCREMENT counter, which is put back so that the
+        # new logs' row ids carry on from the old ones.
+        with self.connection:
+            last_id = self.connection.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'logs'"
+            ).fetchone()
+            self.connection.execute('DROP TABLE IF EXISTS logs_fts')
+            self.connection.execute('DROP TABLE IF EXISTS logs')
+        create_schema(self.connection)
+        if last_id is not None:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) "
+                    "VALUES ('logs', ?)", last_id
+                )
+
+    def report(self, bucket=None, by_task=False):
+        # SQL counts the logs of each distinct date, task and duration;
+        # those counts are then folded into the report's date buckets.
+        if (bucket, by_task) not in GROUPINGS:
+            raise ValueError(
+                'Unknown grouping {!r}'.format((bucket, by_task))
+            )
+        columns = [
+            'date' if bucket is not None else 'NULL',
+            'task_name' if by_task else 'NULL'
+        ]
+        histograms = {}
+        for date, task_name, value, count in self.connection.execute(
+                'SELECT {0}, {1}, minutes, COUNT(*) FROM logs '
+                'WHERE minutes IS NOT NULL '
+                'GROUP BY {0}, {1}, minutes'.format(*columns)):
+            key = group_key(
+                {'date': date, 'task_name': task_name}, bucket, by_task
+            )
+            histogram = histograms.setdefault(key, {})
+            histogram[value] = histogram.get(value, 0) + count
+        # Times too large for the minutes column are counted here.
+        for date, task_name, time_spent in self.connection.execute(
+                'SELECT date, task_name, time_spent FROM logs '
+                'WHERE minutes IS NULL AND time_spent IS NOT NULL'):
+            log = {'date': date, 'task_name': task_name,
+                   'time_spent': time_spent}
+            value = minutes(log)
+            if value is None:
+                continue
+            histogram = histograms.setdefault(
+                group_key(log, bucket, by_task), {}
+            )
+            histogram[value] = histogram.get(value, 0) + 1
+        return sorted(
+            (key, Stats(histogram)) for key, histogram in histograms.items()
+        )
@@ -0,0 +1,253 @@
+'''
+The storage backends the work log can be kept in
+
+Everything that reads or changes the work log as a whole -- fetch_logs(),
+Log.add_log(), Log.delete_log(), clear_all_logs(), the reports and
+LogSearch -- goes through the Storage for the current backend, as returned
+by get_storage():
+
+- FileStorage keeps the logs in a file: work_log.txt (csv, the default) or
+  work_log.bin (binary, see binary_log.py). Searches run over an in-memory
+  snapshot of the logs (see log_cache.py), helped by the sidecar indexes.
+- SqliteStorage (see sqlite_storage.py) keeps them in an indexed SQLite
+  database, work_log.db, and runs every search as a SQL query.
+- PartitionedStorage (see partitions.py) keeps them in one csv file per
+  month, in the work_logs directory, and only searches the partitions a
+  search could match.
+'''
+import csv
+
+import csv_functions
+from aggregates import (record_rollup_append, record_rollup_delete,
+                        report)
+from binary_log import append_binary_logs, create_binary_log
+from csv_functions import iter_log_records
+from date_index import file_identity, record_append
+from locking import atomic_rewrite, work_log_generation, work_log_lock
+from log_cache import load_logs
+from text_index import record_text_append, record_text_delete
+from tombstones import add_tombstone, load_tombstones, tombstones_size
+
+
+class Storage():
+    '''
+    What every storage backend provides
+
+    Logs are dictionaries with the work log's four fields (date, task_name,
+    time_spent and note), all strings. Each stored log has a record id
+    (an integer) that stays the same until the storage is rewritten or
+    cleared, and which is how a log found by a search is deleted. The
+    storage's generation changes whenever that happens, so a record id
+    noted along with the generation can be told apart from a stale one.
+    '''
+
+    # Whether the backend runs searches itself, with the same find_by_* and
+    # dates() methods as LogSearch; otherwise LogSearch runs them over the
+    # table of logs load_logs() returns.
+    pushdown = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def lock(self):
+        '''
+        Returns a context manager holding the storage's exclusive lock, to
+        make several changes at once (see locking.work_log_lock())
+        '''
+        return work_log_lock(self.path)
+
+    def iter_records(self):
+        '''Yields (record id, log) pairs for every log, in storage order'''
+        raise NotImplementedError
+
+    def iter_logs(self):
+        '''Yields every log (as a dictionary), in storage order'''
+        for _, log in self.iter_records():
+            yield log
+
+    def load_logs(self):
+        '''Returns every log, as a chronologically sorted LogTable'''
+        raise NotImplementedError
+
+    def append(self, log):
+        '''Adds a log, returning its record id'''
+        raise NotImplementedError
+
+    def append_many(self, logs):
+        '''Adds several logs at once'''
+        for log in logs:
+            self.append(log)
+
+    def generation(self):
+        '''
+        Returns the storage's generation (an integer), which changes
+        whenever its record ids are reassigned
+        '''
+        return 0
+
+    def delete(self, log, record_id=None, generation=None):
+        '''
+        Deletes a log: the one with the given record id, if it's still from
+        the storage's current generation (when one is given), or otherwise
+        the first log with the same details -- just one, even if several
+        logs are identical
+
+        Arguments: Dictionary (The log), Integer or None (Its record id),
+        Integer or None (The generation the record id is from)
+        Returns: Integer (How many logs were deleted, 0 or 1)
+        '''
+        raise NotImplementedError
+
+    def clear(self):
+        '''Deletes every log'''
+        raise NotImplementedError
+
+    def report(self, bucket=None, by_task=False):
+        '''
+        Returns the totals of one grouping of the logs (see
+        aggregates.report())
+        '''
+        raise NotImplementedError
+
+    def preload(self):
+        '''
+        Gets ready for the first search, e.g. in a background thread while
+        the user is still choosing what to do (see work_logs.py)
+        '''
+
+    def cancel(self):
+        '''
+        Stops a search the storage is running in another thread, where it
+        can (see LogSearch.cancel())
+        '''
+
+
+class FileStorage(Storage):
+    '''
+    A work log kept in a single file, csv or binary
+
+    New logs are appended (their record id being the byte offset they were
+    written at), deleted logs are recorded as tombstones (see tombstones.py)
+    and the sidecar indexes and rollups are kept up to date as logs are
+    added and deleted. Every change is made holding the work log's lock.
+    The generation is the work log's (see locking.work_log_generation()),
+    moved on by every rewrite.
+    '''
+
+    def iter_records(self):
+        return iter_log_records(self.path)
+
+    def load_logs(self):
+        return load_logs(self.path)
+
+    def preload(self):
+        # Searches run over the cached snapshot of the logs, so the first
+        # one needn't wait for it.
+        load_logs(self.path)
+
+    def append(self, log):
+        # Other processes may be appending too, so the work log is locked
+        # while the log is written and the sidecar files are updated (which
+        # also makes the size noted below the new log's record id).
+        with work_log_lock(self.path):
+            # Note the file's identity before appending, so the date and
+            # text indexes and the report rollups can be updated in place
+            # rather than rebuilt.
+            try:
+                previous_identity = file_identity(self.path)
+            except FileNotFoundError:
+                previous_identity = None
+
+            if csv_functions.backend == 'binary':
+                append_binary_logs([log], self.path)
+            else:
+                with open(self.path, 'a+', newline='') as work_log:
+                    logwriter = csv.writer(
+                        work_log,
+                        delimiter=',',
+                        quotechar='|',
+                        quoting=csv.QUOTE_MINIMAL
+                    )
+                    logwriter.writerow(
+                        [log['date']] + [log['task_name']] +
+                        [log['time_spent']] + [log['note']]
+                    )
+
+            if previous_identity is None:
+                return None
+            record_id = previous_identity[0]
+            record_append(log['date'], previous_identity, self.path)
+            record_text_append(record_id, log, previous_identity, self.path)
+            record_rollup_append(log, previous_identity, self.path)
+            return record_id
+
+    def generation(self):
+        return work_log_generation(self.path)
+
+    def delete(self, log, record_id=None, generation=None):
+        with work_log_lock(self.path):
+            if generation is not None and generation != self.generation():
+                # The work log has been rewritten since the record id was
+                # noted, so it may now be another log's.
+                record_id = None
+
+            if record_id is not None and record_id >= 0:
+                # The record is read straight from its offset, unless it
+                # has already been deleted.
+                if record_id in load_tombstones(self.path):
+                    return 0
+                stored = next(iter_log_records(
+                    self.path, record_id, include_deleted=True
+                ), None)
+                if stored is None or stored[0] != record_id:
+                    return 0
+                log = stored[1]
+            else:
+                # The cached table of logs finds the first identical log
+                # without reading the work log again.
+                logs = load_logs(self.path)
+                row = logs.find_log(log)
+                if row is None:
+                    return 0
+                record_id = logs.record_ids[row]
+
+            previous_dead = tombstones_size(self.path)
+            add_tombstone(record_id, self.path)
+            record_text_delete(record_id, log, self.path)
+            record_rollup_delete(log, previous_dead, self.path)
+            return 1
+
+    def clear(self):
+        # The empty work log replaces the old one with an atomic rewrite,
+        # which also discards its sidecar files.
+        with work_log_lock(self.path):
+            if csv_functions.backend == 'binary':
+                create_binary_log(self.path)
+            else:
+                with atomic_rewrite(self.path, 'w') as work_log:
+                    work_log.write('date,task_name,time_spent,note\n')
+
+    def report(self, bucket=None, by_task=False):
+        return report(bucket, by_task, self.path)
+
+
+def get_storage(backend=None):
+    '''
+    Returns the Storage for a backend
+
+    Argument: String or None (Backend name, one of
+    csv_functions.BACKEND_FILES -- None uses the current backend)
+    Returns: Storage
+    '''
+    if backend is None:
+        backend = csv_functions.backend
+    path = csv_functions.BACKEND_FILES[backend]
+    # Imported here as they build on this module (and so the sqlite3 module
+    # is only loaded when used).
+    if backend == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(path)
+    if backend == 'partitioned':
+        from partitions import PartitionedStorage
+        return PartitionedStorage(path)
+    return FileStorage(path)
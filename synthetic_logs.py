@@ -0,0 +1,144 @@
+'''
+Generates synthetic work logs, for benchmarking
+
+The logs are meant to look like a real team's work log: dates spread over a
+few years with most work done on weekdays, a long tail of task names (a few
+are used constantly, most rarely), durations clustered around common
+meeting lengths, and notes ranging from empty to a few sentences.
+
+Usage: python synthetic_logs.py ROWS [--output work_log.txt] [--seed N]
+'''
+import argparse
+import bisect
+import datetime
+import itertools
+import random
+
+
+# Row counts the benchmarks are normally run at, by name.
+SIZES = {
+    '10k': 10000,
+    '100k': 100000,
+    '1M': 1000000,
+    '10M': 10000000
+}
+
+# How many distinct task names there are, and the years the logs span
+# (fixed, so that the same seed gives the same logs on any day).
+TASK_NAMES = 500
+START_DATE = datetime.date(2016, 1, 1)
+YEARS = 3
+
+_WORDS = (
+    'review fix deploy meeting design write test refactor update check '
+    'customer release bug feature docs planning sync report database api '
+    'server client build migrate investigate support call email estimate '
+    'prototype cleanup performance security backup config monitor alert '
+    'team sprint retro demo onboarding interview research spike invoice'
+).split()
+
+_DURATIONS = (5, 10, 15, 20, 25, 30, 45, 60, 90, 120, 180, 240)
+
+
+def _task_names(rng):
+    '''Returns TASK_NAMES made up task names, e.g. 'Review api 17' '''
+    return [
+        '{} {} {}'.format(
+            rng.choice(_WORDS).capitalize(), rng.choice(_WORDS), number
+        )
+        for number in range(TASK_NAMES)
+    ]
+
+
+def _note(rng):
+    '''Returns a note of a realistic length (often 'None', as when empty)'''
+    length = int(rng.expovariate(1 / 12))
+    if not length:
+        return 'None'
+    return ' '.join(rng.choice(_WORDS) for _ in range(length)).capitalize()
+
+
+def generate_logs(rows, seed=0):
+    '''
+    Yields synthetic logs (as dictionaries), in no particular date order
+
+    Arguments: Integer (Number of logs), Integer (Random seed -- the same
+    seed always gives the same logs)
+    Yields: Dictionaries (Logs, with the same fields as work_log.txt)
+    '''
+    rng = random.Random(seed)
+    names = _task_names(rng)
+    # Zipf-like weights: the n-th most used task is used 1/n as often as the
+    # most used one.
+    task_weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, len(names) + 1)
+    ))
+    start = START_DATE.toordinal()
+    days = [
+        day for day in range(start, start + 365 * YEARS)
+        # Only one in five weekend days has any work logged.
+        if datetime.date.fromordinal(day).weekday() < 5 or day % 5 == 0
+    ]
+
+    for _ in range(rows):
+        day = datetime.date.fromordinal(rng.choice(days))
+        task = bisect.bisect_left(
+            task_weights, rng.random() * task_weights[-1]
+        )
+        yield {
+            'date': day.strftime('%d/%m/%Y'),
+            'task_name': names[task],
+            'time_spent': str(
+                rng.choice(_DURATIONS) if rng.random() < 0.8
+                else rng.randint(1, 480)
+            ),
+            'note': _note(rng)
+        }
+
+
+def write_work_log(path, rows, seed=0):
+    '''
+    Writes a csv work log of synthetic logs (replacing any existing file)
+
+    Arguments: String (Path to write), Integer (Number of logs), Integer
+    (Random seed)
+    '''
+    with open(path, 'w', buffering=1024 * 1024) as work_log:
+        work_log.write('date,task_name,time_spent,note\n')
+        # The generated text never needs quoting, so rows are joined by hand
+        # rather than by the (much slower) csv module.
+        for log in generate_logs(rows, seed):
+            work_log.write('{date},{task_name},{time_spent},{note}\n'.format(
+                **log
+            ))
+
+
+def main(arguments=None):
+    '''Writes a synthetic work log from the command line'''
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic work log for benchmarking.'
+    )
+    parser.add_argument(
+        'rows',
+        help='number of logs, or one of: {}'.format(', '.join(SIZES))
+    )
+    parser.add_argument(
+        '--output', default='work_log.txt',
+        help='file to write (default work_log.txt)'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='random seed (default 0)'
+    )
+    options = parser.parse_args(arguments)
+    rows = SIZES.get(options.rows)
+    if rows is None:
+        try:
+            rows = int(options.rows)
+        except ValueError:
+            parser.error('invalid number of logs: {}'.format(options.rows))
+    write_work_log(options.output, rows, options.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+from aggregates import Stats, aggregate, format_report
+
+
+def test_format_report_with_a_missing_task_name():
+    groups = aggregate([
+        {'date': '01/02/2016', 'task_name': 'a', 'time_spent': '5'},
+        {'date': '01/02/2016', 'task_name': None, 'time_spent': '10'},
+    ], 'day', True)
+    lines = format_report(list(groups.items()))
+    assert lines[1].split() == ['2016-02-01', '/', 'a', '1', '5', '5', '5',
+                                '5', '5']
+    assert lines[2].split() == ['2016-02-01', '/', '-', '1', '10', '10',
+                                '10', '10', '10']
+
+
+def test_format_report_of_all_logs():
+    stats = Stats()
+    stats.add(5)
+    assert format_report([((), stats)])[1].split()[:3] == ['All', 'logs', '1']
@@ -0,0 +1,59 @@
+from binary_log import (append_binary_logs, create_binary_log,
+                        iter_binary_records, pack_record, read_binary_table)
+from log_table import LogTable
+
+
+LOGS = [
+    {'date': '01/02/2016', 'task_name': 'a', 'time_spent': '5',
+     'note': 'None'},
+    {'date': '1/2/2016', 'task_name': 'raw date', 'time_spent': '5',
+     'note': 'n'},
+    {'date': '02/02/2016', 'task_name': 'raw time', 'time_spent': '030',
+     'note': 'n'},
+    {'date': '03/02/2016', 'task_name': 'İstanbul', 'time_spent': '15',
+     'note': 'Straße'},
+    {'date': '04/02/2016', 'task_name': 'large', 'time_spent': '3000000000',
+     'note': ''},
+    {'date': '05/02/2016', 'task_name': 'a', 'time_spent': '5',
+     'note': 'None'},
+]
+
+
+def _work_log(tmp_path):
+    path = str(tmp_path / 'work_log.bin')
+    create_binary_log(path)
+    append_binary_logs(LOGS, path)
+    return path
+
+
+def _rows(table):
+    return [(record_id, log.as_dict())
+            for record_id, log in zip(table.record_ids, table)]
+
+
+def test_read_binary_table_matches_the_records(tmp_path):
+    path = _work_log(tmp_path)
+    expected = LogTable.from_records(iter_binary_records(path))
+    assert _rows(read_binary_table(path)) == _rows(expected)
+    assert [log.as_dict() for log in read_binary_table(path)] == LOGS
+
+
+def test_read_binary_table_offsets_tombstones_and_pool(tmp_path):
+    path = _work_log(tmp_path)
+    records = list(iter_binary_records(path))
+    # A partly written record at the end is ignored.
+    with open(path, 'ab') as work_log:
+        work_log.write(pack_record(LOGS[0])[:-2])
+
+    dead = {records[3][0]}
+    table = read_binary_table(path, records[1][0], records[5][0], dead)
+    assert _rows(table) == [
+        (record_id, log) for record_id, log in records[1:5]
+        if record_id not in dead
+    ]
+
+    first = read_binary_table(path)
+    tail = read_binary_table(path, records[4][0], pool=first.pool)
+    assert tail.pool is first.pool
+    assert _rows(tail) == records[4:]
+    assert _rows(first) == records
@@ -0,0 +1,84 @@
+import datetime
+
+from csv_functions import iter_log_records
+from date_index import (INDEX_SUFFIX, DateIndex, date_ordinal, file_identity,
+                        get_chronological_order)
+from log import Log
+from log_search import LogSearch
+from log_table import LogTable
+
+
+def _add(*dates):
+    for date in dates:
+        Log(date=date, task_name=date, time_spent='5', note='n').add_log()
+
+
+def _table(path):
+    return LogTable.from_records(iter_log_records(str(path)))
+
+
+def test_date_ordinal():
+    assert date_ordinal('01/02/2016') == datetime.date(2016, 2, 1).toordinal()
+    assert date_ordinal('1/2/2016') == date_ordinal('01/02/2016')
+    assert date_ordinal('31/02/2016') == 0
+    assert date_ordinal(None) == 0
+
+
+def test_index_is_saved_and_kept_up_to_date(work_log):
+    path = str(work_log)
+    _add('03/02/2016', '01/02/2016')
+    logs = _table(path)
+    assert get_chronological_order(logs, path) == [1, 0]
+
+    index = DateIndex.load(path)
+    assert list(index.record_ids) == [logs.record_ids[1], logs.record_ids[0]]
+
+    # Adding a log inserts it into the saved index in place.
+    _add('02/02/2016')
+    index = DateIndex.load(path)
+    assert [date_ordinal(date) for date in (
+        '01/02/2016', '02/02/2016', '03/02/2016'
+    )] == list(index.ordinals)
+    assert (index.size, index.mtime) == file_identity(path)
+
+
+def test_logs_appended_by_another_writer_are_merged_in(work_log):
+    path = str(work_log)
+    _add('03/02/2016', '01/02/2016')
+    get_chronological_order(_table(path), path)
+    saved = DateIndex.load(path)
+    with open(path, 'a') as logs:
+        logs.write('02/02/2016,b,5,n\n04/01/2016,a,5,n\n')
+    assert DateIndex.load(path) is None
+    assert DateIndex.load(path, allow_growth=True).record_ids == (
+        saved.record_ids
+    )
+
+    logs = _table(path)
+    order = get_chronological_order(logs, path)
+    assert [logs[row]['date'] for row in order] == [
+        '04/01/2016', '01/02/2016', '02/02/2016', '03/02/2016'
+    ]
+    assert len(DateIndex.load(path)) == 4
+
+
+def test_corrupt_index_is_rebuilt(work_log):
+    path = str(work_log)
+    _add('03/02/2016', '01/02/2016')
+    with open(path + INDEX_SUFFIX, 'wb') as index_file:
+        index_file.write(b'garbage')
+    assert DateIndex.load(path) is None
+    logs = _table(path)
+    assert get_chronological_order(logs, path) == [1, 0]
+    assert len(DateIndex.load(path)) == 2
+
+
+def test_find_by_date_range(work_log):
+    _add('03/02/2016', '01/02/2016', '15/03/2016', '02/02/2016')
+    found = LogSearch().find_by_date_range('01/02/2016', '03/02/2016')
+    assert [log['date'] for log in found] == [
+        '01/02/2016', '02/02/2016', '03/02/2016'
+    ]
+    assert [log['date'] for log in LogSearch().find_by_date('15/03/2016')] == [
+        '15/03/2016'
+    ]
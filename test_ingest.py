@@ -0,0 +1,43 @@
+import io
+
+from ingest import ingest, read_csv, read_jsonl
+from log_search import LogSearch
+
+
+def test_ingest_rejects_a_note_with_a_line_break(work_log):
+    source = io.StringIO(
+        '{"date": "01/02/2016", "task_name": "a", "time_spent": "5", '
+        '"note": "line one\\nline two"}\n'
+        '{"date": "02/02/2016", "task_name": "b", "time_spent": "5", '
+        '"note": "fine"}\n'
+    )
+    errors = io.StringIO()
+    assert ingest(read_jsonl(source), errors) == (1, 1)
+    assert 'Skipping log 1' in errors.getvalue()
+    logs = list(LogSearch().find_by_date_range('01/01/2016', '31/12/2016'))
+    assert [dict(log) for log in logs] == [{
+        'date': '02/02/2016', 'task_name': 'b', 'time_spent': '5',
+        'note': 'fine'
+    }]
+
+
+def test_ingest_rejects_a_csv_field_with_a_carriage_return(work_log):
+    source = io.StringIO(
+        'date,task_name,time_spent,note\n'
+        '01/02/2016,"a\rb",5,n\n'
+    )
+    assert ingest(read_csv(source), io.StringIO()) == (0, 1)
+
+
+def test_ingest_skips_a_line_that_is_not_json(work_log):
+    source = io.StringIO(
+        '{bad json\n'
+        '{"date": "02/02/2016", "task_name": "b", "time_spent": "5", '
+        '"note": "fine"}\n'
+    )
+    errors = io.StringIO()
+    assert ingest(read_jsonl(source), errors) == (1, 1)
+    assert errors.getvalue().startswith('Skipping log 1: invalid JSON')
+    assert [log['task_name'] for log in LogSearch().find_by_date(
+        '02/02/2016'
+    )] == ['b']
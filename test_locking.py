@@ -0,0 +1,161 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import locking
+from csv_functions import initialize_work_log, iter_logs
+from locking import (JOURNAL_SUFFIX, TEMP_SUFFIX, atomic_rewrite,
+                     recover_work_log, work_log_generation, work_log_lock)
+from tombstones import TOMBSTONE_SUFFIX
+
+
+HEADER = 'date,task_name,time_spent,note\n'
+OLD = HEADER + '01/02/2016,old,5,n\n'
+NEW = HEADER + '01/02/2016,new,5,n\n'
+
+
+class Crash(Exception):
+    '''Stands in for the program being killed part way through'''
+
+
+def _leftovers(work_log):
+    return sorted(
+        name for name in os.listdir(work_log.parent)
+        if JOURNAL_SUFFIX in name or TEMP_SUFFIX in name
+    )
+
+
+@pytest.fixture
+def old_log(work_log):
+    work_log.write_text(OLD)
+    work_log.with_name(work_log.name + TOMBSTONE_SUFFIX).write_bytes(
+        bytes(8)
+    )
+    return work_log
+
+
+def test_failed_rewrite_leaves_the_work_log_as_it_was(old_log):
+    generation = work_log_generation(str(old_log))
+    with pytest.raises(Crash):
+        with atomic_rewrite(str(old_log), 'w') as rewritten:
+            rewritten.write(NEW)
+            raise Crash
+    assert old_log.read_text() == OLD
+    assert _leftovers(old_log) == []
+    assert work_log_generation(str(old_log)) == generation
+
+
+def test_rewrite_interrupted_after_the_journal_is_finished(old_log,
+                                                          monkeypatch):
+    path = str(old_log)
+    generation = work_log_generation(path)
+
+    def crash(*args):
+        raise Crash
+
+    with monkeypatch.context() as patch:
+        patch.setattr(locking, '_commit', crash)
+        with pytest.raises(Crash):
+            with atomic_rewrite(path, 'w') as rewritten:
+                rewritten.write(NEW)
+    assert old_log.read_text() == OLD
+    assert len(_leftovers(old_log)) == 2
+
+    # The next start finishes the rewrite.
+    initialize_work_log()
+    assert old_log.read_text() == NEW
+    assert _leftovers(old_log) == []
+    assert not os.path.exists(path + TOMBSTONE_SUFFIX)
+    assert work_log_generation(path) == generation + 1
+    assert [log['task_name'] for log in iter_logs(path)] == ['new']
+
+
+def test_rewrite_interrupted_after_the_rename(old_log, monkeypatch):
+    path = str(old_log)
+    generation = work_log_generation(path)
+    with monkeypatch.context() as patch:
+        patch.setattr(locking, 'next_generation', None)
+        with pytest.raises(TypeError):
+            with atomic_rewrite(path, 'w') as rewritten:
+                rewritten.write(NEW)
+    assert old_log.read_text() == NEW
+    assert _leftovers(old_log) == ['work_log.txt' + JOURNAL_SUFFIX]
+
+    # The sidecars of the old work log still need discarding.
+    assert recover_work_log(path)
+    assert _leftovers(old_log) == []
+    assert not os.path.exists(path + TOMBSTONE_SUFFIX)
+    assert work_log_generation(path) == generation + 1
+
+
+def test_partly_written_journal_is_undone(old_log):
+    path = str(old_log)
+    with open(path + TEMP_SUFFIX + 'abc', 'w') as temp:
+        temp.write(NEW)
+    with open(path + JOURNAL_SUFFIX, 'w') as journal:
+        journal.write('{"target": "work_log.txt", "te')
+    assert recover_work_log(path)
+    assert old_log.read_text() == OLD
+    assert _leftovers(old_log) == []
+    assert os.path.exists(path + TOMBSTONE_SUFFIX)
+    assert not recover_work_log(path)
+
+
+def _try_lock(path, exclusive):
+    '''Tries to lock a work log from another process, without waiting'''
+    code = (
+        'import fcntl, sys\n'
+        'lock = open(sys.argv[1], "a")\n'
+        'try:\n'
+        '    fcntl.flock(lock, fcntl.LOCK_NB | fcntl.{})\n'
+        'except OSError:\n'
+        '    sys.exit(1)\n'
+    ).format('LOCK_EX' if exclusive else 'LOCK_SH')
+    return subprocess.run(
+        [sys.executable, '-c', code, path + locking.LOCK_SUFFIX]
+    ).returncode == 0
+
+
+@pytest.mark.skipif(locking.fcntl is None, reason='needs fcntl')
+def test_locks_shared_and_exclusive(work_log):
+    path = str(work_log)
+    with work_log_lock(path, shared=True):
+        assert _try_lock(path, exclusive=False)
+        assert not _try_lock(path, exclusive=True)
+        # Taking the exclusive lock within the shared one upgrades it,
+        # and leaving it goes back to the shared lock.
+        with work_log_lock(path):
+            with work_log_lock(path, shared=True):
+                assert not _try_lock(path, exclusive=False)
+        assert _try_lock(path, exclusive=False)
+    assert _try_lock(path, exclusive=True)
+
+
+@pytest.mark.skipif(locking.fcntl is None, reason='needs fcntl')
+def test_concurrent_writers_lose_no_logs(work_log):
+    code = (
+        'import csv_functions\n'
+        'from log import Log\n'
+        'csv_functions.initialize_work_log("csv")\n'
+        'for number in range(25):\n'
+        '    Log(date="01/02/2016", task_name="writer {}", '
+        'time_spent=str(number), note="n").add_log()\n'
+    )
+    environment = dict(
+        os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))
+    )
+    writers = [
+        subprocess.Popen([sys.executable, '-c', code.format(writer)],
+                         cwd=str(work_log.parent), env=environment)
+        for writer in range(4)
+    ]
+    assert [writer.wait() for writer in writers] == [0] * 4
+    logs = list(iter_logs(str(work_log)))
+    assert len(logs) == 100
+    for writer in range(4):
+        assert [log['time_spent'] for log in logs
+                if log['task_name'] == 'writer {}'.format(writer)] == [
+            str(number) for number in range(25)
+        ]
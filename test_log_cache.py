@@ -0,0 +1,67 @@
+import pickle
+
+import pytest
+
+import log_cache
+from log import Log
+from tombstones import add_tombstone
+
+
+@pytest.fixture
+def saved_snapshots(work_log, monkeypatch):
+    monkeypatch.setattr(log_cache, 'SAVE_SNAPSHOTS', True)
+    monkeypatch.setattr(log_cache, '_snapshots', {})
+    monkeypatch.setattr(log_cache, '_saved', {})
+    return str(work_log)
+
+
+def _rows(table):
+    return [(record_id, log.as_dict())
+            for record_id, log in zip(table.record_ids, table)]
+
+
+def test_saved_snapshot_is_loaded_by_the_next_run(saved_snapshots,
+                                                  monkeypatch):
+    path = saved_snapshots
+    with open(path, 'a') as logs:
+        logs.write('02/02/2016,b,5,n\n'
+                   '01/02/2016,a,030,n\n'
+                   '03/02/2016,c,5\n')
+    expected = _rows(log_cache.load_logs(path))
+    assert [log['task_name'] for _, log in expected] == ['a', 'b', 'c']
+
+    # A new run only reads the saved snapshot, not the work log.
+    monkeypatch.setattr(log_cache, '_snapshots', {})
+    monkeypatch.setattr(log_cache, '_read_table', None)
+    logs = log_cache.load_logs(path)
+    assert _rows(logs) == expected
+    # Task names are still interned.
+    assert logs.pool.add('a') == logs.task_names[0]
+
+
+def test_saved_snapshot_is_refreshed(saved_snapshots, monkeypatch):
+    path = saved_snapshots
+    Log(date='02/02/2016', task_name='b', time_spent='5', note='n').add_log()
+    Log(date='03/02/2016', task_name='c', time_spent='5', note='n').add_log()
+    first = log_cache.load_logs(path)
+    add_tombstone(first.record_ids[0], path)
+    Log(date='01/02/2016', task_name='a', time_spent='5', note='n').add_log()
+
+    monkeypatch.setattr(log_cache, '_snapshots', {})
+    assert [log['task_name'] for log in log_cache.load_logs(path)] == [
+        'a', 'c'
+    ]
+
+
+@pytest.mark.parametrize('contents', [
+    b'', b'WLSNAP02', b'garbage' * 20,
+    pickle.dumps((1, 'not a snapshot')),
+])
+def test_unreadable_snapshot_is_a_cache_miss(saved_snapshots, contents):
+    path = saved_snapshots
+    with open(path, 'a') as logs:
+        logs.write('01/02/2016,a,5,n\n')
+    with open(path + log_cache.SNAPSHOT_SUFFIX, 'wb') as saved:
+        saved.write(contents)
+    assert log_cache._load_saved(path) is None
+    assert [log['task_name'] for log in log_cache.load_logs(path)] == ['a']
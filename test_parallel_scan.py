@@ -0,0 +1,54 @@
+import concurrent.futures
+import re
+
+import pytest
+
+import parallel_scan
+from parallel_scan import parallel_search_files
+
+
+class RecordingExecutor(concurrent.futures.ProcessPoolExecutor):
+    '''A process pool that notes how it was shut down'''
+
+    shutdowns = []
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        RecordingExecutor.shutdowns.append((wait, cancel_futures))
+        super().shutdown(wait, cancel_futures=cancel_futures)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    RecordingExecutor.shutdowns = []
+    monkeypatch.setattr(
+        concurrent.futures, 'ProcessPoolExecutor', RecordingExecutor
+    )
+    return RecordingExecutor
+
+
+def test_search_files(work_log, executor):
+    work_log.write_text(
+        'date,task_name,time_spent,note\n'
+        '01/02/2016,deploy,5,n\n'
+        '02/02/2016,review,5,n\n'
+    )
+    matches = parallel_search_files(
+        re.compile('deploy'), [str(work_log)], workers=2
+    )
+    assert matches == {str(work_log): {31}}
+    assert executor.shutdowns
+
+
+def test_pool_shut_down_when_a_file_goes_missing(work_log, executor,
+                                                  monkeypatch):
+    def split_ranges(path, chunk_size=None):
+        if path == 'missing.txt':
+            raise FileNotFoundError(path)
+        return [(31, work_log.stat().st_size)]
+
+    monkeypatch.setattr(parallel_scan, 'split_ranges', split_ranges)
+    with pytest.raises(FileNotFoundError):
+        parallel_search_files(
+            re.compile('deploy'), [str(work_log), 'missing.txt'], workers=2
+        )
+    assert (False, True) in executor.shutdowns
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+import csv_functions
+import partitions
+from log import Log
+from log_search import LogSearch
+from partitions import Manifest, partition_key, split_record_id
+from storage import get_storage
+
+
+@pytest.fixture
+def partitioned(work_log):
+    with open(work_log, 'a') as logs:
+        logs.write('03/02/2016,b,5,n\n'
+                   '01/02/2016,a,10,n\n'
+                   '31/03/2016,c,5,n\n'
+                   'someday,d,5,n\n')
+    csv_functions.initialize_work_log('partitioned')
+    return work_log.parent / 'work_logs'
+
+
+def _task_names(logs):
+    return [log['task_name'] for log in logs]
+
+
+def test_partition_key():
+    assert partition_key('01/02/2016') == '2016-02'
+    assert partition_key('31/12/1999') == '1999-12'
+    assert partition_key('someday') == 'undated'
+
+
+def test_work_log_split_by_month(partitioned):
+    assert sorted(path.name for path in partitioned.iterdir()) == [
+        '2016-02.csv', '2016-03.csv', 'manifest.json', 'undated.csv'
+    ]
+    assert (partitioned / '2016-02.csv').read_text() == (
+        'date,task_name,time_spent,note\n'
+        '03/02/2016,b,5,n\n'
+        '01/02/2016,a,10,n\n'
+    )
+    manifest = json.loads((partitioned / 'manifest.json').read_text())
+    assert manifest['partitions']['2016-02'] == {
+        'min_date': '2016-02-01', 'max_date': '2016-02-03', 'rows': 2
+    }
+    assert manifest['partitions']['undated']['min_date'] is None
+    # Every log, undated ones first, then chronologically.
+    assert _task_names(get_storage().load_logs()) == ['d', 'a', 'b', 'c']
+
+
+def test_date_searches_only_open_overlapping_partitions(partitioned,
+                                                        monkeypatch):
+    opened = []
+    load_logs = partitions.load_logs
+
+    def recording_load_logs(path):
+        opened.append(path)
+        return load_logs(path)
+
+    monkeypatch.setattr(partitions, 'load_logs', recording_load_logs)
+    found = LogSearch().find_by_date_range('02/02/2016', '29/02/2016')
+    assert _task_names(found) == ['b']
+    assert [os.path.basename(path) for path in opened] == ['2016-02.csv']
+
+    del opened[:]
+    assert _task_names(LogSearch().find_by_date('31/03/2016')) == ['c']
+    assert [os.path.basename(path) for path in opened] == ['2016-03.csv']
+    assert list(LogSearch().find_by_date_range('01/01/2017',
+                                               '31/12/2017')) == []
+
+
+def test_other_searches_cover_every_partition(partitioned):
+    search = LogSearch()
+    assert _task_names(search.find_by_time_spent(5)) == ['d', 'b', 'c']
+    assert _task_names(search.find_by_string('c')) == ['c']
+    report = dict(get_storage().report('month'))
+    assert report[('2016-02',)].total == 15
+
+
+def test_adding_and_deleting_logs(partitioned):
+    Log(date='05/04/2016', task_name='e', time_spent='5', note='n').add_log()
+    assert (partitioned / '2016-04.csv').exists()
+    assert Manifest.load(str(partitioned)).partitions['2016-04']['rows'] == 1
+
+    search = LogSearch()
+    log = next(iter(search.find_by_date('03/02/2016')))
+    assert split_record_id(log.record_id) == ('2016-02', 31)
+    Log(record_id=log.record_id, generation=search.generation,
+        **log.as_dict()).delete_log()
+    assert _task_names(LogSearch().find_by_date_range(
+        '01/01/2016', '31/12/2016'
+    )) == ['a', 'c', 'e']
+    assert Manifest.load(str(partitioned)).partitions['2016-02']['rows'] == 1
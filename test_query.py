@@ -0,0 +1,96 @@
+import collections
+import re
+
+import pytest
+
+import instrumentation
+import log_search
+from log import Log
+from log_search import LogSearch
+from query import (And, DateRange, OnDate, Or, Pattern, Phrase, TimeSpent,
+                   compile_pattern)
+
+
+LOGS = [
+    ('03/02/2016', 'deploy', '30'),
+    ('01/02/2016', 'review', '30'),
+    ('01/02/2016', 'deploy', '5'),
+    ('15/03/2016', 'deploy', '030'),
+    ('02/02/2016', 'lunch', '60'),
+]
+
+
+@pytest.fixture
+def logs(work_log, monkeypatch):
+    monkeypatch.setattr(log_search, '_results', collections.OrderedDict())
+    monkeypatch.setattr(instrumentation, 'ENABLED', True)
+    monkeypatch.setattr(instrumentation, '_counts', {})
+    for date, task_name, time_spent in LOGS:
+        Log(date=date, task_name=task_name, time_spent=time_spent,
+            note='n').add_log()
+
+
+def _found(query):
+    return [(log['date'], log['task_name'], log['time_spent'])
+            for log in LogSearch().find(query)]
+
+
+def _checked(query):
+    '''The logs matching a query, checking every log, in date order'''
+    return [(log['date'], log['task_name'], log['time_spent'])
+            for log in LogSearch().logs if query.matches(log)]
+
+
+def test_queries_are_compared_by_their_terms():
+    assert DateRange('01/01/2016', '31/01/2016') == DateRange(
+        '01/01/2016', '31/01/2016'
+    )
+    assert hash(TimeSpent('030')) == hash(TimeSpent(30))
+    assert Phrase('a') != Pattern('a')
+    query = OnDate('01/02/2016') & (TimeSpent(5) & Phrase('deploy'))
+    assert query.queries == [OnDate('01/02/2016'), TimeSpent(5),
+                             Phrase('deploy')]
+    assert repr(query) == (
+        "(OnDate('01/02/2016') & TimeSpent(5) & Phrase('deploy'))"
+    )
+    assert compile_pattern('dep', re.I) is compile_pattern('dep', re.I)
+
+
+def test_and_searches_for_the_most_selective_query(logs):
+    search = LogSearch()
+    query = Phrase('deploy') & OnDate('01/02/2016') & TimeSpent(30)
+    first, rest = query.plan(search)
+    assert first == OnDate('01/02/2016')
+    assert rest == [TimeSpent(30), Phrase('deploy')]
+    # A regex with no literal text has no index to use.
+    first, _ = (Pattern(r'\w+') & TimeSpent(30)).plan(search)
+    assert first == TimeSpent(30)
+
+
+@pytest.mark.parametrize('query', [
+    DateRange('01/02/2016', '28/02/2016') & TimeSpent(30),
+    Phrase('deploy') & TimeSpent(30),
+    Phrase('deploy') | OnDate('01/02/2016'),
+    Pattern(r'\w+w') | TimeSpent(60),
+    (Phrase('deploy') | Phrase('lunch')) & DateRange('01/02/2016',
+                                                    '02/02/2016'),
+])
+def test_planned_queries_find_what_checking_every_log_would(logs, query):
+    assert _found(query) == _checked(query)
+    assert _found(query)
+
+
+def test_results_are_remembered_until_the_logs_change(logs):
+    query = Phrase('deploy') & TimeSpent(30)
+    assert _found(query) == [('03/02/2016', 'deploy', '30'),
+                             ('15/03/2016', 'deploy', '030')]
+    assert _found(query) == _found(Phrase('deploy') & TimeSpent('030'))
+    counts = instrumentation._counts
+    assert (counts['query_cache_miss'], counts['query_cache_hit']) == (1, 2)
+
+    Log(date='04/02/2016', task_name='deploy', time_spent='30',
+        note='n').add_log()
+    assert len(_found(query)) == 3
+    assert counts['query_cache_miss'] == 2
+    # The result found in the old table of logs was dropped.
+    assert len(log_search._results) == 1
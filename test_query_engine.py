@@ -0,0 +1,73 @@
+import subprocess
+import sys
+
+import pytest
+
+import query_engine
+from log import Log
+from log_search import LogSearch
+from log_table import LogTable
+from query import TimeSpent
+from query_engine import QueryEngine
+
+
+def _table(*minutes):
+    table = LogTable()
+    for number, time_spent in enumerate(minutes):
+        table.append({
+            'date': '01/02/2016', 'task_name': 'a', 'time_spent': time_spent,
+            'note': 'n'
+        }, number)
+    return table
+
+
+@pytest.fixture(params=['numpy', 'pure python'])
+def engine_numpy(request, monkeypatch):
+    if request.param == 'pure python':
+        monkeypatch.setattr(query_engine, 'numpy', None)
+    elif query_engine._numpy() is None:
+        pytest.skip('NumPy is not installed')
+
+
+def test_time_spent_too_large_for_the_column(engine_numpy):
+    engine = QueryEngine(_table('5', '3000000000', '10' * 20, 'x', '030'))
+    assert engine.equals('time_spent', 3000000000).rows() == [1]
+    assert engine.equals('time_spent', int('10' * 20)).rows() == [2]
+    assert engine.equals('time_spent', 30).rows() == [4]
+    assert engine.between('time_spent', 6, 2**40).rows() == [1, 4]
+    assert engine.between('time_spent', 0, 10**40).count() == 4
+
+
+def test_find_a_log_with_a_large_time_spent(work_log):
+    Log(date='01/02/2016', task_name='a', time_spent='3000000000',
+        note='n').add_log()
+    found = list(LogSearch().find(TimeSpent('3000000000')))
+    assert [log['time_spent'] for log in found] == ['3000000000']
+
+
+def test_one_engine_per_table(work_log):
+    Log(date='01/02/2016', task_name='a', time_spent='5', note='n').add_log()
+    logs = LogSearch().logs
+    engine = QueryEngine.of(logs)
+    assert QueryEngine.of(logs) is engine
+    assert QueryEngine.of(LogSearch().logs) is engine
+
+    # Adding a log gives a new table, with a new engine.
+    Log(date='02/02/2016', task_name='b', time_spent='5', note='n').add_log()
+    logs = LogSearch().logs
+    assert QueryEngine.of(logs) is not engine
+    assert QueryEngine.of(logs).equals('time_spent', 5).rows() == [0, 1]
+
+    table = _table('5')
+    engine = QueryEngine.of(table)
+    table.append({'date': '01/02/2016', 'task_name': 'a', 'time_spent': '5',
+                  'note': 'n'})
+    assert QueryEngine.of(table).equals('time_spent', 5).rows() == [0, 1]
+
+
+def test_numpy_is_not_imported_at_startup():
+    # Checked in a new interpreter, as this one may have imported it already.
+    subprocess.run([
+        sys.executable, '-c',
+        'import sys, query_cli; assert "numpy" not in sys.modules'
+    ], check=True)
@@ -0,0 +1,57 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from server import WorkLogServer
+
+
+@pytest.fixture
+def url(work_log):
+    server = WorkLogServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url, path, body):
+    request = urllib.request.Request(
+        url + path, json.dumps(body).encode('utf-8'),
+        {'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def _get(url, path):
+    with urllib.request.urlopen(url + path) as response:
+        return json.loads(response.read())
+
+
+@pytest.mark.parametrize('field', ['task_name', 'note'])
+def test_add_rejects_a_field_with_a_line_break(url, work_log, field):
+    log = {'date': '01/02/2016', 'task_name': 'a', 'time_spent': '5',
+           'note': 'n'}
+    log[field] = 'line one\nline two'
+    status, response = _post(url, '/logs', log)
+    assert status == 400
+    assert 'error' in response
+    assert work_log.read_text() == 'date,task_name,time_spent,note\n'
+
+
+def test_add_then_search(url):
+    log = {'date': '01/02/2016', 'task_name': 'a b', 'time_spent': '5',
+           'note': 'n'}
+    status, response = _post(url, '/logs', log)
+    assert status == 201
+    found = _get(url, '/search/pattern?regex=.')
+    assert found['count'] == 1
+    assert found['logs'][0]['record_id'] == response['record_id']
+    assert {field: found['logs'][0][field] for field in log} == log
@@ -0,0 +1,53 @@
+import csv_functions
+from log import Log
+from log_search import LogSearch
+from query import TimeSpent
+from storage import get_storage
+
+
+HUGE = '100000000000000000000'
+
+
+def test_time_spent_too_large_for_an_sqlite_integer(work_log):
+    # The log is already in work_log.txt when the database is migrated.
+    with open(work_log, 'a') as logs:
+        logs.write('01/02/2016,huge,{},n\n'.format(HUGE))
+    csv_functions.initialize_work_log('sqlite')
+
+    Log(date='02/02/2016', task_name='huge', time_spent=HUGE,
+        note='n').add_log()
+    Log(date='02/02/2016', task_name='small', time_spent='5',
+        note='n').add_log()
+
+    search = LogSearch()
+    found = list(search.find_by_time_spent(int(HUGE)))
+    assert [log['date'] for log in found] == ['01/02/2016', '02/02/2016']
+    assert len(list(search.find(TimeSpent(HUGE)))) == 2
+    assert [log['task_name'] for log in search.find_by_time_spent(5)] == [
+        'small'
+    ]
+
+    report = dict(get_storage().report(None, True))
+    assert report[('huge',)].total == 2 * int(HUGE)
+    assert report[('small',)].total == 5
+
+
+def test_delete_by_row_id_and_ids_never_reused(work_log):
+    csv_functions.initialize_work_log('sqlite')
+    for _ in range(3):
+        Log(date='01/02/2016', task_name='a', time_spent='5',
+            note='n').add_log()
+    storage = get_storage()
+    logs = list(LogSearch().find_by_date('01/02/2016'))
+    log = logs[1].as_dict()
+    assert storage.delete(log, logs[1].record_id) == 1
+    assert storage.delete(log, logs[1].record_id) == 0
+    assert storage.delete(log) == 1
+    assert [found.record_id for found in LogSearch().find_by_date(
+        '01/02/2016'
+    )] == [logs[2].record_id]
+
+    storage.clear()
+    Log(date='01/02/2016', task_name='a', time_spent='5', note='n').add_log()
+    found = list(LogSearch().find_by_date('01/02/2016'))
+    assert found[0].record_id > logs[2].record_id
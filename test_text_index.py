@@ -0,0 +1,68 @@
+import re
+
+import pytest
+
+import text_index
+from log import Log
+from log_search import LogSearch
+from text_index import INDEX_SUFFIX, TextIndex, get_text_index, regex_trigrams
+
+
+@pytest.fixture
+def logs(work_log, monkeypatch):
+    monkeypatch.setattr(text_index, '_indexes', {})
+    for task_name, note in (('deploy', 'straße'), ('review', 'deployment'),
+                            ('lunch', 'İstanbul')):
+        Log(date='01/02/2016', task_name=task_name, time_spent='5',
+            note=note).add_log()
+    return str(work_log)
+
+
+def test_regex_trigrams():
+    assert regex_trigrams(re.compile('dep')) == 'dep'
+    assert regex_trigrams(re.compile(r'\d+')) is None
+    assert regex_trigrams(re.compile('ab(cde|xyz)')) == (
+        'or', ['cde', 'xyz']
+    )
+
+
+def test_search_narrowed_down_by_the_index(logs):
+    found = LogSearch().find_by_pattern(re.compile('deploy'))
+    assert [log['task_name'] for log in found] == ['deploy', 'review']
+    found = LogSearch().find_by_pattern(re.compile('STRAßE', re.IGNORECASE))
+    assert [log['task_name'] for log in found] == ['deploy']
+    # Python's re module doesn't match 'ß' to 'ss', and nor does the index.
+    found = LogSearch().find_by_pattern(re.compile('STRASSE', re.IGNORECASE))
+    assert list(found) == []
+    found = LogSearch().find_by_pattern(re.compile('istanbul', re.IGNORECASE))
+    assert [log['task_name'] for log in found] == ['lunch']
+
+
+def test_saved_index_is_read_back(logs, monkeypatch):
+    index = get_text_index(logs)
+    index.save(logs)
+    loaded = TextIndex.load(logs)
+    assert loaded.postings == index.postings
+    assert (loaded.inode, loaded.size, loaded.count) == (
+        index.inode, index.size, index.count
+    )
+
+    # A new run catches up with logs added since the index was saved.
+    Log(date='02/02/2016', task_name='deploy again', time_spent='5',
+        note='n').add_log()
+    monkeypatch.setattr(text_index, '_indexes', {})
+    found = LogSearch().find_by_pattern(re.compile('deploy'))
+    assert [log['task_name'] for log in found] == [
+        'deploy', 'review', 'deploy again'
+    ]
+
+
+@pytest.mark.parametrize('contents', [
+    b'', b'WLTEXT03', b'garbage' * 20,
+    b'\x80\x04\x95\x05\x00\x00\x00\x00\x00\x00\x00\x8c\x01a\x94.',
+])
+def test_unreadable_index_is_rebuilt(logs, contents):
+    with open(logs + INDEX_SUFFIX, 'wb') as saved:
+        saved.write(contents)
+    assert TextIndex.load(logs) is None
+    assert get_text_index(logs).count == 3
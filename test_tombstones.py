@@ -0,0 +1,108 @@
+from csv_functions import iter_log_records, iter_record_offsets
+from log import Log
+from log_search import LogSearch
+from storage import get_storage
+from tombstones import (TOMBSTONE_SUFFIX, add_tombstone, compact_work_log,
+                        load_tombstones)
+
+
+def _add(*task_names):
+    for task_name in task_names:
+        Log(date='01/02/2016', task_name=task_name, time_spent='5',
+            note='n').add_log()
+
+
+def _records(path):
+    return [(record_id, log['task_name'])
+            for record_id, log in iter_log_records(path)]
+
+
+def test_deleting_keeps_the_other_logs_record_ids(work_log):
+    path = str(work_log)
+    _add('a', 'b', 'a', 'c')
+    before = _records(path)
+    size = work_log.stat().st_size
+
+    # The second 'a' is deleted by identity, as the detail view does.
+    search = LogSearch()
+    log = list(search.find_by_date('01/02/2016'))[2]
+    Log(record_id=log.record_id, generation=search.generation,
+        **log.as_dict()).delete_log()
+
+    # Only a tombstone is written; the work log itself is untouched.
+    assert work_log.stat().st_size == size
+    assert load_tombstones(path) == {before[2][0]}
+    assert _records(path) == before[:2] + before[3:]
+    assert [log.record_id for log in LogSearch().find_by_date(
+        '01/02/2016'
+    )] == [record_id for record_id, _ in before[:2] + before[3:]]
+
+
+def test_delete_without_a_record_id_removes_the_first_match(work_log):
+    _add('a', 'b', 'a')
+    before = _records(str(work_log))
+    Log(date='01/02/2016', task_name='a', time_spent='5',
+        note='n').delete_log()
+    assert _records(str(work_log)) == before[1:]
+
+
+def test_compaction_drops_dead_logs_only_past_the_ratio(work_log):
+    path = str(work_log)
+    _add('a', 'b', 'c', 'd')
+    records = _records(path)
+    add_tombstone(records[1][0], path)
+    assert not compact_work_log(path, 0.25)
+    assert load_tombstones(path) == {records[1][0]}
+
+    add_tombstone(records[3][0], path)
+    assert compact_work_log(path, 0.25)
+    assert not work_log.with_name('work_log.txt' + TOMBSTONE_SUFFIX).exists()
+    assert load_tombstones(path) == set()
+    assert work_log.read_text() == (
+        'date,task_name,time_spent,note\n'
+        '01/02/2016,a,5,n\n'
+        '01/02/2016,c,5,n\n'
+    )
+    # The live logs' record ids are their offsets in the new file, and
+    # searches see them.
+    compacted = _records(path)
+    assert [record_id for record_id, _ in compacted] == list(
+        iter_record_offsets(path)
+    )
+    found = LogSearch().find_by_date('01/02/2016')
+    assert [(log.record_id, log['task_name']) for log in found] == compacted
+
+
+def test_record_id_from_before_compaction_is_not_trusted(work_log):
+    path = str(work_log)
+    _add('a', 'b', 'c')
+    search = LogSearch()
+    stale = list(search.find_by_date('01/02/2016'))[1]
+    records = _records(path)
+    add_tombstone(records[0][0], path)
+    assert compact_work_log(path, 0)
+
+    # 'c' now starts where 'b' did, so b's old record id is discarded
+    # along with the generation it came from, and 'b' is found by its
+    # details instead.
+    assert _records(path)[1] == (stale.record_id, 'c')
+    Log(record_id=stale.record_id, generation=search.generation,
+        **stale.as_dict()).delete_log()
+    assert [task_name for _, task_name in _records(path)] == ['c']
+
+
+def test_deleting_one_of_several_identical_logs(work_log):
+    _add('a', 'a', 'a')
+    records = _records(str(work_log))
+    storage = get_storage()
+    log = {'date': '01/02/2016', 'task_name': 'a', 'time_spent': '5',
+           'note': 'n'}
+    assert storage.delete(log, records[1][0], storage.generation()) == 1
+    # Deleting it again (e.g. from a stale result) changes nothing.
+    assert storage.delete(log, records[1][0], storage.generation()) == 0
+    assert _records(str(work_log)) == [records[0], records[2]]
+    assert dict(storage.report(None, True))[('a',)].count == 2
+
+    assert storage.delete(log) == 1
+    assert _records(str(work_log)) == [records[2]]
+    assert dict(storage.report(None, True))[('a',)].count == 1
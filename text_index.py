@@ -0,0 +1,474 @@
+'''
+A trigram index of the logs' task names and notes
+
+Every three character substring (trigram) of each log's task name and note
+is indexed, case folded, so a search can be narrowed down to the logs
+containing the trigrams it needs. For a regex, the trigrams are worked out
+from the literal text the pattern requires, in the style of Google Code
+Search: 'deploy(ment|ing)' needs 'dep', 'epl', 'plo' and 'loy', and then
+either 'men' and 'ent', or 'ing' (see regex_trigrams()). The candidates
+found still need checking against the regex itself. A pattern requiring no
+literal text (e.g. '\\d+') can't be narrowed down, and every log is checked.
+
+The index is saved alongside the work log (e.g. work_log.txt.textidx) and
+kept in memory once loaded. It covers the logs in the first size bytes of
+the file. Logs appended since (by this process, see record_text_append(),
+or another) are added to it when it's next used, so adding a log never
+rewrites the index; the index is only saved again once enough logs have
+been added. Deleted logs are left in the index, since searches only ever
+check candidates that are still in the table of live logs.
+
+Index lookups are counted with instrumentation.count(): text_index_hit
+when a search is narrowed down, text_index_miss when every log has to be
+checked, plus the number of text_index_candidates checked.
+'''
+import array
+import functools
+import itertools
+import json
+import os
+import re
+import struct
+import threading
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from instrumentation import count, timed
+from locking import atomic_write, work_log_lock
+
+
+# The sidecar index lives next to the work log it describes, e.g.
+# work_log.txt -> work_log.txt.textidx
+INDEX_SUFFIX = '.textidx'
+
+# Header: magic (changed whenever the saved format changes, so older
+# indexes are rebuilt), the work log's inode and the size indexed, the number
+# of logs indexed, the length of the (JSON) list of trigrams and the total
+# number of postings. The trigrams, the number of postings of each and the
+# postings themselves (as arrays of record ids) follow.
+_MAGIC = b'WLTEXT03'
+_HEADER = struct.Struct('<8sQqqqq')
+
+# How many logs can be added to an index in memory before it's saved again.
+SAVE_EVERY = 1000
+
+# A search whose candidates are more than this fraction of the logs isn't
+# worth narrowing down: checking every log is about as quick.
+SELECTIVITY = 0.5
+
+# The indexes loaded by this process, by work log path.
+_indexes = {}
+_indexes_guard = threading.RLock()
+
+
+def fold(text):
+    '''
+    Case folds text the way the index does
+
+    Python's re module ignores case using simple case folding, except that
+    the dotted and dotless Turkish i also match 'i', so those are folded to
+    'i' too. A log matching a regex (ignoring case or not) then always
+    contains the folded trigrams of the regex's literal text.
+    '''
+    return text.casefold().replace('i\u0307', 'i').replace('\u0131', 'i')
+
+
+def trigrams(text):
+    '''Returns the set of trigrams of a (folded) string'''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _all_of(queries):
+    '''Combines trigram queries that must all match (see regex_trigrams())'''
+    flattened = []
+    for query in queries:
+        if isinstance(query, tuple) and query[0] == 'and':
+            flattened.extend(query[1])
+        elif query is not None:
+            flattened.append(query)
+    if not flattened:
+        return None
+    if len(flattened) == 1:
+        return flattened[0]
+    return ('and', flattened)
+
+
+def _any_of(queries):
+    '''Combines trigram queries of which one must match'''
+    if not queries or None in queries:
+        return None
+    if len(queries) == 1:
+        return queries[0]
+    return ('or', queries)
+
+
+def _literal_trigrams(text):
+    '''Returns the query needing every trigram of some literal text'''
+    return _all_of(sorted(trigrams(fold(text))))
+
+
+def _opcode(name):
+    '''Returns a regex opcode by name (or None if this Python lacks it)'''
+    return getattr(sre_constants, name, None)
+
+
+_LITERAL = _opcode('LITERAL')
+_AT = _opcode('AT')
+_SUBPATTERN = _opcode('SUBPATTERN')
+_BRANCH = _opcode('BRANCH')
+_ATOMIC_GROUP = _opcode('ATOMIC_GROUP')
+_REPEATS = {
+    _opcode('MAX_REPEAT'), _opcode('MIN_REPEAT'),
+    _opcode('POSSESSIVE_REPEAT')
+} - {None}
+
+
+def _sequence_trigrams(items, ignore_case, ascii_only):
+    '''
+    Works out the trigram query for a parsed sequence of regex items
+
+    Runs of literal characters are collected, and every trigram of each run
+    is needed. Anything that isn't a literal ends the current run, but
+    groups, alternations and repeats of at least once add what they need in
+    turn. Zero width assertions (^, $, \\b) don't end a run, as they match
+    nothing.
+    '''
+    queries = []
+    run = []
+
+    def end_run():
+        if len(run) >= 3:
+            queries.append(_literal_trigrams(''.join(run)))
+        del run[:]
+
+    def is_literal(item):
+        # Ignoring case, only ASCII characters are known to match nothing
+        # but their own case folded forms (see fold()).
+        # With ascii_only, other characters aren't literals at all, nor is
+        # 'i' when ignoring case (see regex_trigrams()).
+        op, argument = item
+        if op is not _LITERAL:
+            return False
+        character = chr(argument)
+        if ascii_only:
+            return character.isascii() and not (
+                ignore_case and character in 'iI'
+            )
+        return character.isascii() or not ignore_case
+
+    for op, argument in items:
+        if is_literal((op, argument)):
+            run.append(chr(argument))
+        elif op is _AT:
+            continue
+        elif op is _SUBPATTERN:
+            _, add_flags, del_flags, pattern = argument
+            group_ignore_case = bool(
+                (ignore_case or add_flags & re.IGNORECASE) and
+                not del_flags & re.IGNORECASE
+            )
+            if group_ignore_case == ignore_case and all(
+                    is_literal(item) or item[0] is _AT for item in pattern):
+                # A group of plain text carries on the current run.
+                run.extend(
+                    chr(item[1]) for item in pattern if item[0] is _LITERAL
+                )
+            else:
+                end_run()
+                queries.append(
+                    _sequence_trigrams(pattern, group_ignore_case, ascii_only)
+                )
+        elif op is _ATOMIC_GROUP:
+            end_run()
+            queries.append(
+                _sequence_trigrams(argument, ignore_case, ascii_only)
+            )
+        elif op is _BRANCH:
+            end_run()
+            queries.append(_any_of([
+                _sequence_trigrams(branch, ignore_case, ascii_only)
+                for branch in argument[1]
+            ]))
+        elif op in _REPEATS:
+            low, high, pattern = argument
+            if low >= 1 and len(pattern) == 1 and is_literal(pattern[0]):
+                # A repeated character: at least low of them follow the run
+                # so far, and at least low of them precede what comes next.
+                character = chr(pattern[0][1])
+                run.extend(character * low)
+                if high != low:
+                    end_run()
+                    run.extend(character * low)
+            else:
+                end_run()
+                if low >= 1:
+                    queries.append(
+                        _sequence_trigrams(pattern, ignore_case, ascii_only)
+                    )
+        else:
+            end_run()
+    end_run()
+    return _all_of(queries)
+
+
+def regex_trigrams(regex, ascii_only=False):
+    '''
+    Works out the trigrams a regex needs a log's text to contain
+
+    With ascii_only, only trigrams of ASCII text are used (and, ignoring
+    case, none with an 'i'), for indexes that don't fold case as fold()
+    does: SQLite's FTS5 folds ASCII, but not 'ß' to 'ss' or the Turkish i.
+
+    Arguments: Compiled Regex, Boolean
+    Returns: Trigram query -- a trigram String, a Tuple ('and' or 'or', List
+    of queries), or None if the regex needs no trigrams at all
+    '''
+    return _pattern_trigrams(regex.pattern, regex.flags, ascii_only)
+
+
+@functools.lru_cache(maxsize=128)
+def _pattern_trigrams(pattern, flags, ascii_only):
+    '''Works out the trigrams a regex needs (see regex_trigrams())'''
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    return _sequence_trigrams(
+        parsed, bool(state.flags & re.IGNORECASE), ascii_only
+    )
+
+
+class TextIndex():
+    '''
+    The trigram index of a work log (see the module docstring)
+
+    postings maps each trigram to the record ids of the logs it appears in
+    (as an array, in the order the logs were indexed). The index covers the
+    logs in the first size bytes of the work log with the given inode.
+    '''
+
+    def __init__(self, inode=None, size=0):
+        self.postings = {}
+        self.inode = inode
+        self.size = size
+        self.count = 0
+        self.unsaved = 0
+        self.deleted = set()
+
+    @classmethod
+    @timed('build_text_index')
+    def build(cls, logs, identity):
+        '''
+        Builds an index of a LogTable (or any iterable of rows with a
+        record_id), for a work log with the given (inode, size)
+        '''
+        index = cls(*identity)
+        for log in logs:
+            index.add(log.record_id, log)
+        return index
+
+    @classmethod
+    def load(cls, path='work_log.txt'):
+        '''Reads the sidecar index for a work log, or returns None'''
+        try:
+            with open(path + INDEX_SUFFIX, 'rb') as index_file:
+                magic, inode, size, logs, keys_size, total = _HEADER.unpack(
+                    index_file.read(_HEADER.size)
+                )
+                if magic != _MAGIC:
+                    return None
+                keys = json.loads(index_file.read(keys_size))
+                lengths = array.array('q')
+                lengths.fromfile(index_file, len(keys))
+                postings = array.array('q')
+                postings.fromfile(index_file, total)
+            if sum(lengths) != total or not all(
+                    isinstance(key, str) for key in keys):
+                return None
+        except Exception:
+            # A missing index, or one that can't be read (e.g. truncated,
+            # or written by an older version), is rebuilt.
+            return None
+        index = cls(inode, size)
+        index.count = logs
+        starts = itertools.accumulate(lengths, initial=0)
+        for key, start, length in zip(keys, starts, lengths):
+            index.postings[key] = postings[start:start + length]
+        return index
+
+    def save(self, path='work_log.txt'):
+        '''
+        Writes the index to its sidecar file (atomically)
+
+        Deleted logs are only noted in memory (see the module docstring),
+        so they aren't saved.
+        '''
+        keys = list(self.postings)
+        encoded_keys = json.dumps(keys).encode('utf-8')
+        lengths = array.array('q', map(len, self.postings.values()))
+        with atomic_write(path + INDEX_SUFFIX) as index_file:
+            index_file.write(_HEADER.pack(
+                _MAGIC, self.inode, self.size, self.count,
+                len(encoded_keys), sum(lengths)
+            ))
+            index_file.write(encoded_keys)
+            lengths.tofile(index_file)
+            for key in keys:
+                self.postings[key].tofile(index_file)
+        self.unsaved = 0
+
+    def add(self, record_id, log):
+        '''Adds a log's task name and note to the index'''
+        found = trigrams(fold(log['task_name'] or ''))
+        found.update(trigrams(fold(log['note'] or '')))
+        for trigram in found:
+            postings = self.postings.get(trigram)
+            if postings is None:
+                postings = self.postings[trigram] = array.array('q')
+            postings.append(record_id)
+        self.count += 1
+        self.unsaved += 1
+
+    def remove(self, record_id):
+        '''Notes that a log has been deleted'''
+        self.deleted.add(record_id)
+
+    def _lookup(self, query, total):
+        '''Returns the record ids of the logs a trigram query could match'''
+        if isinstance(query, str):
+            return set(self.postings.get(query, ()))
+        operator, queries = query
+        if operator == 'or':
+            found = set()
+            for query in queries:
+                found |= self._lookup(query, total)
+            return found
+        # The rarest trigrams are looked up first, and the rest only while
+        # there are candidates left.
+        queries = sorted(queries, key=lambda query: self._size(query))
+        found = None
+        for query in queries:
+            if found is not None and not found:
+                break
+            if self._size(query) > total * SELECTIVITY and found is not None:
+                # Common trigrams barely narrow the candidates down.
+                break
+            matched = self._lookup(query, total)
+            found = matched if found is None else found & matched
+        return found
+
+    def _size(self, query):
+        '''Returns roughly how many logs a trigram query could match'''
+        if isinstance(query, str):
+            return len(self.postings.get(query, ()))
+        operator, queries = query
+        sizes = [self._size(query) for query in queries]
+        return sum(sizes) if operator == 'or' else min(sizes)
+
+    def regex_candidates(self, regex, total=None):
+        '''
+        Finds the record ids of the logs that could match a regex
+
+        Argument: Compiled Regex, Integer or None (Number of live logs, to
+        tell whether the index narrows the search down enough to be worth
+        it)
+        Returns: Set of Integers (Record ids), or None if every log has to
+        be checked
+        '''
+        query = regex_trigrams(regex)
+        if total is None:
+            total = self.count - len(self.deleted)
+        if query is None or self._size(query) > total * SELECTIVITY:
+            count('text_index_miss')
+            return None
+        candidates = self._lookup(query, total) - self.deleted
+        count('text_index_hit')
+        count('text_index_candidates', len(candidates))
+        return candidates
+
+
+def _identity(path):
+    '''Returns the (inode, size) of a work log'''
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size
+
+
+def get_text_index(path='work_log.txt'):
+    '''
+    Returns an up to date TextIndex for the work log
+
+    The index kept in memory, or else the saved one, is used if it was
+    built for the same file (a rewritten work log is a new file), adding
+    any logs appended since. Otherwise the index is rebuilt from the logs.
+
+    The logs are loaded (see log_cache.load_logs()) holding the work log's
+    lock, so they are exactly the logs in the size of the file noted: with
+    a table loaded earlier, a log appended in between (e.g. by another
+    thread) would be counted as indexed without having been added.
+
+    Argument: String (Path to the work log)
+    '''
+    # Imported here as csv_functions (which log_cache uses) imports this
+    # module.
+    from log_cache import load_logs
+
+    key = os.path.abspath(path)
+    with work_log_lock(path, shared=True), _indexes_guard:
+        logs = load_logs(path)
+        identity = _identity(path)
+        index = _indexes.get(key)
+        if index is None or index.inode != identity[0]:
+            index = TextIndex.load(path)
+        if (index is None or index.inode != identity[0] or
+                index.size > identity[1]):
+            index = TextIndex.build(logs, identity)
+            index.unsaved = SAVE_EVERY
+        elif index.size < identity[1]:
+            # Add the logs appended since the index was last brought up to
+            # date (their record ids being the offsets they were written
+            # at).
+            for row, record_id in enumerate(logs.record_ids):
+                if index.size <= record_id < identity[1]:
+                    index.add(record_id, logs[row])
+            index.size = identity[1]
+        if index.unsaved >= SAVE_EVERY:
+            try:
+                index.save(path)
+            except OSError:
+                pass
+        _indexes[key] = index
+    return index
+
+
+def record_text_append(record_id, log, previous_identity,
+                       path='work_log.txt'):
+    '''
+    Adds a log just appended to the work log to the index in memory, if the
+    index covered the whole work log before the append (otherwise it
+    catches up the next time it's used)
+
+    Arguments: Integer (Record id), Dictionary (The log), Tuple (size, mtime
+    of the work log before the append), String (Path to the work log)
+    '''
+    with _indexes_guard:
+        index = _indexes.get(os.path.abspath(path))
+        if index is None or index.size != previous_identity[0]:
+            return
+        identity = _identity(path)
+        if identity[0] != index.inode:
+            return
+        index.add(record_id, log)
+        index.size = identity[1]
+
+
+def record_text_delete(record_id, log, path='work_log.txt'):
+    '''Notes a deleted log in the index in memory (if it's loaded)'''
+    with _indexes_guard:
+        index = _indexes.get(os.path.abspath(path))
+        if index is not None:
+            index.remove(record_id)
@@ -0,0 +1,130 @@
+import array
+import os
+
+from locking import atomic_rewrite, work_log_lock
+
+
+# Deleted logs are recorded in a sidecar file next to the work log, e.g.
+# work_log.txt -> work_log.txt.dead, as an array of record ids.
+TOMBSTONE_SUFFIX = '.dead'
+
+# compact_work_log() only rewrites the work log once more than this fraction
+# of its records are dead. Can be set with WORK_LOG_COMPACTION_RATIO.
+COMPACTION_RATIO = float(os.environ.get('WORK_LOG_COMPACTION_RATIO', 0.25))
+
+# How many bytes compact_work_log() copies at a time.
+COPY_CHUNK = 1 << 20
+
+
+def load_tombstones(path='work_log.txt'):
+    '''
+    Returns the record ids of the deleted logs in a work log
+
+    A log's record id is the byte offset at which it starts in the work log
+    file. Ids are stable until the file is next rewritten (by
+    compact_work_log() or clear_all_logs()), which also discards the
+    tombstones (see csv_functions.discard_sidecars()).
+
+    Argument: String (Path to the work log)
+    Returns: Set of Integers (Record ids of deleted logs)
+    '''
+    dead = array.array('q')
+    try:
+        with open(path + TOMBSTONE_SUFFIX, 'rb') as tombstones:
+            data = tombstones.read()
+    except FileNotFoundError:
+        return set()
+    # Ignore a partially written id at the end of the file.
+    dead.frombytes(data[:len(data) - len(data) % dead.itemsize])
+    return set(dead)
+
+
+def tombstones_size(path='work_log.txt'):
+    '''
+    Returns the size of a work log's tombstone file (0 if there isn't one),
+    which grows by one id with every delete
+    '''
+    try:
+        return os.path.getsize(path + TOMBSTONE_SUFFIX)
+    except FileNotFoundError:
+        return 0
+
+
+def add_tombstone(record_id, path='work_log.txt'):
+    '''Marks the log with the given record id as deleted (a single append)'''
+    with open(path + TOMBSTONE_SUFFIX, 'ab') as tombstones:
+        tombstones.write(array.array('q', [record_id]).tobytes())
+
+
+def _copy_span(source, target, start, end):
+    '''Copies the bytes between two offsets of a file, a chunk at a time'''
+    source.seek(start)
+    while start < end:
+        chunk = source.read(min(end - start, COPY_CHUNK))
+        if not chunk:
+            break
+        target.write(chunk)
+        start += len(chunk)
+
+
+def compact_work_log(path='work_log.txt', ratio=None):
+    '''
+    Rewrites a work log without its deleted logs, if enough are dead
+
+    The file is only rewritten when the fraction of its records that are
+    dead is greater than ratio (COMPACTION_RATIO by default). The span of
+    bytes each dead log occupies (up to the start of the next record) is
+    left out of the rewritten file, so this works for csv and binary work
+    logs alike. The new file replaces the old one atomically (see
+    locking.atomic_rewrite()), while the work log's lock is held.
+
+    Only where each record starts is worked out, not what it holds. The
+    bytes before the first dead log are copied over as they are, and after
+    it each run of live logs is copied in one go, a chunk at a time, so
+    the work log is streamed through rather than read in whole.
+
+    Arguments: String (Path to the work log), Float or None (Dead record
+    ratio above which to compact)
+    Returns: Boolean (True if the work log was rewritten)
+    '''
+    # Imported here as csv_functions calls this at startup.
+    from csv_functions import iter_record_offsets
+
+    if ratio is None:
+        ratio = COMPACTION_RATIO
+
+    with work_log_lock(path):
+        dead = load_tombstones(path)
+        if not dead:
+            return False
+
+        # Every record is counted, but only those from the first dead one
+        # on are noted.
+        first_dead = min(dead)
+        total = 0
+        record_ids = []
+        for record_id in iter_record_offsets(path):
+            total += 1
+            if record_id >= first_dead:
+                record_ids.append(record_id)
+        if not total or len(dead) / total <= ratio:
+            return False
+
+        # The live records are copied into a new file, which then replaces
+        # the work log (discarding its sidecars) in one atomic rename.
+        with open(path, 'rb') as work_log, \
+                atomic_rewrite(path) as compacted:
+            record_ids.append(os.fstat(work_log.fileno()).st_size)
+            _copy_span(work_log, compacted, 0, record_ids[0])
+            live_start = None
+            for start, end in zip(record_ids, record_ids[1:]):
+                if start not in dead:
+                    if live_start is None:
+                        live_start = start
+                    continue
+                if live_start is not None:
+                    _copy_span(work_log, compacted, live_start, start)
+                    live_start = None
+            if live_start is not None:
+                _copy_span(work_log, compacted, live_start, record_ids[-1])
+    return True
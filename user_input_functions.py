@@ -2,6 +2,72 @@ import datetime
 import re
 
 
+def validate_date_format(date):
+    '''
+    Checks that a date has the format DD/MM/YYYY, without prompting
+
+    Argument: String (Date)
+    Returns: String (The date, unchanged)
+    Raises: ValueError (with a message for the user) if the date is invalid
+    '''
+    try:
+        datetime.datetime.strptime(date, '%d/%m/%Y')
+    except (TypeError, ValueError):
+        raise ValueError(
+            "--- Sorry, '{}' is not a valid date format. "
+            "Please use DD/MM/YYYY. ---".format(date)
+        )
+    return date
+
+
+def validate_string(text, field='note'):
+    '''
+    Checks that a task_name or note has valid characters, without prompting
+
+    The same rules as get_valid_string() apply: text may not be surrounded by
+    doublequotes and must (for the most part) use normal characters. Empty
+    text becomes 'None'. Spaces are the only whitespace allowed, as a line
+    break (or other control character) would split the log across lines of
+    the work log, which every reader takes to be separate logs.
+
+    Arguments: String (Field text), String (Field 'type' for the message)
+    Returns: String (Field text compatible with csv.DictReader)
+    Raises: ValueError (with a message for the user) if the text is invalid
+    '''
+    if text == '':
+        return 'None'
+    if text[0] == '"' and text[-1] == '"':
+        raise ValueError(
+            "---Sorry! The {} field cannot be surrounded by "
+            "doublequotes. Try again.---".format(field)
+        )
+    if not re.fullmatch(r'[-\w\d .,!\(\);:\'"?]+', text):
+        raise ValueError(
+            "---\nSorry! Invalid characters detected. Please stick to "
+            "using alphanumerics and normal punctuation. Try again!"
+            "---"
+        )
+    return text
+
+
+def validate_time_spent(time_spent):
+    '''
+    Checks that time_spent is a whole number of minutes, without prompting
+
+    Argument: String (Time spent)
+    Returns: String (The time spent, unchanged)
+    Raises: ValueError (with a message for the user) if it isn't a number
+    '''
+    try:
+        int(time_spent)
+    except (TypeError, ValueError):
+        raise ValueError(
+            "--- Sorry, '{}' is not a whole number. "
+            "Please enter a whole number. ---".format(time_spent)
+        )
+    return time_spent
+
+
 def get_valid_date_format():
     '''
     Prompts the user to enter a date with format DD/MM/YYYY
@@ -16,14 +82,9 @@ def get_valid_date_format():
     while True:
         date = input('(DD/MM/YYYY): ')
         try:
-            datetime.datetime.strptime(date, '%d/%m/%Y')
-        except:
-            print(
-                "\n"
-                "--- Sorry, '{}' is not a valid date format. "
-                "Please use DD/MM/YYYY. ---"
-                "\n".format(date)
-            )
+            validate_date_format(date)
+        except ValueError as error:
+            print("\n{}\n".format(error))
         else:
             break
     return date
@@ -43,20 +104,10 @@ def get_valid_string(field):
     '''
     while True:
         text = input('Enter a {} for this log: '.format(field))
-        if text[0] == '"' and text[-1] == '"':
-            print(
-                "\n---Sorry! The note field cannot be surrounded by "
-                "doublequotes. Try again.---\n"
-            )
-        elif not re.match(r'^[-\w\d\s.,!\(\);:\'"?]+$', text):
-            print(
-                "---\nSorry! Invalid characters detected. Please stick to "
-                "using alphanumerics and normal punctuation. Try again!"
-                "---\n"
-            )
-        elif text == '':
-            text = 'None'
-            break
+        try:
+            text = validate_string(text, field)
+        except ValueError as error:
+            print("\n{}\n".format(error))
         else:
             break
     return text
@@ -67,12 +118,9 @@ def get_valid_time_spent():
     while True:
         time_spent = input('Enter time spent in minutes (rounded): ')
         try:
-            int(time_spent)
-        except ValueError:
-            print(
-                "\n--- Sorry, '{}' is not a whole number. "
-                "Please enter a whole number. ---\n".format(time_spent)
-            )
+            validate_time_spent(time_spent)
+        except ValueError as error:
+            print("\n{}\n".format(error))
         else:
             break
     return time_spent
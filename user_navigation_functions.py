@@ -1,5 +1,7 @@
 import os
 
+from instrumentation import timed
+
 
 def confirm_user_action():
     '''
@@ -20,6 +22,7 @@ def confirm_user_action():
         return True
 
 
+@timed('clear_screen')
 def clear_screen():
     """Clears the screen"""
     os.system('cls' if os.name == 'nt' else 'clear')
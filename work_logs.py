@@ -1,8 +1,12 @@
+import threading
+
 from csv_functions import clear_all_logs, initialize_work_log
-from log import Log
-from search import Search
 from user_navigation_functions import clear_screen, menu
 
+# The modules behind each menu option (log, and search with the NumPy and
+# asyncio modules it uses) are only imported once an option needs them, so
+# the main menu appears as soon as the work log is checked.
+
 
 def greet_user():
     '''Greet the user'''
@@ -16,16 +20,41 @@ def goodbye():
     print("Thank you for using the work log program!")
                 
 
+def preload():
+    '''
+    Gets ready for the first search in a background thread, while the user
+    looks at the main menu: imports the search modules and loads the logs
+    (see Storage.preload())
+    '''
+    def run():
+        try:
+            # Importing the search modules takes a while too.
+            import async_search
+            import search
+            from storage import get_storage
+            get_storage().preload()
+        except Exception:
+            # Any problem (e.g. a badly formatted log) is reported when the
+            # user actually searches.
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
 def work_logs_program():
     main_options = {
         '1': 'Log Work',
         '2': 'Search Logs',
-        '3': 'Clear All Logs',
-        '4': 'Quit'
+        '3': 'Reports',
+        '4': 'Clear All Logs',
+        '5': 'Quit'
     }
     # Build the work_log.txt file if non exists
     initialize_work_log()
-    
+
+    # Load the logs while the user chooses what to do.
+    preload()
+
     # Get user's choice from the main menu options
     while True:
         clear_screen()
@@ -33,12 +62,16 @@ def work_logs_program():
         nav = menu(main_options)
 
         if nav == 'Log Work':
+            from log import Log
             new_log = Log()
             new_log.create_new_log()
             
         if nav == 'Search Logs':
             search_log_loop()
             
+        if nav == 'Reports':
+            reports_loop()
+            
         if nav == 'Clear All Logs':
             clear_all_logs()
             
@@ -71,6 +104,7 @@ def search_log_loop():
 
         # Otherwise execute the chosen search option.
         else:
+            from search import Search
             search = Search()
             if nav == 'Search by Date':
                 search.search_by_date()
@@ -90,6 +124,51 @@ def search_log_loop():
             search.detail_view()
 
 
+def reports_loop():
+    # Each report option, and the grouping (date bucket, whether to group
+    # by task too) it shows -- see aggregates.py.
+    report_options = {
+        '1': 'Minutes per Day',
+        '2': 'Minutes per Week',
+        '3': 'Minutes per Month',
+        '4': 'Minutes per Task',
+        '5': 'Minutes per Task per Week',
+        '6': 'Minutes per Task per Month',
+        '7': 'Return to Main Menu'
+    }
+    groupings = {
+        'Minutes per Day': ('day', False),
+        'Minutes per Week': ('week', False),
+        'Minutes per Month': ('month', False),
+        'Minutes per Task': (None, True),
+        'Minutes per Task per Week': ('week', True),
+        'Minutes per Task per Month': ('month', True)
+    }
+    while True:
+        clear_screen()
+
+        # Present the reports menu and get the user's choice.
+        print("Reports Menu")
+        nav = menu(report_options)
+        clear_screen()
+
+        # Break reports loop if return to main menu is chosen.
+        if nav == 'Return to Main Menu':
+            break
+
+        # Otherwise display the chosen report.
+        from aggregates import format_report
+        from storage import get_storage
+        bucket, by_task = groupings[nav]
+        rows = get_storage().report(bucket, by_task)
+        print(nav + "\n")
+        if rows:
+            print('\n'.join(format_report(rows)))
+        else:
+            print("---There are no logs to report on yet.---")
+        input("\nPress any key to return to the Reports Menu.")
+
+
 if __name__ == '__main__':
     greet_user()
     